@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio.
+# Copyright (C) 2016 CERN.
+#
+# Invenio is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+#
+# In applying this license, CERN does not
+# waive the privileges and immunities granted to it by virtue of its status
+# as an Intergovernmental Organization or submit itself to any jurisdiction.
+
+"""Benchmark the memory held by harvested records.
+
+Maps synthetic ListRecords pages of oai_dc records either to sickle records
+or to :class:`invenio_oaiharvester.records.CompactRecord`, keeps all of them
+like :func:`invenio_oaiharvester.api.list_records` does, and reports the
+memory traced by :mod:`tracemalloc` as well as the peak resident size. The
+parsed trees of sickle records are allocated by libxml2, which tracemalloc
+does not see, hence the resident size. Each mode runs in its own process:
+
+.. code-block:: shell
+
+    python benchmarks/benchmark_compact_records.py [records]
+"""
+
+from __future__ import absolute_import, print_function
+
+import resource
+import subprocess
+import sys
+import tracemalloc
+
+from lxml import etree
+from sickle.app import DEFAULT_CLASS_MAP
+
+from invenio_oaiharvester.api import parse_page
+from invenio_oaiharvester.records import COMPACT_CLASS_MAP
+
+PAGE_SIZE = 100
+
+RECORD = (
+    '<record><header><identifier>oai:example.org:{0}</identifier>'
+    '<datestamp>2016-01-18</datestamp><setSpec>physics</setSpec></header>'
+    '<metadata><oai_dc:dc '
+    'xmlns:oai_dc="http://www.openarchives.org/OAI/2.0/oai_dc/" '
+    'xmlns:dc="http://purl.org/dc/elements/1.1/">'
+    '<dc:title>Title of the record {0}</dc:title>'
+    '<dc:creator>Doe, John</dc:creator><dc:creator>Roe, Jane</dc:creator>'
+    '<dc:subject>Physics</dc:subject>'
+    '<dc:description>A short abstract of the record {0}.</dc:description>'
+    '<dc:date>2016-01-18</dc:date>'
+    '<dc:identifier>http://example.org/record/{0}</dc:identifier>'
+    '</oai_dc:dc></metadata></record>'
+)
+
+
+def page(start):
+    """Return a ListRecords page starting at the given record."""
+    return (
+        '<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/">'
+        '<responseDate>2016-01-18T15:34:50Z</responseDate>'
+        '<request verb="ListRecords">http://example.org/oai2</request>'
+        '<ListRecords>{0}</ListRecords></OAI-PMH>'.format(''.join(
+            RECORD.format(number)
+            for number in range(start, start + PAGE_SIZE)
+        ))
+    ).encode('utf-8')
+
+
+def measure(mode, total):
+    """Map and keep ``total`` records, return the traced and peak memory."""
+    class_mapping = COMPACT_CLASS_MAP if mode == 'compact' else \
+        DEFAULT_CLASS_MAP
+    tracemalloc.start()
+    records = []
+    for start in range(0, total, PAGE_SIZE):
+        items, _ = parse_page(
+            etree.fromstring(page(start)), 'ListRecords',
+            class_mapping=class_mapping
+        )
+        records.extend(items)
+    traced, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert len(records) == total
+    return traced, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def main(total=100000):
+    """Measure both representations in separate processes."""
+    results = {}
+    for mode in ('sickle', 'compact'):
+        output = subprocess.check_output(
+            [sys.executable, __file__, str(total), mode]
+        )
+        results[mode] = [int(value) for value in output.split()]
+        print('{0}: {1} records, traced {2:.1f} MiB, max RSS {3:.1f} '
+              'MiB'.format(mode, total, results[mode][0] / 2.0 ** 20,
+                           results[mode][1] / 2.0 ** 10))
+    print('traced x{0:.2f}, max RSS x{1:.2f}'.format(
+        results['sickle'][0] / float(results['compact'][0]),
+        results['sickle'][1] / float(results['compact'][1])
+    ))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 2:
+        print(*measure(sys.argv[2], int(sys.argv[1])))
+    else:
+        main(*[int(value) for value in sys.argv[1:]])
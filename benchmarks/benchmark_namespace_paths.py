@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio.
+# Copyright (C) 2016 CERN.
+#
+# Invenio is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+#
+# In applying this license, CERN does not
+# waive the privileges and immunities granted to it by virtue of its status
+# as an Intergovernmental Organization or submit itself to any jurisdiction.
+
+"""Benchmark the lookups of OAI-PMH elements in parsed records.
+
+Compares the compiled XPath expressions of
+:func:`invenio_oaiharvester.utils.get_namespace_paths` with the previous
+per-call lookups, which built the namespace map and formatted the path on
+each call, on the records of the arXiv samples of ``tests/data``:
+
+.. code-block:: shell
+
+    python benchmarks/benchmark_namespace_paths.py
+"""
+
+from __future__ import absolute_import, print_function
+
+import os
+import timeit
+
+from flask import Flask
+from lxml import etree
+
+from invenio_oaiharvester import InvenioOAIHarvester
+from invenio_oaiharvester.utils import get_namespace_paths, \
+    record_extraction_from_string
+
+DATA = os.path.join(os.path.dirname(__file__), '..', 'tests', 'data')
+
+SAMPLE = 'sample_arxiv_response_listrecords_physics.xml'
+
+
+def legacy_identifier(root, oai_namespace, config):
+    """Previous lookup, preparing the namespace map on each call."""
+    if oai_namespace:
+        nsmap = {
+            'OAI-PMH': oai_namespace
+        }
+    else:
+        nsmap = config.get("OAIHARVESTER_DEFAULT_NAMESPACE_MAP")
+    namespace_prefix = "{{{0}}}".format(oai_namespace)
+    node = root.find(".//{0}identifier".format(namespace_prefix), nsmap)
+    return node.text if node is not None else None
+
+
+def current_identifier(root, oai_namespace):
+    """Lookup with the compiled expressions."""
+    nodes = get_namespace_paths(oai_namespace).identifiers(root)
+    return nodes[0].text if nodes else None
+
+
+def main(number=200):
+    """Time both lookups on every record of the sample."""
+    app = Flask('benchmark')
+    InvenioOAIHarvester(app)
+    oai_namespace = app.config['OAIHARVESTER_DEFAULT_NAMESPACE_MAP']['OAI-PMH']
+
+    with open(os.path.join(DATA, SAMPLE), 'rb') as f:
+        roots = [etree.fromstring(record) for record in
+                 record_extraction_from_string(f.read())]
+
+    with app.app_context():
+        for namespace in (oai_namespace, ''):
+            for root in roots:
+                assert legacy_identifier(root, namespace, app.config) == \
+                    current_identifier(root, namespace)
+
+            legacy_time = timeit.timeit(
+                lambda: [legacy_identifier(root, namespace, app.config)
+                         for root in roots],
+                number=number
+            )
+            current_time = timeit.timeit(
+                lambda: [current_identifier(root, namespace)
+                         for root in roots],
+                number=number
+            )
+            print('namespace {0!r} ({1} records): legacy {2:.2f} ms, '
+                  'current {3:.2f} ms, x{4:.2f}'.format(
+                      namespace, len(roots), 1000 * legacy_time / number,
+                      1000 * current_time / number,
+                      legacy_time / current_time
+                  ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio.
+# Copyright (C) 2016 CERN.
+#
+# Invenio is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+#
+# In applying this license, CERN does not
+# waive the privileges and immunities granted to it by virtue of its status
+# as an Intergovernmental Organization or submit itself to any jurisdiction.
+
+"""Benchmark the splitting of OAI-PMH responses into records.
+
+Compares :func:`invenio_oaiharvester.utils.record_extraction_from_string`
+with the previous implementation, which built a new wrapper and serialized
+the headers again for each record, on the arXiv samples of ``tests/data``:
+
+.. code-block:: shell
+
+    python benchmarks/benchmark_record_extraction.py
+"""
+
+from __future__ import absolute_import, print_function
+
+import os
+import timeit
+
+from lxml import etree
+
+from invenio_oaiharvester.utils import record_extraction_from_string
+
+DATA = os.path.join(os.path.dirname(__file__), '..', 'tests', 'data')
+
+SAMPLES = (
+    'sample_arxiv_response_listrecords_physics.xml',
+    'sample_arxiv_response_listrecords_cs.xml',
+    'sample_arxiv_response_with_namespace.xml',
+)
+
+
+def legacy_record_extraction_from_string(
+        xml_string,
+        oai_namespace="http://www.openarchives.org/OAI/2.0/"):
+    """Previous implementation, building one wrapper per record."""
+    nsmap = {'OAI-PMH': oai_namespace}
+    namespace_prefix = "{{{0}}}".format(oai_namespace)
+    root = etree.fromstring(xml_string)
+    headers = []
+    headers.extend(
+        root.findall(".//{0}responseDate".format(namespace_prefix), nsmap)
+    )
+    headers.extend(
+        root.findall(".//{0}request".format(namespace_prefix), nsmap)
+    )
+    records = root.findall(".//{0}record".format(namespace_prefix), nsmap)
+
+    list_of_records = []
+    for record in records:
+        wrapper = etree.Element("OAI-PMH", nsmap=nsmap)
+        for header in headers:
+            wrapper.append(header)
+        wrapper.append(record)
+        list_of_records.append(etree.tostring(wrapper))
+    return list_of_records
+
+
+def main(number=50):
+    """Time both implementations on each sample."""
+    for sample in SAMPLES:
+        with open(os.path.join(DATA, sample), 'rb') as f:
+            xml_string = f.read()
+        legacy = legacy_record_extraction_from_string(xml_string)
+        assert record_extraction_from_string(xml_string) == legacy
+
+        legacy_time = timeit.timeit(
+            lambda: legacy_record_extraction_from_string(xml_string),
+            number=number
+        )
+        current_time = timeit.timeit(
+            lambda: record_extraction_from_string(xml_string),
+            number=number
+        )
+        print('{0} ({1} records): legacy {2:.2f} ms, current {3:.2f} ms, '
+              'x{4:.2f}'.format(
+                  sample, len(legacy), 1000 * legacy_time / number,
+                  1000 * current_time / number, legacy_time / current_time
+              ))
+
+
+if __name__ == '__main__':
+    main()
@@ -47,6 +47,13 @@ its easy:
 Note the directory ``-d`` parameter that specifies a directory to save
 harvested XML files.
 
+To only list the identifiers of the records, without their metadata:
+
+.. code-block:: shell
+
+    youroverlay oaiharvester identifiers -u http://export.arxiv.org/oai2 \
+        -s physics -o identifiers.txt.gz
+
 
 Integration with your application
 =================================
@@ -77,15 +84,25 @@ This information is also available when scheduling and running tasks:
 
 Here we are using the `-n, --name` parameter to specify which configured
 OAI-PMH source to query, using the ``name`` property.
+
+When the ``deltaharvest`` property of a source is set, its harvests first list
+the identifiers of the records and only fetch the ones which are new or whose
+datestamp changed since they were last harvested. The ``--skip-unchanged`` and
+``--checkpoint`` options cannot be used by such harvests.
 """
 
 from __future__ import absolute_import, print_function
 
-from .api import get_records, list_records
+from .api import get_records, iter_records, iter_records_delta, \
+    list_identifiers, list_records, list_records_delta
 from .ext import InvenioOAIHarvester
 from .version import __version__
 
 __all__ = ('__version__',
            'InvenioOAIHarvester',
            'get_records',
-           'list_records')
+           'iter_records',
+           'iter_records_delta',
+           'list_identifiers',
+           'list_records',
+           'list_records_delta')
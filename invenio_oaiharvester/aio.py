@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio.
+# Copyright (C) 2016 CERN.
+#
+# Invenio is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+#
+# In applying this license, CERN does not
+# waive the privileges and immunities granted to it by virtue of its status
+# as an Intergovernmental Organization or submit itself to any jurisdiction.
+
+"""Asynchronous harvesting of OAI-PMH repositories.
+
+The async generators of this module follow the semantics of
+:func:`invenio_oaiharvester.api.list_records` and
+:func:`invenio_oaiharvester.api.get_records`, on top of ``aiohttp``, so that
+a single event loop can harvest many endpoints at the same time. They
+require Python 3.6+ and the ``aio`` extra:
+
+.. code-block:: shell
+
+    pip install invenio-oaiharvester[aio]
+
+.. code-block:: python
+
+    from invenio_oaiharvester.aio import alist_records
+
+    async def harvest(name):
+        async for record in alist_records(name=name):
+            print(record.raw)
+
+An application context is required, as for the synchronous API. The
+database is only accessed from the default executor, in a new application
+context, so that the event loop is never blocked by it.
+"""
+
+import asyncio
+from collections import deque
+
+from aiohttp import ClientError, ClientSession, ClientTimeout
+from flask import current_app
+from lxml import etree
+from sickle.oaiexceptions import IdDoesNotExist, NoRecordsMatch
+from sickle.response import XMLParser
+
+from .api import OAI_ERRORS, Watermark, _prepare_list_records, \
+    _save_set_lastrun, get_info_by_oai_name, parse_page, update_lastrun
+from .errors import NameOrUrlMissing
+from .utils import get_oaiharvest_object
+
+
+async def alist_records(metadata_prefix=None, from_date=None,
+                        until_date=None, url=None, name=None, setspecs=None,
+                        session=None):
+    """Harvest multiple records from an OAI repo asynchronously.
+
+    The records are yielded page by page, and the ones which are part of
+    several sets only once. The ``lastrun`` of the OAIHarvestConfig is
+    updated once the generator is exhausted, to the time of the server when
+    the harvest started. The granularity of the dates is not requested with
+    Identify, and defaults to days until a synchronous harvest has read it.
+    As with :func:`~invenio_oaiharvester.api.iter_records`, every set starts
+    from its own 'lastrun', and a failing set does not stop the other ones.
+
+    :param metadata_prefix: The prefix for the metadata return
+                            (defaults to 'oai_dc').
+    :param from_date: The lower bound date for the harvesting (optional).
+    :param until_date: The upper bound date for the harvesting (optional).
+    :param url: The The url to be used to create the endpoint.
+    :param name: The name of the OAIHarvestConfig to use instead of passing
+                 specific parameters.
+    :param setspecs: The 'set' criteria for the harvesting (optional).
+    :param session: The ``aiohttp.ClientSession`` to use (optional).
+    :return: async generator of harvested records
+    """
+    url, queries, watermark = await _run_sync(
+        _prepare_list_records, metadata_prefix, from_date, until_date, url,
+        name, setspecs, identify=False
+    )
+    config_id = None
+    if name is not None and watermark is not None:
+        config_id = await _run_sync(_config_id, name)
+    failures = []
+    async with _Session(session) as session:
+        # Only keep the identifiers to return the same record once
+        # (e.g. if it is part of several sets)
+        seen = set()
+        for params in queries:
+            set_watermark = None
+            if watermark is not None:
+                set_watermark = Watermark(parent=watermark)
+            try:
+                async for records, _ in alist_pages(session, url, params,
+                                                    watermark=set_watermark):
+                    for record in records:
+                        identifier = record.header.identifier
+                        if identifier not in seen:
+                            seen.add(identifier)
+                            if set_watermark is not None:
+                                set_watermark.add_datestamp(
+                                    record.header.datestamp
+                                )
+                            yield record
+            except NoRecordsMatch:
+                pass
+            except Exception as e:
+                failures.append(e)
+                continue
+            if config_id is not None and set_watermark.value is not None:
+                await _run_sync(_save_set_lastrun, config_id, params,
+                                set_watermark.value)
+
+    if failures:
+        raise failures[0]
+    if name is not None and watermark is not None and \
+            watermark.value is not None:
+        await _run_sync(update_lastrun, name, watermark.value)
+
+
+async def aget_records(identifiers, metadata_prefix=None, url=None,
+                       name=None, session=None, concurrency=None,
+                       errors=None):
+    """Harvest specific records from an OAI repo asynchronously.
+
+    The records are yielded in the order of the identifiers, while up to
+    ``concurrency`` of them are being fetched. If ``errors`` is given, the
+    records which could not be fetched are skipped and their exception is
+    stored in it by identifier, instead of being raised.
+
+    :param identifiers: list of unique identifiers for records to be harvested.
+    :param metadata_prefix: The prefix for the metadata return
+                            (defaults to 'oai_dc').
+    :param url: The The url to be used to create the endpoint.
+    :param name: The name of the OAIHarvestConfig to use instead of passing
+                 specific parameters.
+    :param session: The ``aiohttp.ClientSession`` to use (optional).
+    :param concurrency: Number of records fetched at the same time (defaults
+                        to ``OAIHARVESTER_GET_RECORD_CONCURRENCY``).
+    :param errors: dict collecting the errors by identifier (optional).
+    :return: async generator of harvested records
+    """
+    if name:
+        url, _metadata_prefix, _, __ = await _run_sync(
+            get_info_by_oai_name, name
+        )
+        if metadata_prefix is None:
+            metadata_prefix = _metadata_prefix
+    elif not url:
+        raise NameOrUrlMissing(
+            "Retry using the parameters -n <name> or -u <url>."
+        )
+    if concurrency is None:
+        concurrency = current_app.config['OAIHARVESTER_GET_RECORD_CONCURRENCY']
+
+    async with _Session(session) as session:
+        async def get_record(identifier):
+            params = {
+                'verb': 'GetRecord',
+                'identifier': identifier,
+                'metadataPrefix': metadata_prefix or "oai_dc"
+            }
+            try:
+                records, _ = await aharvest_page(session, url, params)
+                if not records:
+                    raise IdDoesNotExist('No record in the response.')
+                return records[0]
+            except OAI_ERRORS + (ClientError,) as e:
+                if errors is None:
+                    raise
+                errors[identifier] = e
+
+        pending = deque()
+        try:
+            for identifier in identifiers:
+                pending.append(asyncio.ensure_future(get_record(identifier)))
+                if len(pending) >= max(concurrency, 1):
+                    record = await pending.popleft()
+                    if record is not None:
+                        yield record
+            while pending:
+                record = await pending.popleft()
+                if record is not None:
+                    yield record
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+async def alist_pages(session, url, params, resumption_token=None,
+                      watermark=None):
+    """Follow the resumption tokens of an OAI-PMH list request.
+
+    :param session: The ``aiohttp.ClientSession`` to use.
+    :param url: The url of the endpoint.
+    :param params: The OAI-PMH parameters, including the ``verb``.
+    :param resumption_token: Resume the list from this token (optional).
+    :param watermark: The :class:`~.api.Watermark` reading the date of the
+                      responses (optional).
+    :return: async generator of (list of items, ResumptionToken or None)
+    """
+    verb = params['verb']
+    while True:
+        if resumption_token:
+            params = {'verb': verb, 'resumptionToken': resumption_token}
+        items, token = await aharvest_page(session, url, params, watermark)
+        yield items, token
+        resumption_token = token.token if token is not None else None
+        if not resumption_token:
+            return
+
+
+async def aharvest_page(session, url, params, watermark=None):
+    """Issue a single OAI-PMH request and map the items of the response.
+
+    The response is parsed in the default executor, so that large pages do
+    not block the event loop.
+
+    :param session: The ``aiohttp.ClientSession`` to use.
+    :param url: The url of the endpoint.
+    :param params: The OAI-PMH parameters, including the ``verb``.
+    :param watermark: The :class:`~.api.Watermark` reading the date of the
+                      response (optional).
+    :return: list of items, ResumptionToken or None
+    """
+    query = dict((k, v) for k, v in params.items() if v is not None)
+    async with session.get(url, params=query) as response:
+        response.raise_for_status()
+        content = await response.read()
+    if watermark is not None:
+        watermark.add_response(content)
+    return await asyncio.get_event_loop().run_in_executor(
+        None, _parse_content, content, params['verb']
+    )
+
+
+async def _run_sync(func, *args, **kwargs):
+    """Call a blocking function in the default executor.
+
+    It runs in a new context of the current application, so that it can use
+    the database.
+    """
+    app = current_app._get_current_object()
+
+    def call():
+        with app.app_context():
+            return func(*args, **kwargs)
+    return await asyncio.get_event_loop().run_in_executor(None, call)
+
+
+def _config_id(name):
+    """Return the id of an OAIHarvestConfig."""
+    return get_oaiharvest_object(name).id
+
+
+def _parse_content(content, verb):
+    """Parse an OAI-PMH response and map its items."""
+    return parse_page(etree.XML(content, parser=XMLParser), verb)
+
+
+class _Session(object):
+    """Use the given session, or a new one closed on exit."""
+
+    def __init__(self, session=None):
+        self.session = session
+        self.owned = session is None
+
+    async def __aenter__(self):
+        if self.owned:
+            self.session = ClientSession(timeout=_timeout())
+        return self.session
+
+    async def __aexit__(self, *exc_info):
+        if self.owned:
+            await self.session.close()
+
+
+def _timeout():
+    """Return the ``aiohttp`` timeout from OAIHARVESTER_HTTP_TIMEOUT."""
+    timeout = current_app.config['OAIHARVESTER_HTTP_TIMEOUT']
+    if isinstance(timeout, (list, tuple)):
+        return ClientTimeout(sock_connect=timeout[0], sock_read=timeout[1])
+    return ClientTimeout(sock_connect=timeout, sock_read=timeout)
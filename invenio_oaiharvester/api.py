@@ -34,18 +34,80 @@ API:
 
 from __future__ import absolute_import, print_function
 
+import codecs
 import datetime
+import hashlib
+import itertools
+import logging
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
+from flask import current_app
 from invenio_db import db
-from sickle import Sickle
-from sickle.oaiexceptions import NoRecordsMatch
+from lxml import etree
+from requests import RequestException
+from sickle import oaiexceptions
+from sickle.app import DEFAULT_CLASS_MAP
+from sickle.iterator import VERBS_ELEMENTS
+from sickle.models import ResumptionToken
+from sickle.oaiexceptions import BadResumptionToken, IdDoesNotExist, \
+    NoRecordsMatch
+from sickle.response import XMLParser
 
+from .client import get_client
 from .errors import NameOrUrlMissing, WrongDateCombination
-from .utils import get_oaiharvest_object
+from .models import OAIHarvestCheckpoint, OAIHarvestRecordState, \
+    OAIHarvestSetLastrun
+from .records import COMPACT_CLASS_MAP, RAW_CLASS_MAP, CompactHeader, RawRecord
+from .signals import oaiharvest_batch, oaiharvest_finished
+from .utils import chunks, date_windows, get_oaiharvest_object, \
+    header_extraction_from_string, iter_prefetched, iter_threaded, \
+    scan_headers
+
+logger = logging.getLogger(__name__)
+
+OAI_NAMESPACE = '{http://www.openarchives.org/OAI/2.0/}'
+
+GRANULARITY_DAY = 'YYYY-MM-DD'
+GRANULARITY_SECONDS = 'YYYY-MM-DDThh:mm:ssZ'
+DATE_FORMATS = {
+    GRANULARITY_DAY: '%Y-%m-%d',
+    GRANULARITY_SECONDS: '%Y-%m-%dT%H:%M:%SZ',
+}
+
+RAW_ROOT = re.compile(br'<(?:[\w.-]+:)?OAI-PMH(\s[^>]*)?>')
+RAW_ENCODING = re.compile(
+    br'\s*<\?xml\s[^>]*?encoding\s*=\s*["\']([\w.:-]+)["\']'
+)
+RAW_ENCODINGS = (b'utf-8', b'utf8', b'us-ascii', b'ascii')
+RAW_DECLARATION = re.compile(
+    br'\s(xmlns(?::[\w.-]+)?)\s*=\s*(?:"[^"]*"|\'[^\']*\')'
+)
+RAW_ERROR = re.compile(
+    br'<(?:[\w.-]+:)?error(\s[^>]*)?>(.*?)</(?:[\w.-]+:)?error\s*>', re.DOTALL
+)
+RAW_TOKEN = re.compile(
+    br'<(?:[\w.-]+:)?resumptionToken(\s[^>]*?)?'
+    br'(?:/>|>([^<]*)</(?:[\w.-]+:)?resumptionToken\s*>)'
+)
+RAW_ATTRIBUTE = re.compile(br'([\w.:-]+)\s*=\s*(?:"([^"]*)"|\'([^\']*)\')')
+RAW_RESPONSE_DATE = re.compile(
+    br'<(?:[\w.-]+:)?responseDate\s*>\s*([^<\s]*)\s*<'
+)
+
+# The exceptions raised for the OAI-PMH errors of a response. The ones of
+# the error codes do not derive from OAIError in all versions of sickle.
+OAI_ERRORS = tuple(
+    error for error in vars(oaiexceptions).values()
+    if isinstance(error, type) and issubclass(error, Exception)
+)
 
 
 def list_records(metadata_prefix=None, from_date=None, until_date=None,
-                 url=None, name=None, setspecs=None, encoding=None):
+                 url=None, name=None, setspecs=None, encoding=None,
+                 set_concurrency=None, prefetch=None, compact=False,
+                 raw=False, skip_unchanged=False, checkpoint=None):
     """Harvest multiple records from an OAI repo.
 
     :param metadata_prefix: The prefix for the metadata return
@@ -58,25 +120,205 @@ def list_records(metadata_prefix=None, from_date=None, until_date=None,
     :param setspecs: The 'set' criteria for the harvesting (optional).
     :param encoding: Override the encoding returned by the server. ISO-8859-1
                      if it is not provided by the server.
+    :param set_concurrency: Number of sets harvested at the same time
+                            (defaults to ``OAIHARVESTER_SET_CONCURRENCY``).
+    :param prefetch: Max number of pages fetched ahead of the processing
+                     (defaults to ``OAIHARVESTER_PREFETCH_DEPTH``).
+    :param compact: Return :class:`~.records.CompactRecord` objects instead
+                    of sickle records.
+    :param raw: Return :class:`~.records.RawRecord` objects read from the
+                bytes of the responses, which are never parsed.
+    :param skip_unchanged: Leave out the records whose content did not change
+                           since they were last harvested (requires ``name``).
+    :param checkpoint: Store the progress of the harvest to resume it
+                       (requires ``name``, defaults to
+                       ``OAIHARVESTER_CHECKPOINT``).
     :return: request object, list of harvested records
     """
+    request, records = iter_records(
+        metadata_prefix, from_date, until_date, url, name, setspecs, encoding,
+        set_concurrency=set_concurrency, prefetch=prefetch, compact=compact,
+        raw=raw, skip_unchanged=skip_unchanged, checkpoint=checkpoint
+    )
+    return request, list(records)
+
+
+def iter_records(metadata_prefix=None, from_date=None, until_date=None,
+                 url=None, name=None, setspecs=None, encoding=None,
+                 set_concurrency=None, prefetch=None, compact=False,
+                 raw=False, skip_unchanged=False, checkpoint=None):
+    """Harvest multiple records from an OAI repo as a stream.
+
+    Works like :func:`list_records`, but the records are yielded page by page
+    while the resumption tokens are followed, so only the current page is kept
+    in memory. Records which are part of several sets are yielded only once.
+    The ``lastrun`` of the OAIHarvestConfig is updated once the generator is
+    exhausted, to the time of the server when the harvest started (see
+    :class:`Watermark`).
+
+    Every set is harvested from its own 'lastrun', which is stored as soon as
+    all its records have been yielded. If a set fails, the other ones are
+    still harvested, and the error is raised at the end: only the failed sets
+    are harvested again from their previous 'lastrun' by the next harvest.
+
+    With ``checkpoint``, the resumption token of every page is stored once
+    its records have been consumed, so that an interrupted harvest of the same
+    OAIHarvestConfig, sets and dates resumes from the last committed page. It
+    restarts from scratch if the server rejects the stored token. The first
+    ``responseDate`` of a set is stored as well, so that the 'lastrun' of a
+    resumed harvest is still the time at which it started.
+
+    With ``prefetch``, the next pages are fetched and parsed in a background
+    thread while the current one is processed. The number of pages fetched
+    ahead adapts to the latency of the server, up to ``prefetch``.
+
+    With ``skip_unchanged``, a hash of the content of every record is stored
+    per OAIHarvestConfig, and the records whose hash did not change since
+    they were last harvested are left out. The states are looked up and
+    stored page by page, once the records of a page have been consumed, and
+    before the 'lastrun' of the page's set is stored.
+
+    :param metadata_prefix: The prefix for the metadata return
+                            (defaults to 'oai_dc').
+    :param from_date: The lower bound date for the harvesting (optional).
+    :param until_date: The upper bound date for the harvesting (optional).
+    :param url: The The url to be used to create the endpoint.
+    :param name: The name of the OAIHarvestConfig to use instead of passing
+                 specific parameters.
+    :param setspecs: The 'set' criteria for the harvesting (optional).
+    :param encoding: Override the encoding returned by the server. ISO-8859-1
+                     if it is not provided by the server.
+    :param set_concurrency: Number of sets harvested at the same time
+                            (defaults to ``OAIHARVESTER_SET_CONCURRENCY``).
+    :param prefetch: Max number of pages fetched ahead of the processing
+                     (defaults to ``OAIHARVESTER_PREFETCH_DEPTH``).
+    :param compact: Yield :class:`~.records.CompactRecord` objects instead
+                    of sickle records.
+    :param raw: Yield :class:`~.records.RawRecord` objects read from the
+                bytes of the responses, which are never parsed.
+    :param skip_unchanged: Leave out the records whose content did not change
+                           since they were last harvested (requires ``name``).
+    :param checkpoint: Store the progress of the harvest to resume it
+                       (requires ``name``, defaults to
+                       ``OAIHARVESTER_CHECKPOINT``).
+    :return: request object, generator of harvested records
+    """
+    url, queries, watermark = _prepare_list_records(
+        metadata_prefix, from_date, until_date, url, name, setspecs
+    )
+    request = get_client(url, encoding)
+
+    if set_concurrency is None:
+        set_concurrency = current_app.config['OAIHARVESTER_SET_CONCURRENCY']
+    if prefetch is None:
+        prefetch = current_app.config['OAIHARVESTER_PREFETCH_DEPTH']
+    if checkpoint is None:
+        checkpoint = current_app.config['OAIHARVESTER_CHECKPOINT']
+    if skip_unchanged and name is None:
+        raise NameOrUrlMissing(
+            "A name is required to skip the unchanged records."
+        )
+
+    records = _iter_records(
+        request, queries, name, watermark,
+        set_concurrency=set_concurrency, checkpoint=checkpoint,
+        prefetch=prefetch,
+        class_mapping=COMPACT_CLASS_MAP if compact else None, raw=raw,
+        skip_unchanged=skip_unchanged
+    )
+    return request, records
+
+
+def list_identifiers(metadata_prefix=None, from_date=None, until_date=None,
+                     url=None, name=None, setspecs=None, encoding=None,
+                     set_concurrency=None, prefetch=None, raw=False,
+                     incremental=False):
+    """List the headers of the records of an OAI repo as a stream.
+
+    Works like :func:`iter_records` with ListIdentifiers requests, which do
+    not transfer the metadata of the records. Headers of records which are
+    part of several sets are yielded only once. The ``lastrun`` of the
+    OAIHarvestConfig is neither used, unless ``incremental`` is given, nor
+    updated.
+
+    :param metadata_prefix: The prefix for the metadata return
+                            (defaults to 'oai_dc').
+    :param from_date: The lower bound date for the harvesting (optional).
+    :param until_date: The upper bound date for the harvesting (optional).
+    :param url: The The url to be used to create the endpoint.
+    :param name: The name of the OAIHarvestConfig to use instead of passing
+                 specific parameters.
+    :param setspecs: The 'set' criteria for the harvesting (optional).
+    :param encoding: Override the encoding returned by the server. ISO-8859-1
+                     if it is not provided by the server.
+    :param set_concurrency: Number of sets listed at the same time
+                            (defaults to ``OAIHARVESTER_SET_CONCURRENCY``).
+    :param prefetch: Max number of pages fetched ahead of the processing
+                     (defaults to ``OAIHARVESTER_PREFETCH_DEPTH``).
+    :param raw: Read the headers from the bytes of the responses, which are
+                never parsed.
+    :param incremental: Without ``from_date``, start from the 'lastrun' of
+                        the OAIHarvestConfig and of its sets.
+    :return: request object, generator of
+             :class:`~.records.CompactHeader`
+    """
+    url, queries, _ = _prepare_list_records(
+        metadata_prefix, from_date, until_date, url, name, setspecs,
+        incremental=incremental
+    )
+    request = get_client(url, encoding)
+
+    if set_concurrency is None:
+        set_concurrency = current_app.config['OAIHARVESTER_SET_CONCURRENCY']
+    if prefetch is None:
+        prefetch = current_app.config['OAIHARVESTER_PREFETCH_DEPTH']
+
+    headers = _iter_records(
+        request, [dict(params, verb='ListIdentifiers') for params in queries],
+        set_concurrency=set_concurrency, prefetch=prefetch,
+        class_mapping=COMPACT_CLASS_MAP, raw=raw
+    )
+    return request, headers
+
+
+def _prepare_list_records(metadata_prefix, from_date, until_date, url, name,
+                          setspecs, identify=True, incremental=True):
+    """Resolve the arguments of a ListRecords harvest.
+
+    When the harvest starts from the 'lastrun' of the OAIHarvestConfig, it is
+    given with the granularity of the endpoint (see :func:`get_granularity`).
+
+    :param identify: Read the granularity of the endpoint with an Identify
+                     request if it is not known yet.
+    :param incremental: Without ``from_date``, start from the 'lastrun' of
+                        the OAIHarvestConfig and of its sets, and update it.
+    :return: url, list of OAI-PMH parameters (one per set), the
+             :class:`Watermark` of the harvest or None if the 'lastrun' of the
+             OAIHarvestConfig should not be updated
+    """
     lastrun = None
+    incremental = bool(incremental and name and from_date is None)
     if name:
-        url, _metadata_prefix, lastrun, _setspecs = get_info_by_oai_name(name)
+        config = get_oaiharvest_object(name)
+        url = config.baseurl
 
         # In case we provide a prefix, we don't want it to be
         # overwritten by the one we get from the name variable.
         if metadata_prefix is None:
-            metadata_prefix = _metadata_prefix
+            metadata_prefix = config.metadataprefix
         if setspecs is None:
-            setspecs = _setspecs
+            setspecs = config.setspecs
+        if incremental:
+            # Both dates must have the same granularity.
+            granularity = GRANULARITY_DAY
+            if until_date is None or 'T' in until_date:
+                granularity = get_granularity(config, identify)
+            lastrun = config.lastrun.strftime(DATE_FORMATS[granularity])
     elif not url:
         raise NameOrUrlMissing(
             "Retry using the parameters -n <name> or -u <url>."
         )
 
-    request = Sickle(url, encoding=encoding)
-
     # By convention, when we have a url we have no lastrun, and when we use
     # the name we can either have from_date (if provided) or lastrun.
     dates = {
@@ -85,41 +327,923 @@ def list_records(metadata_prefix=None, from_date=None, until_date=None,
     }
 
     # Sanity check
-    if (dates['until'] is not None) and (dates['from'] > dates['until']):
+    if dates['from'] is not None and dates['until'] is not None and \
+            dates['from'] > dates['until']:
         raise WrongDateCombination("'Until' date larger than 'from' date.")
 
-    lastrun_date = datetime.datetime.now()
+    queries = _list_queries(metadata_prefix, setspecs, dates)
+    if incremental:
+        _apply_set_lastruns(config.id, queries, DATE_FORMATS[granularity])
 
-    # Use a dict to only return the same record once
-    # (e.g. if it is part of several sets)
-    records = {}
-    setspecs = setspecs.split() or [None]
-    for spec in setspecs:
+    # Update lastrun?
+    watermark = None
+    if incremental and until_date is None:
+        watermark = Watermark()
+    return url, queries, watermark
+
+
+def _apply_set_lastruns(config_id, queries, date_format):
+    """Start the requests of the sets from their own 'lastrun', if any.
+
+    :param config_id: The id of the OAIHarvestConfig.
+    :param queries: list of OAI-PMH parameters, one per set.
+    :param date_format: The format of the dates sent to the endpoint.
+    """
+    lastruns = dict(
+        (row.setspec, row.lastrun) for row in
+        OAIHarvestSetLastrun.query.filter_by(config_id=config_id)
+    )
+    for params in queries:
+        lastrun = lastruns.get(params.get('set') or '')
+        if lastrun is not None:
+            params['from'] = lastrun.strftime(date_format)
+
+
+def _save_set_lastrun(config_id, params, lastrun):
+    """Store the 'lastrun' of a set once it has been harvested.
+
+    :param config_id: The id of the OAIHarvestConfig.
+    :param params: The OAI-PMH parameters of the first request of the set.
+    :param lastrun: The new 'lastrun' of the set.
+    """
+    key = {'config_id': config_id, 'setspec': params.get('set') or ''}
+    row = OAIHarvestSetLastrun.query.filter_by(**key).first()
+    if row is None:
+        row = OAIHarvestSetLastrun(**key)
+        db.session.add(row)
+    row.lastrun = lastrun
+    db.session.commit()
+
+
+def get_granularity(config, identify=True):
+    """Return the datestamp granularity of the endpoint of an OAIHarvestConfig.
+
+    It is read with an Identify request the first time, and stored in the
+    ``granularity`` of the OAIHarvestConfig.
+
+    :param config: The OAIHarvestConfig object.
+    :param identify: Send the Identify request if the granularity is not
+                     known yet, instead of assuming days.
+    :return: ``GRANULARITY_DAY`` or ``GRANULARITY_SECONDS``
+    """
+    if config.granularity is None and identify:
+        try:
+            config.granularity = identify_granularity(
+                get_client(config.baseurl)
+            )
+        except (RequestException, etree.XMLSyntaxError):
+            logger.warning("Cannot read the granularity of %s",
+                           config.baseurl, exc_info=True)
+            return GRANULARITY_DAY
+        config.save()
+        db.session.commit()
+    return config.granularity or GRANULARITY_DAY
+
+
+def identify_granularity(request):
+    """Read the datestamp granularity of an endpoint with an Identify request.
+
+    :param request: The Sickle object used to issue the request.
+    :return: ``GRANULARITY_SECONDS`` if the endpoint supports it, otherwise
+             ``GRANULARITY_DAY``
+    """
+    xml = request.harvest(verb='Identify').xml
+    granularity = xml.findtext('.//' + request.oai_namespace + 'granularity')
+    if (granularity or '').strip() == GRANULARITY_SECONDS:
+        return GRANULARITY_SECONDS
+    return GRANULARITY_DAY
+
+
+class Watermark(object):
+    """New 'lastrun' of a harvest, read from the responses of the server.
+
+    It is the earliest ``responseDate`` of the responses, which is the time
+    of the server when the harvest started, so that the records changed while
+    it runs are harvested again by the next one. If the responses have no
+    valid date, the latest datestamp of the records is used instead.
+
+    :param parent: The watermark of the whole harvest, which also receives
+                   the dates given to the watermark of a set (optional).
+    """
+
+    def __init__(self, parent=None):
+        """Initialize the watermark."""
+        self.parent = parent
+        self.response_date = None
+        self.datestamp = None
+        self._lock = threading.Lock()
+
+    def add_response(self, content):
+        """Read the ``responseDate`` of the bytes of a response."""
+        match = RAW_RESPONSE_DATE.search(content)
+        date = _parse_date(match.group(1)) if match else None
+        if date is not None:
+            self._add_response_date(date)
+
+    def _add_response_date(self, date):
+        with self._lock:
+            if self.response_date is None or date < self.response_date:
+                self.response_date = date
+        if self.parent is not None:
+            self.parent._add_response_date(date)
+
+    def add_datestamp(self, datestamp):
+        """Take the datestamp of a harvested record into account."""
+        if datestamp and (self.datestamp is None or
+                          datestamp > self.datestamp):
+            self.datestamp = datestamp
+        if self.parent is not None:
+            self.parent.add_datestamp(datestamp)
+
+    @property
+    def value(self):
+        """Return the new 'lastrun', in UTC, or None if it is unknown."""
+        if self.response_date is not None:
+            return self.response_date
+        if self.datestamp is not None:
+            return _parse_date(self.datestamp)
+
+
+def _parse_date(value):
+    """Parse an OAI-PMH UTC date, with a granularity of days or seconds."""
+    if isinstance(value, bytes):
+        value = value.decode('ascii', 'replace')
+    try:
+        if len(value) > 10:
+            return datetime.datetime.strptime(value[:19], '%Y-%m-%dT%H:%M:%S')
+        return datetime.datetime.strptime(value, '%Y-%m-%d')
+    except ValueError:
+        return None
+
+
+def _list_queries(metadata_prefix, setspecs, dates):
+    """Build the parameters of the ListRecords requests, one per set.
+
+    :param metadata_prefix: The prefix for the metadata return
+                            (defaults to 'oai_dc').
+    :param setspecs: The 'set' criteria for the harvesting (optional).
+    :param dates: dict with the 'from' and 'until' dates.
+    :return: list of OAI-PMH parameters
+    """
+    queries = []
+    for spec in (setspecs or '').split() or [None]:
         params = {
+            'verb': 'ListRecords',
             'metadataPrefix': metadata_prefix or "oai_dc"
         }
         params.update(dates)
         if spec:
             params['set'] = spec
+        queries.append(params)
+    return queries
+
+
+def _iter_records(request, queries, name=None, watermark=None,
+                  set_concurrency=1, checkpoint=False, prefetch=0,
+                  class_mapping=None, raw=False, skip_unchanged=False):
+    """Yield the records of several ListRecords requests only once.
+
+    :param request: The Sickle object used to issue the requests.
+    :param queries: list of OAI-PMH parameters, one per set.
+    :param name: The name of the OAIHarvestConfig (optional).
+    :param watermark: The :class:`Watermark` of the harvest, which becomes
+                      the 'lastrun' of the OAIHarvestConfig once all records
+                      have been yielded (optional). With ``name``, the
+                      'lastrun' of every set is stored once its records have
+                      been yielded.
+    :param set_concurrency: Number of sets harvested at the same time.
+    :param checkpoint: Store the progress of the harvest to resume it.
+    :param prefetch: Max number of pages fetched ahead of the processing.
+    :param class_mapping: The classes mapping the records (defaults to the
+                          one of ``request``).
+    :param raw: Read the records from the bytes of the responses.
+    :param skip_unchanged: Leave out the records whose content did not change
+                           since they were last harvested (requires ``name``).
+    """
+    config_id = None
+    if name is not None and \
+            (checkpoint or skip_unchanged or watermark is not None):
+        config_id = get_oaiharvest_object(name).id
+    # The watermarks of the sets, stored once they are complete.
+    set_watermarks = {}
+    if watermark is not None:
+        for params in queries:
+            set_watermarks[id(params)] = Watermark(parent=watermark)
+
+    processed = {}
+    tokens = [None] * len(queries)
+    if checkpoint and config_id is not None:
+        for index, params in enumerate(queries):
+            saved = OAIHarvestCheckpoint.query.filter_by(
+                **_checkpoint_key(config_id, params)
+            ).first()
+            if saved is not None:
+                tokens[index] = saved.resumption_token
+                processed[id(params)] = saved.records_processed
+                if saved.response_date is not None and \
+                        id(params) in set_watermarks:
+                    set_watermarks[id(params)]._add_response_date(
+                        saved.response_date
+                    )
+
+    # A failing set does not stop the other ones.
+    failures = []
+    pages = [_catch_failure(_list_set_pages(
+        request, params, token, class_mapping, raw,
+        set_watermarks.get(id(params))
+    ), failures) for params, token in zip(queries, tokens)]
+    if set_concurrency > 1 and len(pages) > 1:
+        pages = iter_threaded(pages, workers=set_concurrency,
+                              maxsize=max(set_concurrency, prefetch))
+    else:
+        pages = itertools.chain.from_iterable(pages)
+        if prefetch > 0:
+            pages = iter_prefetched(pages, prefetch)
+
+    # Only keep the identifiers to return the same record once
+    # (e.g. if it is part of several sets)
+    seen = set()
+    for params, records, token in pages:
+        if records is None:
+            # The stored resumption token was rejected.
+            processed[id(params)] = 0
+            continue
+        set_watermark = set_watermarks.get(id(params))
+        new = []
+        for record in records:
+            identifier = record.header.identifier
+            if identifier not in seen:
+                seen.add(identifier)
+                if set_watermark is not None:
+                    set_watermark.add_datestamp(record.header.datestamp)
+                new.append(record)
+        if skip_unchanged and config_id is not None:
+            states, changed = _changed_records(config_id, new)
+            new = [record for record, _ in changed]
+        for record in new:
+            yield record
+        if skip_unchanged and config_id is not None:
+            _save_record_states(config_id, states, changed)
+        if checkpoint and config_id is not None:
+            processed[id(params)] = processed.get(id(params), 0) + len(records)
+            _save_checkpoint(
+                config_id, params, token, processed[id(params)],
+                None if set_watermark is None else set_watermark.response_date
+            )
+        if name is not None and set_watermark is not None and \
+                set_watermark.value is not None and \
+                not (token is not None and token.token):
+            _save_set_lastrun(config_id, params, set_watermark.value)
+
+    if failures:
+        raise failures[0]
+    if name is not None and watermark is not None and \
+            watermark.value is not None:
+        update_lastrun(name, watermark.value)
+
+
+def _catch_failure(pages, failures):
+    """Follow the pages of a set, storing its error instead of raising it."""
+    try:
+        for page in pages:
+            yield page
+    except Exception as e:
+        failures.append(e)
+
+
+def _changed_records(config_id, records):
+    """Return the stored states and the new or changed records.
+
+    :param config_id: The id of the OAIHarvestConfig.
+    :param records: list of harvested records.
+    :return: dict of the stored states by identifier, list of
+             (record, content hash) of the records whose hash changed.
+    """
+    states = _load_record_states(
+        config_id, (record.header.identifier for record in records)
+    )
+    changed = []
+    for record in records:
+        content_hash = record_hash(record)
+        state = states.get(record.header.identifier)
+        if state is None or state.content_hash != content_hash:
+            changed.append((record, content_hash))
+    return states, changed
+
+
+def record_hash(record):
+    """Return the SHA-256 hash of the raw content of a record."""
+    raw = record.raw
+    if not isinstance(raw, bytes):
+        raw = raw.encode('utf-8')
+    return hashlib.sha256(raw).hexdigest()
+
+
+def _load_record_states(config_id, identifiers):
+    """Return the stored states of records, by identifier.
+
+    :param config_id: The id of the OAIHarvestConfig.
+    :param identifiers: iterable of OAI identifiers.
+    """
+    return dict(
+        (state.identifier, state) for state in
+        OAIHarvestRecordState.query.filter(
+            OAIHarvestRecordState.config_id == config_id,
+            OAIHarvestRecordState.identifier.in_(set(identifiers))
+        )
+    )
+
+
+def _save_record_states(config_id, states, records):
+    """Store the states of harvested records and commit them.
+
+    :param config_id: The id of the OAIHarvestConfig.
+    :param states: dict of the stored states, by identifier, updated with the
+                   states created.
+    :param records: list of (record, content hash).
+    """
+    for record, content_hash in records:
+        state = states.get(record.header.identifier)
+        if state is None:
+            state = OAIHarvestRecordState(
+                config_id=config_id, identifier=record.header.identifier
+            )
+            db.session.add(state)
+            states[state.identifier] = state
+        state.datestamp = record.header.datestamp
+        state.deleted = bool(record.header.deleted)
+        state.content_hash = content_hash
+    db.session.commit()
+
+
+def list_records_delta(metadata_prefix=None, from_date=None, until_date=None,
+                       name=None, setspecs=None, encoding=None,
+                       concurrency=None, errors=None, compact=False,
+                       raw=False):
+    """Harvest the new and changed records of an OAIHarvestConfig.
+
+    See :func:`iter_records_delta`.
+
+    :return: request object, list of harvested records
+    """
+    request, records = iter_records_delta(
+        metadata_prefix, from_date, until_date, name, setspecs, encoding,
+        concurrency=concurrency, errors=errors, compact=compact, raw=raw
+    )
+    return request, list(records)
+
+
+def iter_records_delta(metadata_prefix=None, from_date=None, until_date=None,
+                       name=None, setspecs=None, encoding=None,
+                       concurrency=None, errors=None, compact=False,
+                       raw=False):
+    """Harvest the new and changed records of an OAIHarvestConfig as a stream.
+
+    Instead of ListRecords, the headers of the records are listed with
+    ListIdentifiers, and their datestamp and deleted flag are compared to the
+    state stored when the records were last harvested with the
+    OAIHarvestConfig (see the ``skip_unchanged`` option of
+    :func:`iter_records`). Only the new and changed records are then fetched
+    with GetRecord requests, which saves the transfer of the metadata of the
+    unchanged records.
+
+    The headers are compared by batches of ``OAIHARVESTER_STATE_BATCH_SIZE``,
+    and the states of the records of a batch are stored once they have been
+    consumed. The ``lastrun`` of the OAIHarvestConfig is updated once the
+    generator is exhausted.
+
+    As with :func:`iter_records`, every set is harvested from its own
+    'lastrun', which is stored as soon as all its records have been yielded,
+    and a failing set does not stop the other ones: its error is raised at
+    the end.
+
+    :param metadata_prefix: The prefix for the metadata return
+                            (defaults to 'oai_dc').
+    :param from_date: The lower bound date for the harvesting (optional).
+    :param until_date: The upper bound date for the harvesting (optional).
+    :param name: The name of the OAIHarvestConfig.
+    :param setspecs: The 'set' criteria for the harvesting (optional).
+    :param encoding: Override the encoding returned by the server. ISO-8859-1
+                     if it is not provided by the server.
+    :param concurrency: Number of records fetched at the same time (defaults
+                        to ``OAIHARVESTER_GET_RECORD_CONCURRENCY``).
+    :param errors: dict collecting the errors by identifier (optional). The
+                   records which could not be fetched are then skipped, and
+                   the ``lastrun`` is kept before the oldest of their
+                   datestamps, so that the next harvest lists and fetches
+                   them again.
+    :param compact: Yield :class:`~.records.CompactRecord` objects instead
+                    of sickle records.
+    :param raw: Yield :class:`~.records.RawRecord` objects read from the
+                bytes of the responses, which are never parsed.
+    :return: request object, generator of harvested records
+    """
+    if name is None:
+        raise NameOrUrlMissing(
+            "A name is required to harvest the changed records."
+        )
+    url, queries, watermark = _prepare_list_records(
+        metadata_prefix, from_date, until_date, None, name, setspecs
+    )
+    request = get_client(url, encoding)
+    if concurrency is None:
+        concurrency = current_app.config['OAIHARVESTER_GET_RECORD_CONCURRENCY']
+
+    records = _iter_records_delta(
+        request, queries, name, watermark, concurrency, errors,
+        class_mapping=COMPACT_CLASS_MAP if compact else None, raw=raw,
+        batch_size=current_app.config['OAIHARVESTER_STATE_BATCH_SIZE']
+    )
+    return request, records
+
+
+def _iter_records_delta(request, queries, name, watermark=None,
+                        concurrency=1, errors=None, class_mapping=None,
+                        raw=False, batch_size=500):
+    """Yield the records whose header changed since they were harvested.
+
+    :param request: The Sickle object used to issue the requests.
+    :param queries: list of OAI-PMH parameters, one per set.
+    :param name: The name of the OAIHarvestConfig.
+    :param watermark: The :class:`Watermark` of the harvest, which becomes
+                      the 'lastrun' of the OAIHarvestConfig once all records
+                      have been yielded (optional). The 'lastrun' of every
+                      set is stored once its records have been yielded.
+    :param concurrency: Number of records fetched at the same time.
+    :param errors: dict collecting the errors by identifier (optional).
+    :param class_mapping: The classes mapping the records (defaults to the
+                          one of ``request``).
+    :param raw: Read the records from the bytes of the responses.
+    :param batch_size: The number of headers looked up at once.
+    """
+    config_id = get_oaiharvest_object(name).id
+    # Only keep the identifiers to return the same record once
+    # (e.g. if it is part of several sets)
+    seen = set()
+    # The datestamps of the records which could not be fetched.
+    failed = []
+    # A failing set does not stop the other ones.
+    failures = []
+    for params in queries:
+        set_watermark = None
+        if watermark is not None:
+            set_watermark = Watermark(parent=watermark)
+        set_failed = []
         try:
-            for record in request.ListRecords(**params):
-                records[record.header.identifier] = record
-        except NoRecordsMatch:
+            for record in _iter_set_delta(
+                request, config_id, params, set_watermark, seen, set_failed,
+                concurrency, errors, class_mapping, raw, batch_size
+            ):
+                yield record
+        except Exception as e:
+            failures.append(e)
             continue
+        failed.extend(set_failed)
+        if set_watermark is not None:
+            lastrun = _lastrun_before(set_watermark.value, set_failed)
+            if lastrun is not None:
+                _save_set_lastrun(config_id, params, lastrun)
 
-    # Update lastrun?
-    if from_date is None and until_date is None and name is not None:
-        oai_source = get_oaiharvest_object(name)
-        oai_source.update_lastrun(lastrun_date)
-        oai_source.save()
-        db.session.commit()
-    return request, records.values()
+    if failures:
+        raise failures[0]
+    if watermark is not None:
+        lastrun = _lastrun_before(watermark.value, failed)
+        if lastrun is not None:
+            update_lastrun(name, lastrun)
+
+
+def _iter_set_delta(request, config_id, params, watermark, seen, failed,
+                    concurrency, errors, class_mapping, raw, batch_size):
+    """Yield the records of a set whose header changed.
+
+    :param request: The Sickle object used to issue the requests.
+    :param config_id: The id of the OAIHarvestConfig.
+    :param params: The OAI-PMH parameters of the set.
+    :param watermark: The :class:`Watermark` of the set (optional).
+    :param seen: set of the identifiers already listed, updated with the
+                 ones of the set.
+    :param failed: list extended with the datestamps of the records which
+                   could not be fetched.
+    """
+    headers = _iter_records(
+        request, [dict(params, verb='ListIdentifiers')],
+        watermark=watermark, class_mapping=COMPACT_CLASS_MAP
+    )
+    for batch in chunks(headers, batch_size):
+        batch = [header for header in batch if header.identifier not in seen]
+        seen.update(header.identifier for header in batch)
+        states = _load_record_states(
+            config_id, (header.identifier for header in batch)
+        )
+        changed = []
+        for header in batch:
+            state = states.get(header.identifier)
+            if state is None or state.datestamp != header.datestamp or \
+                    state.deleted != header.deleted:
+                changed.append(header)
+
+        records = _get_records(
+            request, [header.identifier for header in changed],
+            params['metadataPrefix'], concurrency, errors, class_mapping, raw
+        )
+        fetched = set(record.header.identifier for record in records)
+        failed.extend(header.datestamp for header in changed
+                      if header.identifier not in fetched)
+        for record in records:
+            yield record
+
+        _save_record_states(
+            config_id, states,
+            [(record, record_hash(record)) for record in records]
+        )
+
+
+def _lastrun_before(lastrun, datestamps):
+    """Return the 'lastrun', moved back to the oldest of the datestamps.
+
+    :param lastrun: The new 'lastrun', or None if it is unknown.
+    :param datestamps: The datestamps of the records which must be harvested
+                       again by the next harvest.
+    """
+    dates = [date for date in map(_parse_date, datestamps) if date is not None]
+    if dates and (lastrun is None or min(dates) < lastrun):
+        return min(dates)
+    return lastrun
+
+
+def _checkpoint_key(config_id, params):
+    """Return the columns identifying the checkpoint of a request."""
+    return {
+        'config_id': config_id,
+        'setspec': params.get('set') or '',
+        'from_date': params.get('from') or '',
+        'until_date': params.get('until') or '',
+    }
+
+
+def _save_checkpoint(config_id, params, token, records_processed,
+                     response_date=None):
+    """Store the resumption token of a request, or delete it once complete.
+
+    :param config_id: The id of the OAIHarvestConfig.
+    :param params: The OAI-PMH parameters of the first request.
+    :param token: The ResumptionToken of the page which has been consumed.
+    :param records_processed: The number of records consumed so far.
+    :param response_date: The first ``responseDate`` of the request
+                          (optional).
+    """
+    key = _checkpoint_key(config_id, params)
+    checkpoint = OAIHarvestCheckpoint.query.filter_by(**key).first()
+    if token is not None and token.token:
+        if checkpoint is None:
+            checkpoint = OAIHarvestCheckpoint(**key)
+            db.session.add(checkpoint)
+        checkpoint.resumption_token = token.token
+        checkpoint.records_processed = records_processed
+        checkpoint.response_date = response_date
+    elif checkpoint is not None:
+        db.session.delete(checkpoint)
+    db.session.commit()
+
+
+def plan_date_windows(from_date, until_date, max_records,
+                      metadata_prefix=None, url=None, name=None,
+                      setspecs=None, encoding=None):
+    """Split a range of dates into windows of a balanced size.
+
+    The first ListRecords page of a window is requested to read the
+    ``completeListSize`` of its resumption token. Windows with more than
+    ``max_records`` records are bisected until they fit, or until they are a
+    single day long. Windows whose size is not reported by the server are
+    kept as they are.
+
+    :param from_date: The lower bound date for the harvesting, as YYYY-MM-DD.
+    :param until_date: The upper bound date for the harvesting, as YYYY-MM-DD.
+    :param max_records: The max number of records in a window.
+    :param metadata_prefix: The prefix for the metadata return
+                            (defaults to 'oai_dc').
+    :param url: The The url to be used to create the endpoint.
+    :param name: The name of the OAIHarvestConfig to use instead of passing
+                 specific parameters.
+    :param setspecs: The 'set' criteria for the harvesting (optional).
+    :param encoding: Override the encoding returned by the server. ISO-8859-1
+                     if it is not provided by the server.
+    :return: list of (from, until) dates as YYYY-MM-DD
+    """
+    if name:
+        url, _metadata_prefix, _, _setspecs = get_info_by_oai_name(name)
+        if metadata_prefix is None:
+            metadata_prefix = _metadata_prefix
+        if setspecs is None:
+            setspecs = _setspecs
+    elif not url:
+        raise NameOrUrlMissing(
+            "Retry using the parameters -n <name> or -u <url>."
+        )
+
+    request = get_client(url, encoding)
+    windows = []
+    pending = [(from_date[:10], until_date[:10])]
+    while pending:
+        start, end = pending.pop(0)
+        queries = _list_queries(
+            metadata_prefix, setspecs, {'from': start, 'until': end}
+        )
+        size = sum(_list_size(request, params) for params in queries)
+        if size > max_records and start != end:
+            pending[:0] = date_windows(start, end, 2)
+        else:
+            windows.append((start, end))
+    return windows
+
+
+def _list_size(request, params):
+    """Return the number of records of a ListRecords request.
+
+    Only the first page is requested: the size is read from the
+    ``completeListSize`` of the resumption token if any.
+    """
+    try:
+        items, token = harvest_page(request, params)
+    except NoRecordsMatch:
+        return 0
+    if token is not None and token.complete_list_size:
+        return int(token.complete_list_size)
+    return len(items)
+
+
+def _list_set_pages(request, params, resumption_token=None,
+                    class_mapping=None, raw=False, watermark=None):
+    """Follow a ListRecords request, ignoring sets without records.
+
+    If the server rejects the initial resumption token, ``(params, None,
+    None)`` is yielded and the request is restarted from scratch. A set
+    without records yields a single empty page.
+
+    :return: generator of (params, list of records, ResumptionToken or None)
+    """
+    try:
+        pages = list_pages(request, params, resumption_token, class_mapping,
+                           raw, watermark)
+        try:
+            records, token = next(pages)
+        except BadResumptionToken:
+            if not resumption_token:
+                raise
+            yield params, None, None
+            pages = list_pages(request, params, class_mapping=class_mapping,
+                               raw=raw, watermark=watermark)
+            records, token = next(pages)
+        yield params, records, token
+        for records, token in pages:
+            yield params, records, token
+    except NoRecordsMatch:
+        yield params, [], None
+
+
+def list_pages(request, params, resumption_token=None, class_mapping=None,
+               raw=False, watermark=None):
+    """Follow the resumption tokens of an OAI-PMH list request.
+
+    Every response is parsed only once, and nothing but the current page is
+    kept in memory.
+
+    :param request: The Sickle object used to issue the requests.
+    :param params: The OAI-PMH parameters, including the ``verb``.
+    :param resumption_token: Resume the list from this token (optional).
+    :param class_mapping: The classes mapping the items, by verb (defaults
+                          to the one of ``request``).
+    :param raw: Read the records from the bytes of the responses, see
+                :func:`parse_raw_page`.
+    :param watermark: The :class:`Watermark` reading the date of the
+                      responses (optional).
+    :return: generator of (list of items, ResumptionToken or None) per page
+    """
+    verb = params['verb']
+    while True:
+        if resumption_token:
+            params = {'verb': verb, 'resumptionToken': resumption_token}
+        items, token = harvest_page(request, params, class_mapping, raw,
+                                    watermark)
+        yield items, token
+        resumption_token = token.token if token is not None else None
+        if not resumption_token:
+            return
+
+
+def harvest_page(request, params, class_mapping=None, raw=False,
+                 watermark=None):
+    """Issue a single OAI-PMH request and map the items of the response.
+
+    :param request: The Sickle object used to issue the request.
+    :param params: The OAI-PMH parameters, including the ``verb``.
+    :param class_mapping: The classes mapping the items, by verb (defaults
+                          to the one of ``request``).
+    :param raw: Read the records from the bytes of the response, see
+                :func:`parse_raw_page`. If the encoding of ``request`` is
+                overridden, the response is parsed and the records are
+                serialized again.
+    :param watermark: The :class:`Watermark` reading the date of the
+                      response (optional).
+    :return: list of items, ResumptionToken or None
+    """
+    response = request.harvest(**params)
+    if watermark is not None:
+        watermark.add_response(response.http_response.content)
+    if raw and not request.encoding:
+        return parse_raw_page(response.http_response.content, params['verb'])
+    return parse_page(
+        response.xml, params['verb'], request.oai_namespace,
+        RAW_CLASS_MAP if raw else class_mapping or request.class_mapping
+    )
+
+
+def parse_page(xml, verb, namespace=OAI_NAMESPACE,
+               class_mapping=DEFAULT_CLASS_MAP):
+    """Map the items of a parsed OAI-PMH response.
+
+    :param xml: The parsed response.
+    :param verb: The OAI-PMH verb of the request.
+    :param namespace: The OAI-PMH namespace, as ``{namespace}``.
+    :param class_mapping: The classes mapping the items, by verb.
+    :return: list of items, ResumptionToken or None
+    """
+    error = xml.find('.//' + namespace + 'error')
+    if error is not None:
+        raise _oai_error(error.attrib.get('code', 'UNKNOWN'), error.text)
+
+    mapper = class_mapping[verb]
+    items = [mapper(element) for element in
+             xml.iterfind('.//' + namespace + VERBS_ELEMENTS[verb])]
+
+    token = xml.find('.//' + namespace + 'resumptionToken')
+    if token is not None:
+        token = ResumptionToken(
+            token=token.text,
+            cursor=token.attrib.get('cursor'),
+            complete_list_size=token.attrib.get('completeListSize'),
+            expiration_date=token.attrib.get('expirationDate'),
+        )
+    return items, token
+
+
+def parse_raw_page(content, verb):
+    """Read the records of an OAI-PMH response without parsing it.
+
+    The records and the resumption token are located with regular expressions
+    on the bytes of the response, and the header of every record is read with
+    :func:`~.utils.header_extraction_from_string`. The headers of a
+    ListIdentifiers response are read with a single regular expression.
+    Responses containing CDATA sections or comments, which could hide markup,
+    or headers which cannot be read that way (e.g. with entities) are parsed
+    with lxml. So are the responses which are not encoded in UTF-8, so that
+    the records are always UTF-8 documents.
+
+    :param content: The bytes of the response.
+    :param verb: The OAI-PMH verb of the request (``ListRecords``,
+                 ``GetRecord`` or ``ListIdentifiers``).
+    :return: list of :class:`~.records.RawRecord` (or
+             :class:`~.records.CompactHeader` for ListIdentifiers),
+             ResumptionToken or None
+    """
+    declared = RAW_ENCODING.match(content)
+    if b'<![CDATA[' in content or b'<!--' in content or \
+            content.startswith((codecs.BOM_UTF16_BE, codecs.BOM_UTF16_LE)) or \
+            declared and declared.group(1).lower() not in RAW_ENCODINGS:
+        return parse_page(etree.XML(content, parser=XMLParser), verb,
+                          class_mapping=RAW_CLASS_MAP)
+    if verb == 'ListIdentifiers':
+        return _parse_raw_headers(content)
+
+    root = RAW_ROOT.search(content)
+    declarations = [
+        (match.group(1), match.group(0).strip())
+        for match in RAW_DECLARATION.finditer(root.group(0) if root else b'')
+    ]
+    tag = re.compile(br'<(/?)(?:[\w.-]+:)?' +
+                     VERBS_ELEMENTS[verb].encode('ascii') + br'(?=[\s/>])')
+
+    records = []
+    depth = start = name_end = 0
+    end = root.end() if root else 0
+    for match in tag.finditer(content, end):
+        tag_end = content.index(b'>', match.end()) + 1
+        if match.group(1):
+            depth -= 1
+            if depth == 0:
+                records.append(_raw_record(
+                    content, start, name_end, tag_end, declarations
+                ))
+                end = tag_end
+        elif content[tag_end - 2:tag_end - 1] != b'/':
+            if depth == 0:
+                start, name_end = match.start(), match.end()
+                if not records:
+                    _raise_raw_error(content[:start])
+            depth += 1
+    if not records:
+        _raise_raw_error(content)
+    return records, _raw_token(content, end)
+
+
+def _parse_raw_headers(content):
+    """Read the headers of a ListIdentifiers response without parsing it.
+
+    The headers are read with :func:`~.utils.scan_headers`, and the response
+    is parsed with lxml when one of them cannot be read that way.
+    """
+    scanned = scan_headers(content)
+    if scanned is None:
+        return parse_page(etree.XML(content, parser=XMLParser),
+                          'ListIdentifiers', class_mapping=RAW_CLASS_MAP)
+    headers, end = scanned
+    headers = [
+        CompactHeader(identifier, datestamp, status == 'deleted')
+        for identifier, datestamp, status in headers
+    ]
+    if not headers:
+        _raise_raw_error(content)
+    return headers, _raw_token(content, end)
+
+
+def _raw_token(content, end):
+    """Read the resumption token found after ``end`` in a response."""
+    token = RAW_TOKEN.search(content, end)
+    if token is not None:
+        attributes = {
+            name: _raw_text(double or single)
+            for name, double, single in RAW_ATTRIBUTE.findall(
+                token.group(1) or b''
+            )
+        }
+        token = ResumptionToken(
+            token=_raw_text(token.group(2)) or None,
+            cursor=attributes.get(b'cursor'),
+            complete_list_size=attributes.get(b'completeListSize'),
+            expiration_date=attributes.get(b'expirationDate'),
+        )
+    return token
+
+
+def _raw_record(content, start, name_end, end, declarations):
+    """Return the record found at ``content[start:end]``.
+
+    The namespace declarations of the envelope are added to its start tag.
+    """
+    declared = set(match.group(1) for match in RAW_DECLARATION.finditer(
+        content, name_end, content.index(b'>', name_end)
+    ))
+    missing = b''.join(
+        b' ' + declaration for name, declaration in declarations
+        if name not in declared
+    )
+    raw = content[start:name_end] + missing + content[name_end:end]
+    identifier, datestamp, status = header_extraction_from_string(raw)
+    return RawRecord(raw, identifier, datestamp, status == 'deleted')
+
+
+def _raise_raw_error(content):
+    """Raise the OAI-PMH error found in the bytes of a response, if any."""
+    error = RAW_ERROR.search(content)
+    if error is not None:
+        attributes = {
+            name: double or single
+            for name, double, single in RAW_ATTRIBUTE.findall(
+                error.group(1) or b''
+            )
+        }
+        raise _oai_error(
+            (attributes.get(b'code') or b'UNKNOWN').decode('utf-8'),
+            _raw_text(error.group(2))
+        )
+
+
+def _raw_text(value):
+    """Decode the text of an element or attribute, resolving entities."""
+    if not value:
+        return value.decode('utf-8') if value is not None else None
+    if b'&' in value:
+        return etree.fromstring(b'<t>' + value + b'</t>').text
+    return value.decode('utf-8')
+
+
+def _oai_error(code, message=None):
+    """Return the sickle exception of an OAI-PMH error code."""
+    return getattr(
+        oaiexceptions, code[0].upper() + code[1:], oaiexceptions.OAIError
+    )(message or '')
 
 
 def get_records(identifiers, metadata_prefix=None, url=None, name=None,
-                encoding=None):
+                encoding=None, concurrency=None, errors=None, compact=False,
+                raw=False):
     """Harvest specific records from an OAI repo via OAI-PMH identifiers.
 
+    The records are returned in the order of the identifiers. If ``errors`` is
+    given, the records which could not be fetched (e.g. ``IdDoesNotExist``)
+    are skipped and their exception is stored in it by identifier, instead of
+    being raised.
+
     :param metadata_prefix: The prefix for the metadata return
                             (defaults to 'oai_dc').
     :param identifiers: list of unique identifiers for records to be harvested.
@@ -128,6 +1252,13 @@ def get_records(identifiers, metadata_prefix=None, url=None, name=None,
                  specific parameters.
     :param encoding: Override the encoding returned by the server. ISO-8859-1
                      if it is not provided by the server.
+    :param concurrency: Number of records fetched at the same time (defaults
+                        to ``OAIHARVESTER_GET_RECORD_CONCURRENCY``).
+    :param errors: dict collecting the errors by identifier (optional).
+    :param compact: Return :class:`~.records.CompactRecord` objects instead
+                    of sickle records.
+    :param raw: Return :class:`~.records.RawRecord` objects read from the
+                bytes of the responses, which are never parsed.
     :return: request object, list of harvested records
     """
     if name:
@@ -142,15 +1273,102 @@ def get_records(identifiers, metadata_prefix=None, url=None, name=None,
             "Retry using the parameters -n <name> or -u <url>."
         )
 
-    request = Sickle(url, encoding=encoding)
-    records = []
-    for identifier in identifiers:
+    request = get_client(url, encoding)
+    if concurrency is None:
+        concurrency = current_app.config['OAIHARVESTER_GET_RECORD_CONCURRENCY']
+    return request, _get_records(
+        request, identifiers, metadata_prefix, concurrency, errors,
+        COMPACT_CLASS_MAP if compact else None, raw
+    )
+
+
+def _get_records(request, identifiers, metadata_prefix=None, concurrency=1,
+                 errors=None, class_mapping=None, raw=False):
+    """Fetch records with GetRecord requests, in the order of identifiers.
+
+    :param request: The Sickle object used to issue the requests.
+    :param identifiers: list of unique identifiers for records to be harvested.
+    :param metadata_prefix: The prefix for the metadata return
+                            (defaults to 'oai_dc').
+    :param concurrency: Number of records fetched at the same time.
+    :param errors: dict collecting the errors by identifier (optional).
+    :param class_mapping: The classes mapping the records (defaults to the
+                          one of ``request``).
+    :param raw: Read the records from the bytes of the responses.
+    :return: list of harvested records
+    """
+    def get_record(identifier):
         arguments = {
+            'verb': 'GetRecord',
             'identifier': identifier,
             'metadataPrefix': metadata_prefix or "oai_dc"
         }
-        records.append(request.GetRecord(**arguments))
-    return request, records
+        try:
+            records, _ = harvest_page(request, arguments, class_mapping, raw)
+            if not records:
+                raise IdDoesNotExist('No record in the response.')
+            return records[0]
+        except OAI_ERRORS + (RequestException,) as e:
+            if errors is None:
+                raise
+            errors[identifier] = e
+
+    if concurrency > 1 and len(identifiers) > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            records = list(executor.map(get_record, identifiers))
+    else:
+        records = [get_record(identifier) for identifier in identifiers]
+    return [record for record in records if record is not None]
+
+
+def signal_batches(request, records, batch_size, name=None, **kwargs):
+    """Send the records in ``oaiharvest_batch`` signals while yielding them.
+
+    A signal is sent every ``batch_size`` records, and for the remaining ones.
+    Once all the records have been yielded, ``oaiharvest_finished`` is sent
+    with the number of records and of batches only.
+
+    :param request: The Sickle object which harvested the records.
+    :param records: iterable of harvested records, e.g. from
+                    :func:`iter_records`.
+    :param batch_size: The number of records in a batch.
+    :param name: The name of the OAIHarvestConfig harvested (optional).
+    :param kwargs: Additional arguments sent with the signals.
+    :return: generator of the records.
+    """
+    batch = []
+    sequence = count = 0
+    for record in records:
+        yield record
+        batch.append(record)
+        count += 1
+        if len(batch) >= batch_size:
+            oaiharvest_batch.send(request, records=batch, sequence=sequence,
+                                  name=name, **kwargs)
+            batch = []
+            sequence += 1
+    if batch:
+        oaiharvest_batch.send(request, records=batch, sequence=sequence,
+                              name=name, **kwargs)
+        sequence += 1
+    oaiharvest_finished.send(request, count=count, batches=sequence,
+                             name=name, **kwargs)
+
+
+def update_lastrun(name, lastrun_date=None):
+    """Update the 'lastrun' of an OAIHarvestConfig and commit it.
+
+    The 'lastrun' stored for its sets are deleted, as they all start from
+    the new one.
+
+    :param name: name of the source (OAIHarvestConfig.name)
+    :param lastrun_date: The new 'lastrun', in UTC (defaults to now).
+    """
+    oai_source = get_oaiharvest_object(name)
+    oai_source.update_lastrun(lastrun_date)
+    oai_source.save()
+    OAIHarvestSetLastrun.query.filter_by(config_id=oai_source.id).delete()
+    db.session.commit()
 
 
 def get_info_by_oai_name(name):
@@ -158,8 +1376,11 @@ def get_info_by_oai_name(name):
 
     :param name: name of the source (OAIHarvestConfig.name)
 
-    :return: (url, metadataprefix, lastrun as YYYY-MM-DD, setspecs)
+    :return: (url, metadataprefix, lastrun in UTC with the granularity of the
+             endpoint if it is known, otherwise as YYYY-MM-DD, setspecs)
     """
     obj = get_oaiharvest_object(name)
-    lastrun = obj.lastrun.strftime("%Y-%m-%d")
+    lastrun = obj.lastrun.strftime(
+        DATE_FORMATS[get_granularity(obj, identify=False)]
+    )
     return obj.baseurl, obj.metadataprefix, lastrun, obj.setspecs
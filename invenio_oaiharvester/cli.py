@@ -22,13 +22,17 @@
 from __future__ import absolute_import, print_function
 
 import click
+from flask import current_app
 from flask.cli import with_appcontext
 
-from .api import get_records, list_records
-from .errors import IdentifiersOrDates
+from .api import get_records, iter_records, iter_records_delta, \
+    list_identifiers, list_records, list_records_delta, signal_batches
+from .errors import DeltaHarvestOptions, IdentifiersOrDates
 from .signals import oaiharvest_finished
-from .tasks import get_specific_records, list_records_from_dates
-from .utils import get_identifier_names, write_to_dir
+from .tasks import get_specific_records, list_identifiers_from_dates, \
+    list_records_from_dates
+from .utils import get_identifier_names, get_oaiharvest_object, \
+    open_output_file, write_identifiers, write_to_dir
 
 
 @click.group()
@@ -64,13 +68,45 @@ def oaiharvester():
 @click.option('-e', '--encoding', default=None,
               help="Override the encoding returned by the server. ISO-8859-1 "
                    "if it is not provided by the server.")
+@click.option('-c', '--concurrency', default=None, type=int,
+              help="Number of records fetched at the same time when using "
+                   "identifiers or delta harvesting.")
+@click.option('--skip-errors', is_flag=True, default=False,
+              help="Skip the identifiers which could not be fetched.")
+@click.option('--compression', default=None,
+              type=click.Choice(['gzip', 'zstd']),
+              help="Compress the files written to the directory.")
+@click.option('--max-bytes', default=None, type=int,
+              help="Max size of the files written to the directory, before "
+                   "compression.")
+@click.option('--manifest', default=None,
+              help="File name of a manifest, with an index of the records, "
+                   "written to the directory and prefixed with the run id.")
+@click.option('-b', '--batch-size', default=None, type=int,
+              help="Send the records in signals of this size while they are "
+                   "harvested.")
+@click.option('--skip-unchanged', is_flag=True, default=False,
+              help="Leave out the records which did not change since they "
+                   "were last harvested with the configuration.")
+@click.option('--delta/--no-delta', default=None,
+              help="List the identifiers first and only fetch the new and "
+                   "changed records (defaults to the configuration). Cannot "
+                   "be combined with --skip-unchanged or --checkpoint.")
+@click.option('--checkpoint/--no-checkpoint', default=None,
+              help="Store the progress of the harvest to resume it when it "
+                   "is interrupted (defaults to OAIHARVESTER_CHECKPOINT).")
 @with_appcontext
 def harvest(metadata_prefix, name, setspecs, identifiers, from_date,
             until_date, url, directory, arguments, quiet, enqueue, signals,
-            encoding):
+            encoding, concurrency, skip_errors, compression, max_bytes,
+            manifest, batch_size, skip_unchanged, delta, checkpoint):
     """Harvest records from an OAI repository."""
     arguments = dict(x.split('=', 1) for x in arguments)
     records = None
+    # Number of records sent in each batch signal, if any.
+    batches = signals and (
+        batch_size or current_app.config['OAIHARVESTER_BATCH_SIZE']
+    )
     if identifiers is None:
         # If no identifiers are provided, a harvest is scheduled:
         # - url / name is used for the endpoint
@@ -78,9 +114,33 @@ def harvest(metadata_prefix, name, setspecs, identifiers, from_date,
         # (until_date optionally if from_date is used)
         params = (metadata_prefix, from_date, until_date, url,
                   name, setspecs, signals)
+        if delta is None:
+            delta = name is not None and \
+                get_oaiharvest_object(name).deltaharvest
+        if delta and (skip_unchanged or checkpoint):
+            raise DeltaHarvestOptions(
+                "Delta harvests cannot be combined with --skip-unchanged or "
+                "--checkpoint."
+            )
         if enqueue:
-            job = list_records_from_dates.delay(*params, **arguments)
+            job = list_records_from_dates.delay(
+                *params, batch_size=batch_size, skip_unchanged=skip_unchanged,
+                delta=delta, checkpoint=checkpoint, concurrency=concurrency,
+                **arguments
+            )
             print("Scheduled job {0}".format(job.id))
+        elif delta:
+            harvest_delta = iter_records_delta if batches \
+                else list_records_delta
+            request, records = harvest_delta(
+                metadata_prefix, from_date, until_date, name, setspecs,
+                encoding, concurrency=concurrency
+            )
+        elif batches:
+            request, records = iter_records(
+                metadata_prefix, from_date, until_date, url, name, setspecs,
+                encoding, skip_unchanged=skip_unchanged, checkpoint=checkpoint
+            )
         else:
             request, records = list_records(
                 metadata_prefix,
@@ -89,7 +149,9 @@ def harvest(metadata_prefix, name, setspecs, identifiers, from_date,
                 url,
                 name,
                 setspecs,
-                encoding
+                encoding,
+                skip_unchanged=skip_unchanged,
+                checkpoint=checkpoint
             )
     else:
         if (from_date is not None) or (until_date is not None):
@@ -101,20 +163,36 @@ def harvest(metadata_prefix, name, setspecs, identifiers, from_date,
         params = (identifiers, metadata_prefix, url,
                   name, signals)
         if enqueue:
-            job = get_specific_records.delay(*params, **arguments)
+            job = get_specific_records.delay(
+                *params, encoding=encoding, concurrency=concurrency,
+                skip_errors=skip_errors, batch_size=batch_size, **arguments
+            )
             print("Scheduled job {0}".format(job.id))
         else:
             identifiers = get_identifier_names(identifiers)
+            errors = {} if skip_errors else None
             request, records = get_records(
                 identifiers,
                 metadata_prefix,
                 url,
                 name,
-                encoding
+                encoding,
+                concurrency,
+                errors
             )
+            for identifier, error in (errors or {}).items():
+                click.echo('Skipped {0}: {1!r}'.format(identifier, error),
+                           err=True)
 
+    if records is not None and batches:
+        records = signal_batches(request, records, batches, name=name,
+                                 **arguments)
+        if quiet and not directory:
+            # The records are only consumed by the signals.
+            for _ in records:
+                pass
     if records:
-        if signals:
+        if signals and not batches:
             oaiharvest_finished.send(
                 request,
                 records=records,
@@ -122,7 +200,10 @@ def harvest(metadata_prefix, name, setspecs, identifiers, from_date,
                 **arguments
             )
         if directory:
-            files_created, total = write_to_dir(records, directory)
+            files_created, total = write_to_dir(
+                records, directory, compression=compression,
+                max_bytes=max_bytes, manifest=manifest, name=name
+            )
             print_files_created(files_created)
             print_total_records(total)
         elif not quiet:
@@ -130,6 +211,63 @@ def harvest(metadata_prefix, name, setspecs, identifiers, from_date,
             print_total_records(total)
 
 
+@oaiharvester.command()
+@click.option('-m', '--metadata-prefix', default=None,
+              help="The prefix for the metadata return (e.g. 'oai_dc')")
+@click.option('-n', '--name', default=None,
+              help="Name of persistent configuration to use.")
+@click.option('-s', '--setspecs', default=None,
+              help="The 'set' criteria for the listing (optional).")
+@click.option('-f', '--from-date', default=None,
+              help="The lower bound date for the listing (optional).")
+@click.option('-t', '--until_date', default=None,
+              help="The upper bound date for the listing (optional).")
+@click.option('-u', '--url', default=None,
+              help="The url of the OAI-PMH endpoint.")
+@click.option('-o', '--output', default=None,
+              help="The file to write the identifiers to, compressed if it "
+                   "ends with .gz or .zst (defaults to stdout).")
+@click.option('--details', is_flag=True, default=False,
+              help="Add the datestamp and status of the records, separated "
+                   "by tabs.")
+@click.option('--count', is_flag=True, default=False,
+              help="Only print the number of records.")
+@click.option('-k', '--enqueue', is_flag=True, default=False,
+              help="Enqueue the listing and return immediately.")
+@click.option('-e', '--encoding', default=None,
+              help="Override the encoding returned by the server. ISO-8859-1 "
+                   "if it is not provided by the server.")
+@click.option('--incremental', is_flag=True, default=False,
+              help="Without a from date, start from the last run of the "
+                   "configuration.")
+@with_appcontext
+def identifiers(metadata_prefix, name, setspecs, from_date, until_date, url,
+                output, details, count, enqueue, encoding, incremental):
+    """List the identifiers of the records of an OAI repository."""
+    if enqueue:
+        job = list_identifiers_from_dates.delay(
+            metadata_prefix, from_date, until_date, url, name, setspecs,
+            encoding, output=output, details=details,
+            incremental=incremental
+        )
+        print("Scheduled job {0}".format(job.id))
+        return
+
+    _, headers = list_identifiers(metadata_prefix, from_date, until_date,
+                                  url, name, setspecs, encoding,
+                                  raw=encoding is None,
+                                  incremental=incremental)
+    if count:
+        click.echo(sum(1 for _ in headers))
+    elif output:
+        with open_output_file(output) as fileobj:
+            total = write_identifiers(headers, fileobj, details)
+        click.echo('Number of identifiers listed {0}'.format(total))
+    else:
+        with click.open_file('-', 'wb') as fileobj:
+            write_identifiers(headers, fileobj, details)
+
+
 def print_to_stdout(records):
     """Print the raw information of the records to the stdout.
 
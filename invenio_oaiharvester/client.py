@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio.
+# Copyright (C) 2016 CERN.
+#
+# Invenio is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+#
+# In applying this license, CERN does not
+# waive the privileges and immunities granted to it by virtue of its status
+# as an Intergovernmental Organization or submit itself to any jurisdiction.
+
+"""OAI-PMH clients shared by all the harvests of a process.
+
+Each endpoint gets a single client, whose HTTP session keeps its connections
+alive, so that consecutive harvests do not pay for new TCP and TLS handshakes.
+"""
+
+from __future__ import absolute_import, print_function
+
+import logging
+import os
+import threading
+import time
+
+import requests
+from flask import current_app
+from requests.adapters import HTTPAdapter
+from sickle import Sickle
+from sickle.response import OAIResponse
+
+logger = logging.getLogger(__name__)
+
+_clients = {}
+_clients_pid = None
+_clients_lock = threading.Lock()
+
+
+class PooledSickle(Sickle):
+    """Sickle client sending its requests through an HTTP session."""
+
+    def __init__(self, endpoint, session=None, **kwargs):
+        """Initialize the client.
+
+        :param endpoint: The endpoint of the OAI interface.
+        :param session: The ``requests`` session to use (optional).
+        """
+        super(PooledSickle, self).__init__(endpoint, **kwargs)
+        self.session = session or requests.Session()
+
+    def harvest(self, **kwargs):
+        """Make HTTP requests to the OAI server.
+
+        Requests answered with HTTP 503 are retried up to ``max_retries``
+        times, after the delay given by the server.
+
+        :param kwargs: OAI HTTP parameters.
+        :rtype: :class:`sickle.OAIResponse`
+        """
+        for attempt in range(self.max_retries + 1):
+            if self.http_method == 'GET':
+                http_response = self.session.get(
+                    self.endpoint, params=kwargs, **self.request_args
+                )
+            else:
+                http_response = self.session.post(
+                    self.endpoint, data=kwargs, **self.request_args
+                )
+            if http_response.status_code != 503 or \
+                    attempt == self.max_retries:
+                break
+            try:
+                retry_after = int(http_response.headers.get('retry-after'))
+            except (TypeError, ValueError):
+                retry_after = 20
+            logger.info("HTTP 503! Retrying after %d seconds...", retry_after)
+            time.sleep(retry_after)
+
+        http_response.raise_for_status()
+        if self.encoding:
+            http_response.encoding = self.encoding
+        return OAIResponse(http_response, params=kwargs)
+
+
+def get_client(url, encoding=None):
+    """Return the client of an endpoint, shared by the whole process.
+
+    :param url: The url of the endpoint.
+    :param encoding: Override the encoding returned by the server.
+    :return: :class:`PooledSickle` object.
+    """
+    global _clients_pid
+    key = (url, encoding)
+    with _clients_lock:
+        # Connections must not be shared with forked processes.
+        if _clients_pid != os.getpid():
+            _clients.clear()
+            _clients_pid = os.getpid()
+        client = _clients.get(key)
+        if client is None:
+            client = _clients[key] = _create_client(url, encoding)
+    return client
+
+
+def _create_client(url, encoding):
+    """Create a client with a pooled session from the configuration."""
+    config = current_app.config
+    adapter = HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=config['OAIHARVESTER_HTTP_POOL_SIZE'],
+    )
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return PooledSickle(
+        url,
+        session=session,
+        encoding=encoding,
+        max_retries=config['OAIHARVESTER_HTTP_MAX_RETRIES'],
+        timeout=config['OAIHARVESTER_HTTP_TIMEOUT'],
+    )
+
+
+def clear_clients():
+    """Close and forget all the shared clients."""
+    with _clients_lock:
+        for client in _clients.values():
+            client.session.close()
+        _clients.clear()
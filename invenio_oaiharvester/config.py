@@ -28,3 +28,70 @@ OAIHARVESTER_DEFAULT_NAMESPACE_MAP = {
 
 OAIHARVESTER_WORKDIR = None
 """Path to directory for oaiharvester related files, default: instance_path."""
+
+OAIHARVESTER_SET_CONCURRENCY = 1
+"""Number of sets of an endpoint harvested at the same time.
+
+By default the sets are harvested one after the other.
+"""
+
+OAIHARVESTER_GET_RECORD_CONCURRENCY = 1
+"""Number of GetRecord requests sent at the same time to an endpoint.
+
+By default the records are fetched one after the other.
+"""
+
+OAIHARVESTER_HTTP_POOL_SIZE = 10
+"""Max number of connections kept alive to an endpoint."""
+
+OAIHARVESTER_HTTP_TIMEOUT = 60
+"""Timeout of the HTTP requests, in seconds.
+
+A ``(connect, read)`` tuple can be given as well.
+"""
+
+OAIHARVESTER_HTTP_MAX_RETRIES = 0
+"""Number of times a request answered with HTTP 503 is retried."""
+
+OAIHARVESTER_PREFETCH_DEPTH = 0
+"""Max number of pages fetched ahead while the current page is processed.
+
+The next pages are fetched in a background thread, as far ahead as needed to
+hide the latency of the server. By default nothing is fetched in advance.
+"""
+
+OAIHARVESTER_FILES_PER_DIRECTORY = 1000
+"""Max number of files written by a harvest in a single directory.
+
+The files of a run are spread over numbered subdirectories of its date
+directory. Set to ``None`` to write all of them in the date directory.
+"""
+
+OAIHARVESTER_WRITE_CONCURRENCY = 1
+"""Number of files compressed and written at the same time.
+
+The records are split in files in the harvesting thread, while the files are
+written by a pool of threads. By default they are written one after the
+other.
+"""
+
+OAIHARVESTER_CHECKPOINT = False
+"""Store the progress of the harvests of an OAIHarvestConfig to resume them.
+
+The resumption token of every page is stored once its records have been
+consumed, see :func:`invenio_oaiharvester.api.iter_records`.
+"""
+
+OAIHARVESTER_BATCH_SIZE = None
+"""Number of records sent in each ``oaiharvest_batch`` signal.
+
+By default all the records are sent at once in ``oaiharvest_finished`` when
+the harvest has completed.
+"""
+
+OAIHARVESTER_STATE_BATCH_SIZE = 500
+"""Number of records whose harvested state is looked up at once.
+
+Used when the new and changed records are fetched, see
+:func:`invenio_oaiharvester.api.iter_records_delta`.
+"""
@@ -42,5 +42,9 @@ class IdentifiersOrDates(InvenioOAIHarvesterError):
     """Identifiers cannot be used in combination with dates."""
 
 
+class DeltaHarvestOptions(InvenioOAIHarvesterError):
+    """Delta harvests cannot skip unchanged records or use checkpoints."""
+
+
 class InvenioOAIHarvesterConfigNotFound(InvenioOAIHarvesterError):
     """No InvenioOAIHarvesterConfig was found."""
@@ -28,6 +28,7 @@ from __future__ import absolute_import, print_function
 
 from . import config
 from .cli import oaiharvester as oaiharvester_cmd
+from .utils import register_namespaces
 
 
 class InvenioOAIHarvester(object):
@@ -41,6 +42,7 @@ class InvenioOAIHarvester(object):
     def init_app(self, app):
         """Flask application initialization."""
         self.init_config(app)
+        register_namespaces(app.config['OAIHARVESTER_DEFAULT_NAMESPACE_MAP'])
         app.cli.add_command(oaiharvester_cmd)
         app.extensions['invenio-oaiharvester'] = self
 
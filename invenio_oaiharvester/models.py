@@ -41,6 +41,13 @@ class OAIHarvestConfig(db.Model):
         year=1900, month=1, day=1
     ), nullable=True)
     setspecs = db.Column(db.Text, nullable=False)
+    #: Datestamp granularity of the endpoint, read from Identify, see
+    #: :func:`invenio_oaiharvester.api.get_granularity`.
+    granularity = db.Column(db.String(32), nullable=True)
+    #: List the headers first and only fetch the changed records, see
+    #: :func:`invenio_oaiharvester.api.iter_records_delta`.
+    deltaharvest = db.Column(db.Boolean(name='deltaharvest'), nullable=False,
+                             default=False, server_default=db.false())
 
     def save(self):
         """Save object to persistent storage."""
@@ -48,8 +55,84 @@ class OAIHarvestConfig(db.Model):
             db.session.merge(self)
 
     def update_lastrun(self, new_date=None):
-        """Update the 'lastrun' attribute of object to now."""
-        self.lastrun = new_date or datetime.datetime.now()
+        """Update the 'lastrun' attribute of object to now, in UTC."""
+        self.lastrun = new_date or datetime.datetime.utcnow()
 
 
-__all__ = ('OAIHarvestConfig',)
+class OAIHarvestCheckpoint(db.Model):
+    """Represents the last committed page of an interrupted harvest.
+
+    There is one checkpoint per OAIHarvestConfig, set and date window.
+    """
+
+    __tablename__ = 'oaiharvester_checkpoints'
+    __table_args__ = (
+        db.UniqueConstraint('config_id', 'setspec', 'from_date', 'until_date'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    config_id = db.Column(db.Integer, db.ForeignKey(OAIHarvestConfig.id),
+                          nullable=False)
+    setspec = db.Column(db.String(255), nullable=False, server_default='')
+    from_date = db.Column(db.String(32), nullable=False, server_default='')
+    until_date = db.Column(db.String(32), nullable=False, server_default='')
+    resumption_token = db.Column(db.Text, nullable=False)
+    records_processed = db.Column(db.Integer, nullable=False, default=0)
+    response_date = db.Column(db.DateTime, nullable=True)
+    updated = db.Column(db.DateTime, default=datetime.datetime.now,
+                        onupdate=datetime.datetime.now, nullable=False)
+
+    config = db.relationship(OAIHarvestConfig)
+
+
+class OAIHarvestRecordState(db.Model):
+    """Represents the last harvested state of a record.
+
+    It is used to skip the records whose content did not change since they
+    were last harvested with an OAIHarvestConfig.
+    """
+
+    __tablename__ = 'oaiharvester_record_states'
+    __table_args__ = (
+        db.UniqueConstraint('config_id', 'identifier'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    config_id = db.Column(db.Integer, db.ForeignKey(OAIHarvestConfig.id),
+                          nullable=False)
+    identifier = db.Column(db.String(255), nullable=False)
+    datestamp = db.Column(db.String(32), nullable=True)
+    deleted = db.Column(db.Boolean(name='deleted'), nullable=False,
+                        default=False)
+    content_hash = db.Column(db.String(64), nullable=False)
+    updated = db.Column(db.DateTime, default=datetime.datetime.now,
+                        onupdate=datetime.datetime.now, nullable=False)
+
+    config = db.relationship(OAIHarvestConfig)
+
+
+class OAIHarvestSetLastrun(db.Model):
+    """Represents the 'lastrun' of a set of an OAIHarvestConfig.
+
+    It is stored when all the records of the set have been harvested, so that
+    every set starts the next harvest from its own date when others failed.
+    The rows are deleted once the 'lastrun' of the OAIHarvestConfig itself is
+    updated.
+    """
+
+    __tablename__ = 'oaiharvester_set_lastruns'
+    __table_args__ = (
+        db.UniqueConstraint('config_id', 'setspec'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    config_id = db.Column(db.Integer, db.ForeignKey(OAIHarvestConfig.id),
+                          nullable=False)
+    setspec = db.Column(db.String(255), nullable=False, server_default='')
+    lastrun = db.Column(db.DateTime, nullable=False)
+
+    config = db.relationship(OAIHarvestConfig)
+
+
+__all__ = ('OAIHarvestCheckpoint', 'OAIHarvestConfig', 'OAIHarvestRecordState',
+           'OAIHarvestSetLastrun')
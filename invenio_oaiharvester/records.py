@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio.
+# Copyright (C) 2016 CERN.
+#
+# Invenio is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+#
+# In applying this license, CERN does not
+# waive the privileges and immunities granted to it by virtue of its status
+# as an Intergovernmental Organization or submit itself to any jurisdiction.
+
+"""Compact representation of harvested records.
+
+:class:`CompactRecord` keeps the header fields and the raw XML of a record
+instead of its parsed tree, which is released with the page it comes from.
+The metadata is only parsed when it is accessed. :class:`RawRecord` is built
+from the bytes of the response, without parsing it at all.
+:class:`CompactHeader` is a tuple holding the fields of a header.
+"""
+
+from __future__ import absolute_import, print_function
+
+from collections import namedtuple
+
+from lxml import etree
+from sickle.app import DEFAULT_CLASS_MAP
+from sickle.utils import get_namespace, xml_to_dict
+
+
+class CompactRecord(object):
+    """Harvested OAI-PMH record holding only its header and raw XML.
+
+    It can be used in place of :class:`sickle.models.Record`: ``header``
+    returns the record itself, which exposes ``identifier``, ``datestamp``
+    and ``deleted``.
+
+    :param record_element: The XML element 'record'.
+    :type record_element: :class:`lxml.etree._Element`
+    """
+
+    __slots__ = ('identifier', 'datestamp', 'deleted', 'raw', '_metadata')
+
+    def __init__(self, record_element):
+        """Read the header and serialize the record element."""
+        namespace = get_namespace(record_element)
+        header = record_element.find('.//' + namespace + 'header')
+        self.identifier = header.findtext(namespace + 'identifier')
+        self.datestamp = header.findtext(namespace + 'datestamp')
+        self.deleted = header.get('status') == 'deleted'
+        #: The original XML as unicode.
+        self.raw = etree.tounicode(record_element)
+        self._metadata = None
+
+    def __repr__(self):
+        """Return the same representation as sickle records."""
+        if self.deleted:
+            return '<Record %s [deleted]>' % self.identifier
+        return '<Record %s>' % self.identifier
+
+    def __iter__(self):
+        """Iterate over the metadata fields."""
+        return iter(self.metadata.items())
+
+    @property
+    def header(self):
+        """Return the record, which holds the header fields."""
+        return self
+
+    @property
+    def xml(self):
+        """Parse the raw XML again."""
+        return etree.fromstring(self.raw)
+
+    @property
+    def metadata(self):
+        """Return the metadata as a dictionary, parsed on first access."""
+        if self._metadata is None:
+            xml = self.xml
+            namespace = get_namespace(xml)
+            node = xml.find('.//' + namespace + 'metadata')
+            self._metadata = xml_to_dict(node[0], strip_ns=True) \
+                if node is not None and len(node) else {}
+        return self._metadata
+
+
+class RawRecord(CompactRecord):
+    """Harvested OAI-PMH record holding its header and raw XML as bytes.
+
+    ``raw`` is a standalone XML document, encoded in UTF-8 without an XML
+    declaration, which declares the namespaces of the envelope it was taken
+    from.
+
+    :param raw: The XML of the record.
+    :type raw: bytes
+    :param identifier: The OAI identifier of the record.
+    :param datestamp: The datestamp of the record.
+    :param deleted: Whether the record is marked as deleted.
+    """
+
+    __slots__ = ()
+
+    def __init__(self, raw, identifier, datestamp=None, deleted=False):
+        """Initialize the record from its already extracted fields."""
+        self.identifier = identifier
+        self.datestamp = datestamp
+        self.deleted = deleted
+        self.raw = raw
+        self._metadata = None
+
+    @classmethod
+    def from_element(cls, record_element):
+        """Create the record from a parsed element."""
+        record = CompactRecord(record_element)
+        return cls(etree.tostring(record_element), record.identifier,
+                   record.datestamp, record.deleted)
+
+
+class CompactHeader(namedtuple('CompactHeader',
+                               ('identifier', 'datestamp', 'deleted'))):
+    """Header of an OAI-PMH record, as returned by ListIdentifiers.
+
+    Like records, it exposes its fields through ``header``, which returns
+    the header itself.
+    """
+
+    __slots__ = ()
+
+    @property
+    def header(self):
+        """Return the header itself."""
+        return self
+
+    @classmethod
+    def from_element(cls, header_element):
+        """Create the header from the XML element 'header'."""
+        namespace = get_namespace(header_element)
+        return cls(header_element.findtext(namespace + 'identifier'),
+                   header_element.findtext(namespace + 'datestamp'),
+                   header_element.get('status') == 'deleted')
+
+
+COMPACT_CLASS_MAP = dict(
+    DEFAULT_CLASS_MAP, GetRecord=CompactRecord, ListRecords=CompactRecord,
+    ListIdentifiers=CompactHeader.from_element
+)
+"""Class mapping returning :class:`CompactRecord` for the record verbs, and
+:class:`CompactHeader` for ListIdentifiers."""
+
+RAW_CLASS_MAP = dict(
+    DEFAULT_CLASS_MAP, GetRecord=RawRecord.from_element,
+    ListRecords=RawRecord.from_element,
+    ListIdentifiers=CompactHeader.from_element
+)
+"""Class mapping returning :class:`RawRecord` for the record verbs, and
+:class:`CompactHeader` for ListIdentifiers."""
@@ -34,4 +34,26 @@ Example subscriber
     def listener(sender, records, *args, **kwargs):
         for record in records:
             pass
+
+When the records are sent in batches (see :data:`oaiharvest_batch`), it only
+carries the number of records and of batches instead of the records:
+
+.. code-block:: python
+
+    def listener(sender, count, batches, name=None, **kwargs):
+        pass
+"""
+
+oaiharvest_batch = _signals.signal('oaiharvest-batch')
+"""
+This signal is sent for every batch of harvested records.
+
+The batches are numbered from 0 by ``sequence`` within a harvest. Example
+subscriber
+
+.. code-block:: python
+
+    def listener(sender, records, sequence, name=None, **kwargs):
+        for record in records:
+            pass
 """
@@ -21,16 +21,26 @@
 
 from __future__ import absolute_import, print_function
 
-from celery import shared_task
+import datetime
 
-from .api import get_records, list_records
+from celery import chord, group, shared_task
+from flask import current_app
+
+from .api import get_info_by_oai_name, get_records, iter_records, \
+    iter_records_delta, list_identifiers, plan_date_windows, signal_batches, \
+    update_lastrun
+from .errors import DeltaHarvestOptions, WrongDateCombination
 from .signals import oaiharvest_finished
-from .utils import get_identifier_names
+from .utils import date_windows, get_identifier_names, get_oaiharvest_object, \
+    open_output_file, write_identifiers
+
+DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
 
 
 @shared_task
 def get_specific_records(identifiers, metadata_prefix=None, url=None,
                          name=None, signals=True, encoding=None,
+                         concurrency=None, skip_errors=False, batch_size=None,
                          **kwargs):
     """Harvest specific records from an OAI repo via OAI-PMH identifiers.
 
@@ -42,21 +52,46 @@ def get_specific_records(identifiers, metadata_prefix=None, url=None,
     :param signals: If signals should be emitted about results.
     :param encoding: Override the encoding returned by the server. ISO-8859-1
                      if it is not provided by the server.
+    :param concurrency: Number of records fetched at the same time (optional).
+    :param skip_errors: Skip the records which could not be fetched instead
+                        of failing.
+    :param batch_size: Send the records in ``oaiharvest_batch`` signals of
+                       this size (defaults to ``OAIHARVESTER_BATCH_SIZE``).
+    :return: The errors of the skipped records, by identifier.
     """
+    if batch_size is None:
+        batch_size = current_app.config['OAIHARVESTER_BATCH_SIZE']
     identifiers = get_identifier_names(identifiers)
+    errors = {} if skip_errors else None
     request, records = get_records(identifiers, metadata_prefix, url, name,
-                                   encoding)
-    if signals:
+                                   encoding, concurrency, errors)
+    if signals and batch_size:
+        _consume(signal_batches(request, records, batch_size, name=name,
+                                **kwargs))
+    elif signals:
         oaiharvest_finished.send(request, records=records, name=name, **kwargs)
+    return dict((k, repr(v)) for k, v in (errors or {}).items())
 
 
 @shared_task
 def list_records_from_dates(metadata_prefix=None, from_date=None,
                             until_date=None, url=None,
                             name=None, setspecs=None, signals=True,
-                            encoding=None, **kwargs):
+                            encoding=None, batch_size=None,
+                            skip_unchanged=False, delta=None,
+                            checkpoint=None, concurrency=None, **kwargs):
     """Harvest multiple records from an OAI repo.
 
+    With ``batch_size``, the records are streamed and sent in
+    ``oaiharvest_batch`` signals while they are harvested, instead of being
+    sent all at once when the harvest has completed.
+
+    With ``delta``, only the new and changed records are harvested with
+    :func:`invenio_oaiharvester.api.iter_records_delta`. It defaults to the
+    ``deltaharvest`` of the OAIHarvestConfig. As the unchanged records are
+    never fetched, it cannot be combined with ``skip_unchanged`` or
+    ``checkpoint``.
+
     :param metadata_prefix: The prefix for the metadata return (e.g. 'oai_dc')
     :param from_date: The lower bound date for the harvesting (optional).
     :param until_date: The upper bound date for the harvesting (optional).
@@ -67,15 +102,172 @@ def list_records_from_dates(metadata_prefix=None, from_date=None,
     :param signals: If signals should be emitted about results.
     :param encoding: Override the encoding returned by the server. ISO-8859-1
                      if it is not provided by the server.
+    :param batch_size: Send the records in ``oaiharvest_batch`` signals of
+                       this size (defaults to ``OAIHARVESTER_BATCH_SIZE``).
+    :param skip_unchanged: Leave out the records whose content did not change
+                           since they were last harvested (requires ``name``).
+    :param delta: List the headers first and only fetch the new and changed
+                  records (requires ``name``).
+    :param checkpoint: Store the progress of the harvest to resume it
+                       (requires ``name``, defaults to
+                       ``OAIHARVESTER_CHECKPOINT``).
+    :param concurrency: Number of records fetched at the same time by a delta
+                        harvest (defaults to
+                        ``OAIHARVESTER_GET_RECORD_CONCURRENCY``).
+    :return: The number of harvested records.
     """
-    request, records = list_records(
-        metadata_prefix,
-        from_date,
-        until_date,
-        url,
-        name,
-        setspecs,
-        encoding
-    )
+    if batch_size is None:
+        batch_size = current_app.config['OAIHARVESTER_BATCH_SIZE']
+    if delta is None:
+        delta = name is not None and get_oaiharvest_object(name).deltaharvest
+    if delta:
+        if skip_unchanged or checkpoint:
+            raise DeltaHarvestOptions(
+                "Delta harvests cannot be combined with skip_unchanged or "
+                "checkpoint."
+            )
+        request, records = iter_records_delta(
+            metadata_prefix, from_date, until_date, name, setspecs, encoding,
+            concurrency=concurrency
+        )
+    else:
+        request, records = iter_records(
+            metadata_prefix, from_date, until_date, url, name, setspecs,
+            encoding, skip_unchanged=skip_unchanged, checkpoint=checkpoint
+        )
+    if signals and batch_size:
+        return _consume(signal_batches(request, records, batch_size,
+                                       name=name, **kwargs))
+
+    records = list(records)
     if signals:
         oaiharvest_finished.send(request, records=records, name=name, **kwargs)
+    return len(records)
+
+
+@shared_task
+def list_identifiers_from_dates(metadata_prefix=None, from_date=None,
+                                until_date=None, url=None, name=None,
+                                setspecs=None, encoding=None, output=None,
+                                details=False, incremental=False):
+    """List the identifiers of the records of an OAI repo.
+
+    Unless the encoding is overridden, the headers are read from the bytes
+    of the ListIdentifiers responses without parsing them, see
+    :func:`invenio_oaiharvester.api.list_identifiers`.
+
+    :param metadata_prefix: The prefix for the metadata return (e.g. 'oai_dc')
+    :param from_date: The lower bound date for the harvesting (optional).
+    :param until_date: The upper bound date for the harvesting (optional).
+    :param url: The The url to be used to create the endpoint.
+    :param name: The name of the OAIHarvestConfig to use instead of passing
+                 specific parameters.
+    :param setspecs: The 'set' criteria for the harvesting (optional).
+    :param encoding: Override the encoding returned by the server. ISO-8859-1
+                     if it is not provided by the server.
+    :param output: Path of a file the identifiers are written to, one per
+                   line, compressed according to its extension (optional).
+    :param details: Add the datestamp and status of the records to the lines.
+    :param incremental: Without ``from_date``, start from the 'lastrun' of
+                        the OAIHarvestConfig and of its sets.
+    :return: The number of identifiers.
+    """
+    _, headers = list_identifiers(metadata_prefix, from_date, until_date,
+                                  url, name, setspecs, encoding,
+                                  raw=encoding is None,
+                                  incremental=incremental)
+    if output is None:
+        return _consume(headers)
+    with open_output_file(output) as fileobj:
+        return write_identifiers(headers, fileobj, details)
+
+
+@shared_task
+def list_records_partitioned(metadata_prefix=None, from_date=None,
+                             until_date=None, url=None, name=None,
+                             setspecs=None, signals=True, encoding=None,
+                             windows=4, max_records=None, **kwargs):
+    """Harvest multiple records from an OAI repo, one task per date window.
+
+    The ``[from_date, until_date]`` range is split into ``windows`` windows,
+    harvested in parallel by :func:`list_records_from_dates`. The 'lastrun'
+    of the OAIHarvestConfig is only updated once every window has been
+    harvested successfully.
+
+    If ``max_records`` is given, the windows are then bisected until each
+    one holds at most ``max_records`` records (see
+    :func:`invenio_oaiharvester.api.plan_date_windows`).
+
+    :param metadata_prefix: The prefix for the metadata return (e.g. 'oai_dc')
+    :param from_date: The lower bound date for the harvesting (defaults to the
+                      'lastrun' of the OAIHarvestConfig).
+    :param until_date: The upper bound date for the harvesting (defaults to
+                       today, in UTC).
+    :param url: The The url to be used to create the endpoint.
+    :param name: The name of the OAIHarvestConfig to use instead of passing
+                 specific parameters.
+    :param setspecs: The 'set' criteria for the harvesting (optional).
+    :param signals: If signals should be emitted about results.
+    :param encoding: Override the encoding returned by the server. ISO-8859-1
+                     if it is not provided by the server.
+    :param windows: The number of date windows to harvest.
+    :param max_records: The max number of records in a window (optional).
+    """
+    lastrun_date = datetime.datetime.utcnow()
+    update_name = None
+    if from_date is None and until_date is None and name is not None:
+        update_name = name
+
+    start, end = from_date, until_date
+    if start is None:
+        if name is None:
+            raise WrongDateCombination("A 'from' date is required.")
+        start = get_info_by_oai_name(name)[2]
+    if end is None:
+        end = lastrun_date.strftime('%Y-%m-%d')
+    if start[:10] > end[:10]:
+        raise WrongDateCombination("'Until' date larger than 'from' date.")
+
+    windows = date_windows(start, end, windows)
+    if max_records:
+        windows = [
+            window for window_start, window_end in windows
+            for window in plan_date_windows(
+                window_start, window_end, max_records, metadata_prefix, url,
+                name, setspecs, encoding
+            )
+        ]
+
+    header = group(
+        list_records_from_dates.s(
+            metadata_prefix, window_start, window_end, url, name, setspecs,
+            signals, encoding, **kwargs
+        ) for window_start, window_end in windows
+    )
+    return chord(header)(finish_partitioned_harvest.s(
+        name=update_name, lastrun=lastrun_date.strftime(DATETIME_FORMAT)
+    ))
+
+
+def _consume(records):
+    """Consume the records, returning their number."""
+    count = 0
+    for _ in records:
+        count += 1
+    return count
+
+
+@shared_task
+def finish_partitioned_harvest(counts, name=None, lastrun=None):
+    """Merge the results of the windows of a partitioned harvest.
+
+    :param counts: The number of records harvested in each window.
+    :param name: The name of the OAIHarvestConfig to update (optional).
+    :param lastrun: The new 'lastrun' of the OAIHarvestConfig.
+    :return: The total number of harvested records.
+    """
+    if name is not None:
+        update_lastrun(
+            name, datetime.datetime.strptime(lastrun, DATETIME_FORMAT)
+        )
+    return sum(counts)
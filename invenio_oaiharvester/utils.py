@@ -21,20 +21,147 @@
 
 from __future__ import absolute_import, print_function, unicode_literals
 
-import codecs
+import gzip
+import hashlib
+import io
 import itertools
+import json
+import math
+import mmap
 import os
 import re
+import sys
 import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import closing
-from datetime import datetime
+from datetime import datetime, timedelta
 
 from flask import current_app
 from lxml import etree
 
 from .errors import InvenioOAIHarvesterConfigNotFound
 
-REGEXP_OAI_ID = re.compile(r"<identifier.*?>(.*?)</identifier>", re.DOTALL)
+try:
+    from queue import Full, Queue
+except ImportError:  # pragma: no cover
+    from Queue import Full, Queue
+
+ENVELOPE_END = b'</OAI-PMH>'
+
+COMPRESSION_SUFFIXES = {
+    None: '',
+    'gzip': '.gz',
+    'zstd': '.zst',
+}
+"""Suffix added to the names of the files written with each compression."""
+
+_HEADER_FIELD_PATTERN = (r'<(?:[\w.-]+:)?{0}(?:\s[^>]*)?>([^<&]*)'
+                         r'</(?:[\w.-]+:)?{0}\s*>')
+_HEADER_START_PATTERN = r'<(?:[\w.-]+:)?header[\s/>]'
+# The identifier and datestamp are matched along with the header when they
+# are its first elements, as they usually are.
+_HEADER_PATTERN = (r'<(?:([\w.-]+):)?header(\s[^>]*)?(?<!/)>('
+                   r'(?:\s*' + _HEADER_FIELD_PATTERN.format('identifier') +
+                   r'\s*' + _HEADER_FIELD_PATTERN.format('datestamp') + r')?'
+                   r'[^<]*(?:<(?!/(?:[\w.-]+:)?header\s*>)[^<]*)*)'
+                   r'</(?:[\w.-]+:)?header\s*>')
+_HEADER_STATUS_PATTERN = r'\sstatus\s*=\s*["\']([^"\'<&]*)["\']'
+_NAMESPACE_DECLARATION_PATTERN = \
+    r'\sxmlns(?::([\w.-]+))?\s*=\s*["\']([^"\']*)["\']'
+
+
+def _compile_header_regexps(convert):
+    return (
+        re.compile(convert(_HEADER_PATTERN)),
+        re.compile(convert(_HEADER_FIELD_PATTERN.format('identifier'))),
+        re.compile(convert(_HEADER_FIELD_PATTERN.format('datestamp'))),
+        re.compile(convert(_HEADER_STATUS_PATTERN)),
+        re.compile(convert(_NAMESPACE_DECLARATION_PATTERN)),
+        re.compile(convert(_HEADER_START_PATTERN)),
+    )
+
+
+_HEADER_REGEXPS = {
+    type(''): _compile_header_regexps(lambda pattern: pattern),
+    bytes: _compile_header_regexps(lambda pattern: pattern.encode('ascii')),
+}
+
+
+class NamespacePaths(object):
+    """Compiled lookups of the OAI-PMH elements for one namespace.
+
+    :param oai_namespace: the OAI-PMH namespace, falsy for elements without
+        a namespace.
+    :param nsmap: the namespace map of the envelopes built around records.
+    """
+
+    def __init__(self, oai_namespace, nsmap):
+        """Compile the XPath expressions for the namespace."""
+        self.nsmap = dict(nsmap)
+        self.tag_prefix = "{{{0}}}".format(oai_namespace) if oai_namespace \
+            else ""
+        namespaces = {'o': oai_namespace} if oai_namespace else None
+        prefix = 'o:' if oai_namespace else ''
+
+        def xpath(path):
+            return etree.XPath(path.format(prefix), namespaces=namespaces)
+
+        self.response_dates = xpath('.//{0}responseDate')
+        self.requests = xpath('.//{0}request')
+        self.records = xpath('.//{0}record')
+        self.identifiers = xpath('.//{0}identifier')
+        self.headers = xpath('descendant-or-self::{0}header')
+        self.datestamps = xpath('{0}datestamp')
+        self.declarations = [
+            ' xmlns{0}="{1}"'.format(':' + key if key else '', value)
+            .encode('utf-8') for key, value in self.nsmap.items()
+        ]
+
+    def tag(self, name):
+        """Return the qualified tag of an OAI-PMH element."""
+        return "{0}{1}".format(self.tag_prefix, name)
+
+
+_NAMESPACE_PATHS = {}
+
+
+def register_namespaces(nsmap):
+    """Compile the lookups for the namespaces of a namespace map.
+
+    Called with ``OAIHARVESTER_DEFAULT_NAMESPACE_MAP`` when the extension is
+    initialized; the map also becomes the one used when no namespace is
+    given to the extraction functions.
+
+    :param nsmap: namespace map, e.g. ``{'OAI-PMH': '...OAI/2.0/'}``.
+    """
+    _NAMESPACE_PATHS[''] = NamespacePaths('', nsmap)
+    for namespace in nsmap.values():
+        _NAMESPACE_PATHS[namespace] = NamespacePaths(
+            namespace, {'OAI-PMH': namespace}
+        )
+
+
+def get_namespace_paths(oai_namespace):
+    """Return the compiled lookups of an OAI-PMH namespace.
+
+    :param oai_namespace: the OAI-PMH namespace, falsy for elements without
+        a namespace.
+    :rtype: :class:`NamespacePaths`
+    """
+    key = oai_namespace or ''
+    paths = _NAMESPACE_PATHS.get(key)
+    if paths is None:
+        if key:
+            paths = NamespacePaths(key, {'OAI-PMH': key})
+        else:
+            paths = NamespacePaths('', current_app.config.get(
+                "OAIHARVESTER_DEFAULT_NAMESPACE_MAP"
+            ))
+        _NAMESPACE_PATHS[key] = paths
+    return paths
 
 
 def record_extraction_from_file(
@@ -59,6 +186,46 @@ def record_extraction_from_file(
     return list_of_records
 
 
+def iter_records_from_file(
+        path,
+        oai_namespace="http://www.openarchives.org/OAI/2.0/"):
+    """Given a harvested file yield every record incl. headers.
+
+    Unlike :func:`record_extraction_from_file`, the file is parsed
+    incrementally and each record is discarded once yielded, so the memory
+    needed does not depend on the size of the file. It works on OAI-PMH
+    responses as well as on the files created by :func:`write_to_dir`,
+    compressed or not.
+
+    :param path: is the path of the file harvested
+    :type path: str
+
+    :param oai_namespace: optionally provide the OAI-PMH namespace
+    :type oai_namespace: str
+
+    :return: generator of XML records as string
+    :rtype: str
+    """
+    paths = get_namespace_paths(oai_namespace)
+    record_tag = paths.tag("record")
+    tags = (paths.tag("responseDate"), paths.tag("request"), record_tag)
+
+    headers = []
+    with open_input_file(path) as xml_file:
+        for _, element in etree.iterparse(xml_file, events=('end',),
+                                          tag=tags):
+            if element.tag != record_tag:
+                headers.append(element)
+                continue
+            wrapper = etree.Element("OAI-PMH", nsmap=paths.nsmap)
+            for header in headers:
+                wrapper.append(header)
+            # Appending moves the record out of the parsed tree, which is
+            # therefore never built completely.
+            wrapper.append(element)
+            yield etree.tostring(wrapper)
+
+
 def record_extraction_from_string(
         xml_string,
         oai_namespace="http://www.openarchives.org/OAI/2.0/"):
@@ -73,34 +240,208 @@ def record_extraction_from_string(
     :return: return a list of XML records as string
     :rtype: str
     """
-    if oai_namespace:
-        nsmap = {
-            'OAI-PMH': oai_namespace
-        }
-    else:
-        nsmap = current_app.config.get("OAIHARVESTER_DEFAULT_NAMESPACE_MAP")
-    namespace_prefix = "{{{0}}}".format(oai_namespace)
+    paths = get_namespace_paths(oai_namespace)
     root = etree.fromstring(xml_string)
-    headers = []
-    headers.extend(
-        root.findall(".//{0}responseDate".format(namespace_prefix), nsmap)
-    )
-    headers.extend(
-        root.findall(".//{0}request".format(namespace_prefix), nsmap)
-    )
+    records = paths.records(root)
+    if not records:
+        return []
 
-    records = root.findall(".//{0}record".format(namespace_prefix), nsmap)
+    # The envelope shared by all records is serialized only once.
+    wrapper = etree.Element("OAI-PMH", nsmap=paths.nsmap)
+    wrapper.text = ''
+    for header in paths.response_dates(root) + paths.requests(root):
+        wrapper.append(header)
+    envelope_start = etree.tostring(wrapper)[:-len(ENVELOPE_END)]
 
-    list_of_records = []
+    # Moving the records into the wrapper puts them in the namespace context
+    # of the envelope; the declarations repeated on each serialized record
+    # are then stripped, as they belong to the envelope.
     for record in records:
-        wrapper = etree.Element("OAI-PMH", nsmap=nsmap)
-        for header in headers:
-            wrapper.append(header)
         wrapper.append(record)
-        list_of_records.append(etree.tostring(wrapper))
+
+    list_of_records = []
+    for record in records:
+        serialized = etree.tostring(record)
+        start_tag_end = serialized.index(b'>')
+        start_tag = serialized[:start_tag_end]
+        for declaration in paths.declarations:
+            start_tag = start_tag.replace(declaration, b'', 1)
+        list_of_records.append(
+            envelope_start + start_tag + serialized[start_tag_end:] +
+            ENVELOPE_END
+        )
     return list_of_records
 
 
+def _iter_header_scan(xml_string, oai_namespace):
+    """Read the OAI header fields of the records without parsing them.
+
+    :return: generator of ``(fields, match)`` for every header found, where
+        ``fields`` is ``(identifier, datestamp, status)`` or ``None`` when the
+        header cannot be read safely without a parser (CDATA, entities, or a
+        header which may not be in ``oai_namespace``), and ``match`` is the
+        match of the header.
+    """
+    regexps = _HEADER_REGEXPS.get(type(xml_string))
+    if regexps is None:
+        return
+    header_regexp, identifier_regexp, datestamp_regexp, status_regexp, \
+        declaration_regexp, _ = regexps
+    decode = isinstance(xml_string, bytes)
+    if decode:
+        oai_namespace = (oai_namespace or '').encode('utf-8')
+    empty = xml_string[:0]
+    declarations = []
+    # Whether the headers of a prefix are known to be in ``oai_namespace``,
+    # until another namespace declaration is found.
+    known_prefixes = {}
+    scanned = 0
+    for header in header_regexp.finditer(xml_string):
+        prefix, attributes, _, identifier, datestamp = header.groups()
+        start, end = header.span(3)
+
+        # The namespace of the header is only known for sure when every
+        # declaration of its prefix found before its content is the expected
+        # one. The declarations made within the previous headers are out of
+        # its scope.
+        found = declaration_regexp.findall(xml_string, scanned, start)
+        scanned = header.end()
+        if found:
+            declarations.extend(found)
+            known_prefixes.clear()
+        known = known_prefixes.get(prefix)
+        if known is None:
+            namespaces = [namespace for name, namespace in declarations
+                          if name == (prefix or empty)]
+            if oai_namespace:
+                known = bool(namespaces) and all(
+                    namespace == oai_namespace for namespace in namespaces
+                )
+            else:
+                known = not prefix and not any(namespaces)
+            known_prefixes[prefix] = known
+
+        if known and identifier is None:
+            identifier = identifier_regexp.search(xml_string, start, end)
+            if identifier is not None:
+                identifier = identifier.group(1)
+                datestamp = datestamp_regexp.search(xml_string, start, end)
+                datestamp = datestamp.group(1) if datestamp else None
+        if not known or identifier is None:
+            yield None, header
+            continue
+        status = status_regexp.search(attributes) if attributes else None
+        status = status.group(1) if status else None
+        if decode:
+            identifier = identifier.decode('utf-8')
+            datestamp = datestamp.decode('utf-8') if datestamp else datestamp
+            status = status.decode('utf-8') if status else status
+        yield (identifier, datestamp, status), header
+
+
+def _header_scan(xml_string, oai_namespace):
+    """Read the OAI header fields of a record without parsing it.
+
+    :return: ``(identifier, datestamp, status)`` or ``None`` when the record
+        cannot be read safely without a parser (see
+        :func:`_iter_header_scan`).
+    """
+    for fields, _ in _iter_header_scan(xml_string, oai_namespace):
+        return fields
+    return None
+
+
+def scan_headers(xml_string,
+                 oai_namespace="http://www.openarchives.org/OAI/2.0/"):
+    """Read the header fields of every record of a response without parsing.
+
+    The headers are read with the regular expressions of
+    :func:`header_extraction_from_string`, e.g. from a ListIdentifiers
+    response.
+
+    :param xml_string: OAI-PMH XML response
+    :type xml_string: str or bytes
+
+    :param oai_namespace: optionally provide the OAI-PMH namespace
+    :type oai_namespace: str
+
+    :return: list of ``(identifier, datestamp, status)`` tuples and the offset
+        of the end of the last header, or ``None`` when a header cannot be
+        read without a parser.
+    :rtype: tuple
+    """
+    regexps = _HEADER_REGEXPS.get(type(xml_string))
+    if regexps is None:
+        return None
+    start_regexp = regexps[-1]
+    headers = []
+    end = 0
+    for fields, header in _iter_header_scan(xml_string, oai_namespace):
+        # Self-closing or unterminated headers are not matched.
+        if fields is None or \
+                start_regexp.search(xml_string, end, header.start()):
+            return None
+        headers.append(fields)
+        end = header.end()
+    if start_regexp.search(xml_string, end):
+        return None
+    return headers, end
+
+
+def _header_parse(xml_string, oai_namespace):
+    """Read the OAI header fields of a record with lxml."""
+    paths = get_namespace_paths(oai_namespace)
+    root = etree.fromstring(xml_string)
+    nodes = paths.identifiers(root)
+    identifier = nodes[0].text if nodes else None
+    headers = paths.headers(root)
+    if not headers:
+        return identifier, None, None
+    nodes = paths.datestamps(headers[0])
+    return (
+        identifier,
+        nodes[0].text if nodes else None,
+        headers[0].get("status"),
+    )
+
+
+def header_extraction_from_string(
+        xml_string,
+        oai_namespace="http://www.openarchives.org/OAI/2.0/"):
+    """Given a OAI-PMH record string return its header fields.
+
+    The header is read with regular expressions from the beginning of the
+    record when it is declared in ``oai_namespace``; records which cannot be
+    read that way (no ``header`` element, another namespace, CDATA sections
+    or entities in the values) are parsed with lxml.
+
+    :param xml_string: OAI-PMH XML
+    :type xml_string: str or bytes
+
+    :param oai_namespace: optionally provide the OAI-PMH namespace
+    :type oai_namespace: str
+
+    :return: ``(identifier, datestamp, status)``; ``status`` is ``None``
+        unless the record is marked, e.g. ``'deleted'``.
+    :rtype: tuple
+    """
+    return _header_scan(xml_string, oai_namespace) or \
+        _header_parse(xml_string, oai_namespace)
+
+
+def header_extraction_from_strings(
+        xml_strings,
+        oai_namespace="http://www.openarchives.org/OAI/2.0/"):
+    """Return the header fields of every given OAI-PMH record string.
+
+    :param xml_strings: iterable of OAI-PMH XML records
+    :param oai_namespace: optionally provide the OAI-PMH namespace
+    :return: list of ``(identifier, datestamp, status)`` tuples
+    """
+    return [header_extraction_from_string(xml_string, oai_namespace)
+            for xml_string in xml_strings]
+
+
 def identifier_extraction_from_string(
         xml_string,
         oai_namespace="http://www.openarchives.org/OAI/2.0/"):
@@ -115,17 +456,20 @@ def identifier_extraction_from_string(
     :return: OAI identifier
     :rtype: str
     """
-    if oai_namespace:
-        nsmap = {
-            'OAI-PMH': oai_namespace
-        }
-    else:
-        nsmap = current_app.config.get("OAIHARVESTER_DEFAULT_NAMESPACE_MAP")
-    namespace_prefix = "{{{0}}}".format(oai_namespace)
-    root = etree.fromstring(xml_string)
-    node = root.find(".//{0}identifier".format(namespace_prefix), nsmap)
-    if node is not None:
-        return node.text
+    return header_extraction_from_string(xml_string, oai_namespace)[0]
+
+
+def identifiers_extraction_from_strings(
+        xml_strings,
+        oai_namespace="http://www.openarchives.org/OAI/2.0/"):
+    """Return the OAI identifier of every given OAI-PMH record string.
+
+    :param xml_strings: iterable of OAI-PMH XML records
+    :param oai_namespace: optionally provide the OAI-PMH namespace
+    :return: list of OAI identifiers
+    """
+    return [header[0] for header in
+            header_extraction_from_strings(xml_strings, oai_namespace)]
 
 
 def get_identifier_names(identifiers):
@@ -172,10 +516,11 @@ def check_or_create_dir(output_dir):
     return path
 
 
-def create_file_name(output_dir):
+def create_file_name(output_dir, suffix='.xml'):
     """Create a random file name.
 
     :param output_dir: The directory where the file should be created.
+    :param suffix: The extension of the file.
     :return: random filename
     """
     prefix = 'oaiharvest_' + datetime.now().strftime('%Y-%m-%d') + '_'
@@ -183,7 +528,7 @@ def create_file_name(output_dir):
     with closing(
         tempfile.NamedTemporaryFile(
             prefix=prefix,
-            suffix='.xml',
+            suffix=suffix,
             dir=output_dir,
             mode='w+'
         )
@@ -193,6 +538,56 @@ def create_file_name(output_dir):
     return file_name
 
 
+class FileAllocator(object):
+    """Allocate the names of the files written by a harvest.
+
+    The files are named ``<date>/<shard>/<run id>-<sequence><suffix>`` in the
+    output directory, where ``shard`` is the sequence number divided by
+    ``files_per_directory``, so that no directory holds more files than
+    that, and sort in the order they were written.
+
+    :param output_path: The directory where the files are created.
+    :param run_id: Identifier of the run (defaults to the current time).
+    :param suffix: The extension of the files.
+    :param files_per_directory: Max number of files in a directory, or
+                                ``None`` to write them in the date directory.
+    :param date: The date of the run (defaults to today).
+    """
+
+    def __init__(self, output_path, run_id=None, suffix='.xml',
+                 files_per_directory=None, date=None):
+        """Initialize the allocator."""
+        now = datetime.now()
+        self.run_id = run_id or now.strftime('%H%M%S%f')
+        self.directory = os.path.join(
+            output_path, (date or now).strftime('%Y-%m-%d')
+        )
+        self.suffix = suffix
+        self.files_per_directory = files_per_directory
+        self._sequence = itertools.count()
+        self._created = set()
+
+    def __call__(self):
+        """Return the path of the next file, creating its directory."""
+        sequence = next(self._sequence)
+        directory = self.directory
+        if self.files_per_directory:
+            directory = os.path.join(directory, '{0:04d}'.format(
+                sequence // self.files_per_directory
+            ))
+        if directory not in self._created:
+            if not os.path.isdir(directory):
+                try:
+                    os.makedirs(directory)
+                except OSError:
+                    if not os.path.isdir(directory):
+                        raise
+            self._created.add(directory)
+        return os.path.join(directory, '{0}-{1:06d}{2}'.format(
+            self.run_id, sequence, self.suffix
+        ))
+
+
 def chunks(iterable, size):
     """Yield successive chunks of specific size from iterable."""
     iterable = iter(iterable)
@@ -203,29 +598,552 @@ def chunks(iterable, size):
         yield chunk
 
 
-def write_to_dir(records, output_dir, max_records=1000, encoding='utf-8'):
+def _open_new(path):
+    """Create a binary file, failing if it exists.
+
+    The files of another run are never overwritten.
+    """
+    return os.fdopen(
+        os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL), 'wb'
+    )
+
+
+class _HashingFile(object):
+    """Binary file counting and hashing the bytes written to it."""
+
+    def __init__(self, path):
+        """Open the file."""
+        self.size = 0
+        self._file = _open_new(path)
+        self._hash = hashlib.sha256()
+
+    def write(self, data):
+        """Write bytes."""
+        self._file.write(data)
+        self._hash.update(data)
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        """Flush the file."""
+        self._file.flush()
+
+    def close(self):
+        """Close the file."""
+        self._file.close()
+
+    def hexdigest(self):
+        """Return the SHA-256 checksum of the bytes written."""
+        return self._hash.hexdigest()
+
+
+def _compressed_writer(fileobj, compression, path):
+    """Return a writer compressing to ``fileobj``, which it does not close."""
+    if compression is None:
+        return fileobj
+    if compression == 'gzip':
+        return gzip.GzipFile(filename=path, mode='wb', fileobj=fileobj)
+    if compression == 'zstd':
+        import zstandard
+        return zstandard.ZstdCompressor().stream_writer(fileobj,
+                                                        closefd=False)
+    raise ValueError('Unknown compression: {0}'.format(compression))
+
+
+def open_input_file(path):
+    """Open a file written by :func:`write_to_dir` for reading bytes.
+
+    The compression is guessed from the extension of the file.
+
+    :param path: The path of the file.
+    :return: binary file object
+    """
+    if path.endswith(COMPRESSION_SUFFIXES['gzip']):
+        return gzip.open(path, 'rb')
+    if path.endswith(COMPRESSION_SUFFIXES['zstd']):
+        import zstandard
+        return zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'))
+    return open(path, 'rb')
+
+
+def open_output_file(path):
+    """Open a file for writing bytes, compressed according to its extension.
+
+    :param path: The path of the file.
+    :return: binary file object
+    """
+    if path.endswith(COMPRESSION_SUFFIXES['gzip']):
+        return gzip.open(path, 'wb')
+    if path.endswith(COMPRESSION_SUFFIXES['zstd']):
+        import zstandard
+        return zstandard.ZstdCompressor().stream_writer(open(path, 'wb'))
+    return open(path, 'wb')
+
+
+def _iter_chunks(records, encoding, max_records, max_bytes, overhead,
+                 identifiers=False):
+    """Split the records in chunks of ``(identifier, raw bytes)`` tuples."""
+    chunk, size = [], overhead
+    for record in records:
+        raw = record.raw
+        if not isinstance(raw, bytes):
+            raw = raw.encode(encoding)
+        if chunk and (len(chunk) >= max_records or
+                      max_bytes and size + len(raw) > max_bytes):
+            yield chunk
+            chunk, size = [], overhead
+        chunk.append((record.header.identifier if identifiers else None, raw))
+        size += len(raw)
+    if chunk:
+        yield chunk
+
+
+def _write_chunk(path, chunk, compression, start, end):
+    """Write a chunk of records to a file.
+
+    :return: manifest entry of the file, with the ``(identifier, offset,
+        length)`` of each record in the uncompressed content.
+    """
+    output = _HashingFile(path)
+    try:
+        writer = _compressed_writer(output, compression, path)
+        writer.write(start)
+        offset = len(start)
+        offsets = []
+        for identifier, raw in chunk:
+            writer.write(raw)
+            offsets.append((identifier, offset, len(raw)))
+            offset += len(raw)
+        writer.write(end)
+        if writer is not output:
+            writer.close()
+    finally:
+        output.close()
+    return {
+        'records': len(chunk),
+        'bytes': output.size,
+        'sha256': output.hexdigest(),
+        'offsets': offsets,
+    }
+
+
+def write_to_dir(records, output_dir, max_records=1000, encoding='utf-8',
+                 compression=None, max_bytes=None, manifest=None, name=None,
+                 run_id=None, files_per_directory=None, workers=None):
     """Check if the output directory exists, and creates it if it does not.
 
+    A new file is started once ``max_records`` records or, if given,
+    ``max_bytes`` bytes (before compression) have been written to the current
+    one. Every file holds at least one record.
+
+    With ``manifest``, a JSON manifest listing the files created with their
+    number of records, size and SHA-256 checksum is written, along with an
+    index of the position of every record (see :class:`RecordIndex`).
+
+    The files are named by a :class:`FileAllocator`, in the subdirectory
+    ``name`` of the output directory if given.
+
+    With several ``workers``, the files are encoded, compressed and written
+    by a pool of threads, with at most twice as many chunks of records in
+    memory as workers.
+
     :param records: harvested records.
     :param output_dir: directory where the output should be sent.
     :param max_records: max number of records to be written in a single file.
+    :param encoding: encoding of the records given as unicode; records given
+                     as bytes are written as is.
+    :param compression: ``None``, ``'gzip'`` or ``'zstd'``.
+    :param max_bytes: max size of a single file, before compression.
+    :param manifest: file name of the manifest, in the date directory of the
+                     run and prefixed with the run id like its files
+                     (optional). The index is written next to it, with the
+                     ``.index`` extension.
+    :param name: name of the OAIHarvestConfig harvested (optional).
+    :param run_id: identifier of the run (defaults to the current time).
+    :param files_per_directory: max number of files in a directory (defaults
+                                to ``OAIHARVESTER_FILES_PER_DIRECTORY``).
+    :param workers: number of files written at the same time (defaults to
+                    ``OAIHARVESTER_WRITE_CONCURRENCY``).
 
     :return: paths to files created, total number of records
     """
     if not records:
         return [], 0
+    suffix = '.xml' + COMPRESSION_SUFFIXES[compression]
 
-    output_path = check_or_create_dir(output_dir)
+    if files_per_directory is None:
+        files_per_directory = \
+            current_app.config['OAIHARVESTER_FILES_PER_DIRECTORY']
+    if workers is None:
+        workers = current_app.config['OAIHARVESTER_WRITE_CONCURRENCY']
+    allocate = FileAllocator(
+        check_or_create_dir(os.path.join(output_dir, name or '')),
+        run_id=run_id, suffix=suffix, files_per_directory=files_per_directory
+    )
     files_created = []
+    entries = []
     total = 0  # total number of records processed
 
-    for chunk in chunks(records, max_records):
-        files_created.append(create_file_name(output_path))
-        with codecs.open(files_created[-1], 'w+', encoding=encoding) as f:
-            f.write('<ListRecords>')
-            for record in chunk:
-                f.write(record.raw)
-                total += 1
-            f.write('</ListRecords>')
+    start, end = '<ListRecords>'.encode(encoding), \
+        '</ListRecords>'.encode(encoding)
+
+    def write(item):
+        path, chunk = item
+        return path, _write_chunk(path, chunk, compression, start, end)
+
+    # The files are allocated in order, before being written.
+    items = ((allocate(), chunk) for chunk in _iter_chunks(
+        records, encoding, max_records, max_bytes, len(start) + len(end),
+        manifest is not None
+    ))
+    for path, entry in iter_mapped(write, items, workers=workers):
+        files_created.append(path)
+        entry['path'] = os.path.relpath(path, allocate.directory)
+        entries.append(entry)
+        total += entry['records']
 
+    # Like the files, no manifest is written when there was no record.
+    if manifest is not None and entries:
+        write_manifest(os.path.join(allocate.directory, '{0}-{1}'.format(
+            allocate.run_id, manifest
+        )), entries)
     return files_created, total
+
+
+def write_manifest(path, entries):
+    """Write the manifest and the index of the files of a run.
+
+    :param path: path of the manifest, which must not exist yet.
+    :param entries: manifest entries of the files, as returned by
+                    ``_write_chunk``.
+    """
+    index_path = os.path.splitext(path)[0] + '.index'
+    with _open_new(index_path) as f:
+        for entry in entries:
+            for identifier, offset, length in entry['offsets']:
+                f.write('{0}\t{1}\t{2}\t{3}\n'.format(
+                    identifier, entry['path'], offset, length
+                ).encode('utf-8'))
+    files = [dict((key, value) for key, value in entry.items()
+                  if key != 'offsets') for entry in entries]
+    with _open_new(path) as f:
+        f.write(json.dumps({
+            'files': files,
+            'records': sum(entry['records'] for entry in entries),
+            'index': os.path.basename(index_path),
+        }, indent=2, sort_keys=True).encode('utf-8'))
+
+
+def write_identifiers(headers, output, details=False):
+    """Write the identifiers of records to a file, one per line.
+
+    The lines are written while the headers are consumed, so that the file
+    is filled as the identifiers are listed.
+
+    :param headers: iterable of headers, e.g. as returned by
+                    :func:`~.api.list_identifiers`.
+    :param output: binary file object.
+    :param details: add the datestamp and ``deleted`` status of the records
+                    to the lines, separated by tabs.
+    :return: number of identifiers written
+    """
+    total = 0
+    for header in headers:
+        if details:
+            line = u'{0}\t{1}\t{2}\n'.format(
+                header.identifier, header.datestamp or u'',
+                u'deleted' if header.deleted else u''
+            )
+        else:
+            line = header.identifier + u'\n'
+        output.write(line.encode('utf-8'))
+        total += 1
+    return total
+
+
+class RecordIndex(object):
+    """Read the records written by :func:`write_to_dir` by identifier.
+
+    The index of the manifest is loaded once; every record is then read with
+    a single seek in its file, or from a memory map of it with ``use_mmap``.
+    Records of compressed files are read by decompressing the file up to them.
+
+    :param manifest_path: path of the manifest written by
+                          :func:`write_to_dir`.
+    :param use_mmap: map the uncompressed files in memory.
+    """
+
+    def __init__(self, manifest_path, use_mmap=False):
+        """Load the manifest and its index."""
+        self.directory = os.path.dirname(os.path.abspath(manifest_path))
+        with io.open(manifest_path, encoding='utf-8') as f:
+            self.manifest = json.load(f)
+        self.use_mmap = use_mmap
+        self._index = {}
+        index_path = os.path.join(self.directory, self.manifest['index'])
+        with io.open(index_path, encoding='utf-8') as f:
+            for line in f:
+                identifier, path, offset, length = \
+                    line.rstrip('\n').split('\t')
+                self._index[identifier] = (path, int(offset), int(length))
+        self._files = {}
+
+    def __contains__(self, identifier):
+        """Check whether a record is in the index."""
+        return identifier in self._index
+
+    def __len__(self):
+        """Return the number of records in the index."""
+        return len(self._index)
+
+    def __enter__(self):
+        """Return the index."""
+        return self
+
+    def __exit__(self, *args):
+        """Close the files opened."""
+        self.close()
+
+    def get(self, identifier):
+        """Return the XML of a record, or ``None`` if it is not indexed.
+
+        :param identifier: OAI identifier of the record.
+        :rtype: bytes
+        """
+        try:
+            path, offset, length = self._index[identifier]
+        except KeyError:
+            return None
+        path = os.path.join(self.directory, path)
+        if any(path.endswith(suffix)
+               for suffix in COMPRESSION_SUFFIXES.values() if suffix):
+            with closing(open_input_file(path)) as f:
+                f.seek(offset)
+                return f.read(length)
+        f = self._open(path)
+        if self.use_mmap:
+            return f[offset:offset + length]
+        f.seek(offset)
+        return f.read(length)
+
+    def _open(self, path):
+        """Return the open file, or memory map, of an uncompressed file."""
+        f = self._files.get(path)
+        if f is None:
+            f = open(path, 'rb')
+            if self.use_mmap:
+                with closing(f):
+                    f = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._files[path] = f
+        return f
+
+    def close(self):
+        """Close the files opened."""
+        for f in self._files.values():
+            f.close()
+        self._files.clear()
+
+
+def iter_mapped(function, iterable, workers=1, maxsize=None):
+    """Apply a function to every item in a pool of threads, in order.
+
+    The items are submitted as the results are consumed, so that at most
+    ``maxsize`` of them are pending at the same time. Exceptions are raised
+    again in the caller.
+
+    :param function: the function to apply.
+    :param iterable: the items, consumed in the calling thread.
+    :param workers: number of threads; with one, everything is done in the
+                    calling thread.
+    :param maxsize: max number of pending items (defaults to twice the number
+                    of workers).
+    :return: generator of the results, in the order of the items.
+    """
+    if workers <= 1:
+        for item in iterable:
+            yield function(item)
+        return
+
+    maxsize = maxsize or 2 * workers
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        try:
+            for item in iterable:
+                if len(pending) >= maxsize:
+                    yield pending.popleft().result()
+                pending.append(executor.submit(function, item))
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def iter_threaded(iterables, workers=1, maxsize=1):
+    """Merge several iterables, each one consumed in a background thread.
+
+    At most ``workers`` iterables are consumed at the same time, and the
+    threads can only run ``maxsize`` items ahead of the caller. Exceptions
+    are raised again in the caller, and closing the generator stops the
+    threads.
+
+    :param iterables: list of iterables to consume.
+    :param workers: number of threads.
+    :param maxsize: max number of items waiting to be consumed.
+    :return: generator of the items, in the order they were produced.
+    """
+    iterables = list(iterables)
+    workers = max(1, min(workers, len(iterables)))
+    items = Queue(maxsize)
+    stop = threading.Event()
+    lock = threading.Lock()
+    done = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except Full:
+                continue
+        return False
+
+    def work():
+        try:
+            while not stop.is_set():
+                with lock:
+                    if not iterables:
+                        break
+                    iterable = iterables.pop(0)
+                for item in iterable:
+                    if not put((None, item)):
+                        return
+        except Exception:
+            put((sys.exc_info()[1], None))
+        finally:
+            put((done, None))
+
+    threads = [threading.Thread(target=work) for _ in range(workers)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+
+    try:
+        running = workers
+        while running:
+            error, item = items.get()
+            if error is done:
+                running -= 1
+            elif error is not None:
+                raise error
+            else:
+                yield item
+    finally:
+        stop.set()
+
+
+def iter_prefetched(iterable, depth=1):
+    """Consume an iterable ahead of the caller in a background thread.
+
+    Up to ``depth`` items are produced in advance. How far ahead the thread
+    runs adapts to the ratio between the time needed to produce an item and
+    the time the caller spends on it, so that slow producers get a deeper
+    buffer without keeping more items in memory than needed.
+
+    :param iterable: The iterable to consume.
+    :param depth: The max number of items produced in advance.
+    :return: generator of the items.
+    """
+    items = deque()
+    condition = threading.Condition()
+    state = {'target': 1, 'produce': None, 'consume': None, 'done': False,
+             'error': None, 'stop': False}
+
+    def average(key, value):
+        # Exponentially weighted moving average of the durations.
+        previous = state[key]
+        state[key] = value if previous is None else 0.7 * previous + \
+            0.3 * value
+
+    def work():
+        iterator = iter(iterable)
+        try:
+            while True:
+                with condition:
+                    while len(items) >= state['target'] and \
+                            not state['stop']:
+                        condition.wait()
+                    if state['stop']:
+                        return
+                start = time.time()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                with condition:
+                    average('produce', time.time() - start)
+                    items.append(item)
+                    condition.notify_all()
+        except Exception:
+            state['error'] = sys.exc_info()[1]
+        finally:
+            with condition:
+                state['done'] = True
+                condition.notify_all()
+
+    thread = threading.Thread(target=work)
+    thread.daemon = True
+    thread.start()
+
+    try:
+        returned = None
+        while True:
+            with condition:
+                if returned is not None:
+                    average('consume', time.time() - returned)
+                    if state['produce'] is not None:
+                        ratio = state['produce'] / max(state['consume'], 1e-3)
+                        state['target'] = max(1, min(depth, int(
+                            math.ceil(ratio)
+                        )))
+                        condition.notify_all()
+                while not items and not state['done']:
+                    condition.wait()
+                if items:
+                    item = items.popleft()
+                    condition.notify_all()
+                elif state['error'] is not None:
+                    raise state['error']
+                else:
+                    return
+            yield item
+            returned = time.time()
+    finally:
+        with condition:
+            state['stop'] = True
+            condition.notify_all()
+
+
+def date_windows(from_date, until_date, windows):
+    """Split a range of dates into consecutive windows.
+
+    The bounds are inclusive, as for the OAI-PMH ``from`` and ``until``
+    arguments, so the windows do not overlap.
+
+    :param from_date: The lower bound date, as YYYY-MM-DD.
+    :param until_date: The upper bound date, as YYYY-MM-DD.
+    :param windows: The number of windows (at most one per day).
+    :return: list of (from, until) dates as YYYY-MM-DD.
+    """
+    start = datetime.strptime(from_date[:10], '%Y-%m-%d')
+    end = datetime.strptime(until_date[:10], '%Y-%m-%d')
+    days = (end - start).days + 1
+    windows = max(1, min(windows, days))
+
+    result = []
+    for i in range(windows):
+        window_start = start + timedelta(days=days * i // windows)
+        window_end = start + timedelta(days=days * (i + 1) // windows - 1)
+        result.append((window_start.strftime('%Y-%m-%d'),
+                       window_end.strftime('%Y-%m-%d')))
+    return result
@@ -46,6 +46,9 @@ tests_require = [
 ]
 
 extras_require = {
+    'aio': [
+        'aiohttp>=3.3.0;python_version>="3.6"',
+    ],
     'docs': [
         'Sphinx>=1.5.3,<1.6',
     ],
@@ -59,6 +62,9 @@ extras_require = {
         'invenio-db>=1.0.0a9',
     ],
     'tests': tests_require,
+    'zstd': [
+        'zstandard>=0.15.0',
+    ],
 }
 
 extras_require['all'] = []
@@ -76,6 +82,7 @@ install_requires = [
     'flask-celeryext>=0.2.2',
     'blinker>=1.4',
     'sickle>=0.6.1',
+    'futures>=3.1.1;python_version=="2.7"',
 ]
 
 packages = find_packages()
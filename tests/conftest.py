@@ -27,10 +27,13 @@
 from __future__ import absolute_import, print_function
 
 import os
+import re
 import shutil
+import sys
 import tempfile
 
 import pytest
+import responses
 from flask import Flask
 from flask.cli import ScriptInfo
 from flask_celeryext import FlaskCeleryExt
@@ -39,6 +42,11 @@ from invenio_db import InvenioDB, db
 from invenio_oaiharvester import InvenioOAIHarvester
 from invenio_oaiharvester.models import OAIHarvestConfig
 
+collect_ignore = []
+if sys.version_info < (3, 6):
+    # Async generators
+    collect_ignore.append('test_aio.py')
+
 
 @pytest.fixture()
 def app(request):
@@ -87,6 +95,7 @@ def sample_config(app):
             baseurl="http://export.arxiv.org/oai2",
             metadataprefix="arXiv",
             setspecs="physics",
+            granularity="YYYY-MM-DD",
         )
         source.save()
         db.session.commit()
@@ -145,3 +154,69 @@ def sample_list_xml_cs():
         "data/sample_arxiv_response_listrecords_cs.xml"
     )).read()
     return raw_cs_xml
+
+
+def _oai_list_response(identifiers, token=None, complete_list_size=None,
+                       verb='ListRecords', datestamp='2015-01-16'):
+    """Build an OAI-PMH list response for the given identifiers."""
+    headers = [
+        '<header><identifier>{0}</identifier>'
+        '<datestamp>{1}</datestamp></header>'.format(identifier, datestamp)
+        for identifier in identifiers
+    ]
+    if verb in ('ListRecords', 'GetRecord'):
+        items = [
+            '<record>{0}<metadata><oai_dc:dc '
+            'xmlns:oai_dc="http://www.openarchives.org/OAI/2.0/oai_dc/" '
+            'xmlns:dc="http://purl.org/dc/elements/1.1/">'
+            '<dc:title>Title</dc:title></oai_dc:dc></metadata>'
+            '</record>'.format(header) for header in headers
+        ]
+    else:
+        items = headers
+    attributes = ''
+    if complete_list_size is not None:
+        attributes = ' completeListSize="{0}"'.format(complete_list_size)
+    resumption_token = ''
+    if token is not None or complete_list_size is not None:
+        resumption_token = '<resumptionToken{0}>{1}</resumptionToken>'.format(
+            attributes, token or ''
+        )
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/">'
+        '<responseDate>2016-01-18T15:34:50Z</responseDate>'
+        '<request verb="{0}">http://export.arxiv.org/oai2</request>'
+        '<{0}>{1}{2}</{0}></OAI-PMH>'.format(
+            verb, ''.join(items), resumption_token
+        )
+    )
+
+
+@pytest.fixture()
+def oai_list_response():
+    """Factory of OAI-PMH list responses."""
+    return _oai_list_response
+
+
+@pytest.fixture()
+def mock_oai_pages():
+    """Serve OAI-PMH pages keyed by resumption token.
+
+    Must be used inside a test decorated with ``responses.activate``. Returns
+    the list of requested tokens (``None`` for the first page).
+    """
+    def register(pages, url=re.compile(r'https?://export.arxiv.org/oai2.*')):
+        requested = []
+
+        def callback(request):
+            match = re.search(r'resumptionToken=([^&]*)', request.url)
+            token = match.group(1) if match else None
+            requested.append(token)
+            return (200, {}, pages[token])
+
+        responses.add_callback(
+            responses.GET, url, callback=callback, content_type='text/xml'
+        )
+        return requested
+    return register
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio.
+# Copyright (C) 2016 CERN.
+#
+# Invenio is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Test the asynchronous harvesting."""
+
+import asyncio
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+from invenio_db import db
+
+pytest.importorskip('aiohttp')
+
+from invenio_oaiharvester.aio import aget_records, alist_records  # noqa
+from invenio_oaiharvester.utils import get_oaiharvest_object  # noqa
+
+
+@pytest.fixture()
+def oai_server(oai_list_response):
+    """Local stub OAI-PMH server serving three pages."""
+    pages = {
+        None: oai_list_response(['oai:1', 'oai:2'], token='page2'),
+        'page2': oai_list_response(['oai:2', 'oai:3'], token='page3'),
+        'page3': oai_list_response(['oai:4'], token=''),
+    }
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if 'verb=GetRecord' in self.path:
+                identifier = re.search(r'identifier=([^&]*)', self.path)
+                identifier = identifier.group(1).replace('%3A', ':')
+                if identifier == 'oai:missing':
+                    body = (
+                        '<?xml version="1.0" encoding="UTF-8"?>'
+                        '<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/"'
+                        '><error code="idDoesNotExist"/></OAI-PMH>'
+                    )
+                else:
+                    body = oai_list_response([identifier], verb='GetRecord')
+            else:
+                token = re.search(r'resumptionToken=([^&]*)', self.path)
+                body = pages[token.group(1) if token else None]
+            body = body.encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/xml')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield 'http://127.0.0.1:{0}/oai2'.format(server.server_address[1])
+    server.shutdown()
+    server.server_close()
+
+
+def run(coroutine):
+    """Run a coroutine in a new event loop."""
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+def test_alist_records(app, sample_config, oai_server):
+    """Check asynchronous harvesting of records."""
+    async def harvest(**kwargs):
+        return [record.header.identifier
+                async for record in alist_records(**kwargs)]
+
+    with app.app_context():
+        assert run(harvest(url=oai_server, setspecs='a b')) == [
+            'oai:1', 'oai:2', 'oai:3', 'oai:4'
+        ]
+
+        source = get_oaiharvest_object(sample_config)
+        last_updated = source.lastrun
+        source.baseurl = oai_server
+        source.save()
+        db.session.commit()
+        assert len(run(harvest(name=sample_config))) == 4
+        assert last_updated < get_oaiharvest_object(sample_config).lastrun
+
+
+def test_aget_records(app, oai_server):
+    """Check asynchronous fetching of records, in order."""
+    async def harvest(identifiers, **kwargs):
+        return [record.header.identifier async for record in aget_records(
+            identifiers, url=oai_server, **kwargs
+        )]
+
+    identifiers = ['oai:{0}'.format(i) for i in range(10)]
+    with app.app_context():
+        assert run(harvest(identifiers, concurrency=3)) == identifiers
+
+        errors = {}
+        assert run(harvest(['oai:1', 'oai:missing', 'oai:2'],
+                           errors=errors)) == ['oai:1', 'oai:2']
+        assert list(errors) == ['oai:missing']
@@ -21,12 +21,14 @@
 
 from __future__ import absolute_import, print_function
 
+import gzip
 import re
 
 import responses
 from click.testing import CliRunner
 
-from invenio_oaiharvester.cli import harvest
+from invenio_oaiharvester.cli import harvest, identifiers
+from invenio_oaiharvester.errors import DeltaHarvestOptions
 
 
 @responses.activate
@@ -82,6 +84,31 @@ def test_cli_harvest_idents(script_info, sample_record_xml, tmpdir):
     )
     assert result.exit_code == 0
 
+    # Save it compressed
+    result = runner.invoke(
+        harvest,
+        ['-u', 'http://export.arxiv.org/oai2',
+         '-m', 'arXiv',
+         '-i', 'oai:arXiv.org:1507.03011',
+         '-d', tmpdir.dirname, '--compression', 'gzip',
+         '--max-bytes', '1000000'],
+        obj=script_info
+    )
+    assert result.exit_code == 0
+    assert '.xml.gz' in result.output
+
+    # Concurrently, skipping errors
+    result = runner.invoke(
+        harvest,
+        ['-u', 'http://export.arxiv.org/oai2',
+         '-m', 'arXiv',
+         '-i', 'oai:arXiv.org:1507.03011,oai:arXiv.org:1507.03011',
+         '-c', '2', '--skip-errors'],
+        obj=script_info
+    )
+    assert result.exit_code == 0
+    assert result.output.count('<record') == 2
+
     # Missing URL
     result = runner.invoke(
         harvest,
@@ -127,3 +154,107 @@ def test_cli_harvest_list(script_info, sample_empty_set):
         obj=script_info
     )
     assert result.exit_code == 0
+
+
+def test_cli_harvest_delta(script_info, sample_config, monkeypatch):
+    """Test the options of a delta harvest."""
+    calls = []
+
+    def list_records_delta(*args, **kwargs):
+        calls.append(kwargs)
+        return None, []
+
+    monkeypatch.setattr('invenio_oaiharvester.cli.list_records_delta',
+                        list_records_delta)
+    runner = CliRunner()
+    result = runner.invoke(
+        harvest, ['-n', sample_config, '--delta', '--no-signals', '-c', '4'],
+        obj=script_info
+    )
+    assert result.exit_code == 0
+    assert calls == [{'concurrency': 4}]
+
+    for option in ('--skip-unchanged', '--checkpoint'):
+        result = runner.invoke(
+            harvest, ['-n', sample_config, '--delta', option],
+            obj=script_info
+        )
+        assert isinstance(result.exception, DeltaHarvestOptions)
+    assert len(calls) == 1
+
+
+@responses.activate
+def test_cli_harvest_batches(script_info, sample_list_xml, tmpdir):
+    """Test sending the records in batches while they are harvested."""
+    from invenio_oaiharvester.signals import oaiharvest_batch, \
+        oaiharvest_finished
+
+    batches = []
+    finished = []
+
+    def on_batch(request, records, sequence, name):
+        batches.append((sequence, len(records)))
+
+    def on_finished(request, **kwargs):
+        finished.append(kwargs)
+
+    responses.add(
+        responses.GET,
+        re.compile(r'https?://export.arxiv.org/oai2.*set=physics.*'),
+        body=sample_list_xml,
+        content_type='text/xml'
+    )
+    oaiharvest_batch.connect(on_batch)
+    oaiharvest_finished.connect(on_finished)
+    try:
+        runner = CliRunner()
+        for options in (['-q'], ['-d', tmpdir.dirname]):
+            del batches[:], finished[:]
+            result = runner.invoke(
+                harvest,
+                ['-u', 'http://export.arxiv.org/oai2',
+                 '-m', 'arXiv',
+                 '-s', 'physics',
+                 '-f', '2015-01-17',
+                 '-b', '100'] + options,
+                obj=script_info
+            )
+            assert result.exit_code == 0
+            assert batches == [(0, 100), (1, 50)]
+            assert finished == [{'count': 150, 'batches': 2, 'name': None}]
+    finally:
+        oaiharvest_batch.disconnect(on_batch)
+        oaiharvest_finished.disconnect(on_finished)
+
+
+@responses.activate
+def test_cli_identifiers(script_info, oai_list_response, tmpdir):
+    """Check that the identifiers are printed or written to a file."""
+    responses.add(
+        responses.GET,
+        re.compile(r'https?://export.arxiv.org/oai2.*'),
+        body=oai_list_response(['oai:1', 'oai:2'], verb='ListIdentifiers'),
+        content_type='text/xml'
+    )
+    runner = CliRunner()
+    result = runner.invoke(
+        identifiers, ['-u', 'http://export.arxiv.org/oai2'], obj=script_info
+    )
+    assert result.exit_code == 0
+    assert result.output == 'oai:1\noai:2\n'
+
+    result = runner.invoke(
+        identifiers, ['-u', 'http://export.arxiv.org/oai2', '--count'],
+        obj=script_info
+    )
+    assert result.exit_code == 0
+    assert result.output == '2\n'
+
+    output = str(tmpdir.join('identifiers.txt.gz'))
+    result = runner.invoke(
+        identifiers, ['-u', 'http://export.arxiv.org/oai2', '-o', output],
+        obj=script_info
+    )
+    assert result.exit_code == 0
+    with gzip.open(output, 'rb') as fileobj:
+        assert fileobj.read() == b'oai:1\noai:2\n'
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio.
+# Copyright (C) 2016 CERN.
+#
+# Invenio is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Test the shared OAI-PMH clients."""
+
+import responses
+
+from invenio_oaiharvester.client import PooledSickle, clear_clients, get_client
+
+
+def test_get_client(app):
+    """Check that the clients are shared by endpoint and encoding."""
+    with app.app_context():
+        clear_clients()
+        client = get_client('http://export.arxiv.org/oai2')
+        assert isinstance(client, PooledSickle)
+        assert client is get_client('http://export.arxiv.org/oai2')
+        assert client is not get_client('http://export.arxiv.org/oai2',
+                                        'utf-8')
+        assert client.request_args['timeout'] == \
+            app.config['OAIHARVESTER_HTTP_TIMEOUT']
+        adapter = client.session.get_adapter('http://export.arxiv.org/oai2')
+        assert adapter._pool_maxsize == \
+            app.config['OAIHARVESTER_HTTP_POOL_SIZE']
+        clear_clients()
+        assert client is not get_client('http://export.arxiv.org/oai2')
+
+
+@responses.activate
+def test_client_retries(app, sample_record_xml, monkeypatch):
+    """Check that requests answered with HTTP 503 are retried."""
+    monkeypatch.setattr('time.sleep', lambda seconds: None)
+    responses.add(responses.GET, 'http://export.arxiv.org/oai2', status=503,
+                  headers={'Retry-After': '1'})
+    responses.add(responses.GET, 'http://export.arxiv.org/oai2',
+                  body=sample_record_xml, content_type='text/xml')
+    client = PooledSickle('http://export.arxiv.org/oai2', max_retries=1)
+    record = client.GetRecord(identifier='oai:arXiv.org:1507.03011',
+                              metadataPrefix='arXiv')
+    assert record.header.identifier == 'oai:arXiv.org:1507.03011'
+    assert len(responses.calls) == 2
@@ -17,15 +17,28 @@
 # along with Invenio; if not, write to the Free Software Foundation, Inc.,
 # 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
 
+import datetime
 import os
 import re
 import time
 
 import pytest
 import responses
+from invenio_db import db
+from lxml import etree
+from sickle.oaiexceptions import BadArgument
 
-from invenio_oaiharvester import get_records, list_records
-from invenio_oaiharvester.errors import WrongDateCombination
+from invenio_oaiharvester import get_records, iter_records, list_records, \
+    list_records_delta
+from invenio_oaiharvester.api import Watermark, get_info_by_oai_name, \
+    list_identifiers, parse_page, parse_raw_page, plan_date_windows, \
+    update_lastrun
+from invenio_oaiharvester.errors import NameOrUrlMissing, WrongDateCombination
+from invenio_oaiharvester.models import OAIHarvestCheckpoint, \
+    OAIHarvestConfig, OAIHarvestRecordState, OAIHarvestSetLastrun
+from invenio_oaiharvester.records import RAW_CLASS_MAP, CompactRecord, \
+    RawRecord
+from invenio_oaiharvester.utils import get_oaiharvest_object
 
 
 @responses.activate
@@ -150,6 +163,18 @@ def test_list_records(app, sample_list_xml, sample_list_xml_cs):
         # 46 cs + 150 physics - 6 dupes == 190
         assert len(records) == 190
 
+        _, records = list_records(
+            metadata_prefix='arXiv',
+            from_date='2015-01-15',
+            until_date='2015-01-20',
+            url='http://export.arxiv.org/oai2',
+            name=None,
+            setspecs='cs physics',
+            set_concurrency=2
+        )
+        assert len(records) == 190
+        assert len(set(r.header.identifier for r in records)) == 190
+
 
 @responses.activate
 def test_list_no_records(app, sample_empty_set):
@@ -212,3 +237,696 @@ def test_get_from_identifiers_with_prefix(app, sample_record_xml):
                 namespaces={"arXiv": "http://arxiv.org/OAI/arXiv/"}
             )[0].text
             assert identifier_in_request == "1507.03011"
+
+
+@responses.activate
+def test_iter_records(app, sample_config, oai_list_response,
+                      mock_oai_pages):
+    """Check that records are streamed page by page."""
+    requested = mock_oai_pages({
+        None: oai_list_response(['oai:1', 'oai:2'], token='page2'),
+        'page2': oai_list_response(['oai:2', 'oai:3'], token='page3'),
+        'page3': oai_list_response(['oai:4'], token=''),
+    })
+    with app.app_context():
+        from invenio_oaiharvester.utils import get_oaiharvest_object
+        last_updated = get_oaiharvest_object(sample_config).lastrun
+        _, records = iter_records(name=sample_config)
+
+        assert next(records).header.identifier == 'oai:1'
+        assert requested == [None]
+        assert next(records).header.identifier == 'oai:2'
+        assert next(records).header.identifier == 'oai:3'
+        assert requested == [None, 'page2']
+        assert get_oaiharvest_object(sample_config).lastrun == last_updated
+
+        assert [r.header.identifier for r in records] == ['oai:4']
+        assert requested == [None, 'page2', 'page3']
+        assert last_updated < get_oaiharvest_object(sample_config).lastrun
+
+        # Fetch the next pages in the background.
+        del requested[:]
+        _, records = iter_records(name=sample_config, prefetch=2)
+        assert next(records).header.identifier == 'oai:1'
+        time.sleep(0.1)
+        assert requested == [None, 'page2']
+        assert [r.header.identifier for r in records] == [
+            'oai:2', 'oai:3', 'oai:4'
+        ]
+        assert requested == [None, 'page2', 'page3']
+
+        # Compact records
+        _, records = list_records(name=sample_config, compact=True)
+        assert [type(r) for r in records] == [CompactRecord] * 4
+        assert [r.header.identifier for r in records] == [
+            'oai:1', 'oai:2', 'oai:3', 'oai:4'
+        ]
+
+
+@responses.activate
+def test_list_records_skip_unchanged(app, sample_config, oai_list_response,
+                                     mock_oai_pages):
+    """Check that records are skipped until their content changes."""
+    pages = {
+        None: oai_list_response(['oai:1', 'oai:2'], token='page2'),
+        'page2': oai_list_response(['oai:3'], token=''),
+    }
+    mock_oai_pages(pages)
+    with app.app_context():
+        _, records = iter_records(name=sample_config, skip_unchanged=True)
+        assert [next(records).header.identifier for _ in range(3)] == [
+            'oai:1', 'oai:2', 'oai:3'
+        ]
+        # Nothing is stored before the last record has been consumed.
+        assert get_oaiharvest_object(sample_config).lastrun == \
+            datetime.datetime(1900, 1, 1)
+        assert OAIHarvestRecordState.query.count() == 2
+        assert list(records) == []
+        assert get_oaiharvest_object(sample_config).lastrun == \
+            datetime.datetime(2016, 1, 18, 15, 34, 50)
+        assert OAIHarvestRecordState.query.count() == 3
+
+        _, records = list_records(name=sample_config, skip_unchanged=True)
+        assert records == []
+
+        # Only the first record changes.
+        pages[None] = oai_list_response(
+            ['oai:1', 'oai:2'], token='page2'
+        ).replace('2015-01-16</datestamp></header><metadata>'
+                  '<oai_dc:dc', '2015-01-17</datestamp></header>'
+                  '<metadata><oai_dc:dc', 1)
+        _, records = list_records(name=sample_config, skip_unchanged=True)
+        assert [r.header.identifier for r in records] == ['oai:1']
+        state = OAIHarvestRecordState.query.filter_by(
+            identifier='oai:1'
+        ).one()
+        assert state.datestamp == '2015-01-17'
+        assert not state.deleted
+
+        with pytest.raises(NameOrUrlMissing):
+            list_records(url='http://export.arxiv.org/oai2',
+                         skip_unchanged=True)
+
+
+@responses.activate
+def test_list_records_delta(app, sample_config, oai_list_response):
+    """Check that only the new and changed records are fetched."""
+    datestamps = {'oai:1': '2015-01-16', 'oai:2': '2015-01-16'}
+    fetched = []
+    failing = set()
+
+    def callback(request):
+        if 'verb=ListIdentifiers' in request.url:
+            body = oai_list_response(sorted(datestamps),
+                                     verb='ListIdentifiers')
+            for identifier, datestamp in datestamps.items():
+                body = body.replace(
+                    '{0}</identifier><datestamp>2015-01-16'.format(identifier),
+                    '{0}</identifier><datestamp>{1}'.format(identifier,
+                                                            datestamp)
+                )
+            return (200, {}, body)
+        identifier = re.search(r'identifier=([^&]*)', request.url).group(1)
+        identifier = identifier.replace('%3A', ':')
+        fetched.append(identifier)
+        if identifier in failing:
+            return (200, {}, oai_list_response([], verb='GetRecord').replace(
+                '<GetRecord></GetRecord>',
+                '<error code="idDoesNotExist">Unavailable</error>'
+            ))
+        return (200, {}, oai_list_response(
+            [identifier], verb='GetRecord', datestamp=datestamps[identifier]
+        ))
+
+    responses.add_callback(
+        responses.GET,
+        re.compile(r'https?://export.arxiv.org/oai2.*'),
+        callback=callback,
+        content_type='text/xml'
+    )
+
+    with app.app_context():
+        _, records = list_records_delta(name=sample_config, concurrency=2)
+        assert [r.header.identifier for r in records] == ['oai:1', 'oai:2']
+        assert sorted(fetched) == ['oai:1', 'oai:2']
+
+        del fetched[:]
+        _, records = list_records_delta(name=sample_config)
+        assert records == []
+        assert fetched == []
+
+        # A record changes and a new one is added.
+        datestamps.update({'oai:2': '2015-01-17', 'oai:3': '2015-01-17'})
+        _, records = list_records_delta(name=sample_config)
+        assert [r.header.identifier for r in records] == ['oai:2', 'oai:3']
+        assert fetched == ['oai:2', 'oai:3']
+        state = OAIHarvestRecordState.query.filter_by(
+            identifier='oai:2'
+        ).one()
+        assert state.datestamp == '2015-01-17'
+
+        # The lastrun does not move past the records which failed.
+        datestamps['oai:4'] = '2015-01-18'
+        failing.add('oai:4')
+        errors = {}
+        _, records = list_records_delta(name=sample_config, errors=errors)
+        assert records == []
+        assert list(errors) == ['oai:4']
+        assert get_oaiharvest_object(sample_config).lastrun == \
+            datetime.datetime(2015, 1, 18)
+
+        failing.clear()
+        _, records = list_records_delta(name=sample_config)
+        assert [r.header.identifier for r in records] == ['oai:4']
+        assert get_oaiharvest_object(sample_config).lastrun == \
+            datetime.datetime(2016, 1, 18, 15, 34, 50)
+
+        with pytest.raises(NameOrUrlMissing):
+            list_records_delta()
+
+
+@pytest.mark.parametrize('raw', [False, True])
+@responses.activate
+def test_list_identifiers(app, oai_list_response, raw):
+    """Check that the headers of several sets are listed only once."""
+    sets = {
+        'physics': oai_list_response(['oai:1', 'oai:2'],
+                                     verb='ListIdentifiers'),
+        'cs': oai_list_response(['oai:2', 'oai:3'], verb='ListIdentifiers'),
+    }
+
+    def callback(request):
+        assert 'verb=ListIdentifiers' in request.url
+        return (200, {}, sets[re.search(r'set=(\w+)', request.url).group(1)])
+
+    responses.add_callback(
+        responses.GET,
+        re.compile(r'https?://export.arxiv.org/oai2.*'),
+        callback=callback,
+        content_type='text/xml'
+    )
+
+    with app.app_context():
+        _, headers = list_identifiers(url='http://export.arxiv.org/oai2',
+                                      setspecs='physics cs', raw=raw)
+        assert list(headers) == [
+            ('oai:1', '2015-01-16', False),
+            ('oai:2', '2015-01-16', False),
+            ('oai:3', '2015-01-16', False),
+        ]
+
+
+@responses.activate
+def test_list_identifiers_lastrun(app, sample_config, oai_list_response):
+    """Check that the lastrun is only used when asked."""
+    requested = []
+
+    def callback(request):
+        assert 'verb=ListIdentifiers' in request.url
+        match = re.search(r'from=([^&]*)', request.url)
+        requested.append(match.group(1) if match else None)
+        return (200, {}, oai_list_response(['oai:1'],
+                                           verb='ListIdentifiers'))
+
+    responses.add_callback(
+        responses.GET,
+        re.compile(r'https?://export.arxiv.org/oai2.*'),
+        callback=callback,
+        content_type='text/xml'
+    )
+
+    with app.app_context():
+        config = OAIHarvestConfig.query.filter_by(name=sample_config).one()
+        config.granularity = None
+        db.session.add(OAIHarvestSetLastrun(
+            config_id=config.id, setspec='physics',
+            lastrun=datetime.datetime(2015, 1, 1)
+        ))
+        db.session.commit()
+
+        _, headers = list_identifiers(name=sample_config)
+        assert len(list(headers)) == 1
+        # Neither Identify nor the lastruns are used.
+        assert requested == [None]
+        config = OAIHarvestConfig.query.filter_by(name=sample_config).one()
+        assert config.granularity is None
+
+        config.granularity = 'YYYY-MM-DD'
+        db.session.commit()
+        del requested[:]
+        _, headers = list_identifiers(name=sample_config, incremental=True)
+        assert len(list(headers)) == 1
+        assert requested == ['2015-01-01']
+        assert config.lastrun == datetime.datetime(1900, 1, 1)
+        assert OAIHarvestSetLastrun.query.count() == 1
+
+
+@responses.activate
+def test_list_records_watermark(app, sample_config, oai_list_response):
+    """Check that the lastrun is the date of the server, in seconds."""
+    requested = []
+
+    def callback(request):
+        if 'verb=Identify' in request.url:
+            requested.append('Identify')
+            return (200, {}, oai_list_response([], verb='Identify').replace(
+                '<Identify>', '<Identify><granularity>YYYY-MM-DDThh:mm:ssZ'
+                '</granularity>'
+            ))
+        requested.append(re.search(r'from=([^&]*)', request.url).group(1))
+        return (200, {}, oai_list_response(['oai:1']))
+
+    responses.add_callback(
+        responses.GET,
+        re.compile(r'https?://export.arxiv.org/oai2.*'),
+        callback=callback,
+        content_type='text/xml'
+    )
+
+    with app.app_context():
+        config = OAIHarvestConfig.query.filter_by(name=sample_config).one()
+        config.granularity = None
+        db.session.commit()
+
+        list_records(name=sample_config)
+        assert requested == ['Identify', '1900-01-01T00%3A00%3A00Z']
+        config = OAIHarvestConfig.query.filter_by(name=sample_config).one()
+        assert config.granularity == 'YYYY-MM-DDThh:mm:ssZ'
+        assert config.lastrun == datetime.datetime(2016, 1, 18, 15, 34, 50)
+
+        # The granularity is only read once.
+        del requested[:]
+        list_records(name=sample_config)
+        assert requested == ['2016-01-18T15%3A34%3A50Z']
+        assert get_info_by_oai_name(sample_config)[2] == \
+            '2016-01-18T15:34:50Z'
+
+        # Both dates must have the same granularity.
+        del requested[:]
+        list_records(name=sample_config, until_date='2016-01-19')
+        assert requested == ['2016-01-18']
+
+        # The lastrun is stored in UTC.
+        before = datetime.datetime.utcnow().replace(microsecond=0)
+        update_lastrun(sample_config)
+        config = OAIHarvestConfig.query.filter_by(name=sample_config).one()
+        assert before <= config.lastrun <= datetime.datetime.utcnow()
+
+    # Without response dates, the latest datestamp is used.
+    watermark = Watermark()
+    watermark.add_response(b'<OAI-PMH><responseDate/></OAI-PMH>')
+    for datestamp in ('2015-01-16T10:00:00Z', '2015-01-17', '2015-01-15'):
+        watermark.add_datestamp(datestamp)
+    assert watermark.value == datetime.datetime(2015, 1, 17)
+
+
+@responses.activate
+def test_list_records_set_lastruns(app, sample_config, oai_list_response):
+    """Check that every set advances independently of the failing ones."""
+    requested = []
+    failing = set(['cs'])
+
+    def callback(request):
+        spec = re.search(r'set=(\w+)', request.url).group(1)
+        requested.append((spec, re.search(r'from=([^&]*)',
+                                          request.url).group(1)))
+        if spec in failing:
+            return (200, {}, oai_list_response([]).replace(
+                '<ListRecords></ListRecords>',
+                '<error code="badArgument">Unavailable</error>'
+            ))
+        return (200, {}, oai_list_response(['oai:' + spec]))
+
+    responses.add_callback(
+        responses.GET,
+        re.compile(r'https?://export.arxiv.org/oai2.*'),
+        callback=callback,
+        content_type='text/xml'
+    )
+
+    with app.app_context():
+        config = OAIHarvestConfig.query.filter_by(name=sample_config).one()
+        config.setspecs = 'cs physics'
+        db.session.commit()
+        lastrun = config.lastrun
+
+        _, records = iter_records(name=sample_config)
+        assert next(records).header.identifier == 'oai:physics'
+        with pytest.raises(BadArgument):
+            next(records)
+        assert get_info_by_oai_name(sample_config)[2] == \
+            lastrun.strftime('%Y-%m-%d')
+        row = OAIHarvestSetLastrun.query.one()
+        assert row.setspec == 'physics'
+        assert row.lastrun == datetime.datetime(2016, 1, 18, 15, 34, 50)
+
+        # Only the failed set is harvested again from the old lastrun.
+        del requested[:]
+        failing.clear()
+        _, records = list_records(name=sample_config)
+        assert sorted(requested) == [('cs', '1900-01-01'),
+                                     ('physics', '2016-01-18')]
+        assert [r.header.identifier for r in records] == [
+            'oai:cs', 'oai:physics'
+        ]
+        assert OAIHarvestSetLastrun.query.count() == 0
+        assert get_info_by_oai_name(sample_config)[2] == '2016-01-18'
+
+
+@responses.activate
+def test_list_records_delta_set_lastruns(app, sample_config,
+                                         oai_list_response):
+    """Check that the sets of a delta harvest advance independently."""
+    requested = []
+    fetched = []
+    failing = set(['cs'])
+
+    def callback(request):
+        if 'verb=GetRecord' in request.url:
+            identifier = re.search(r'identifier=([^&]*)', request.url)
+            identifier = identifier.group(1).replace('%3A', ':')
+            fetched.append(identifier)
+            return (200, {}, oai_list_response([identifier],
+                                               verb='GetRecord'))
+        spec = re.search(r'set=(\w+)', request.url).group(1)
+        requested.append((spec, re.search(r'from=([^&]*)',
+                                          request.url).group(1)))
+        if spec in failing:
+            return (200, {}, oai_list_response(
+                [], verb='ListIdentifiers'
+            ).replace('<ListIdentifiers></ListIdentifiers>',
+                      '<error code="badArgument">Unavailable</error>'))
+        return (200, {}, oai_list_response(['oai:' + spec, 'oai:shared'],
+                                           verb='ListIdentifiers'))
+
+    responses.add_callback(
+        responses.GET,
+        re.compile(r'https?://export.arxiv.org/oai2.*'),
+        callback=callback,
+        content_type='text/xml'
+    )
+
+    with app.app_context():
+        config = OAIHarvestConfig.query.filter_by(name=sample_config).one()
+        config.setspecs = 'cs physics'
+        db.session.commit()
+
+        with pytest.raises(BadArgument):
+            list_records_delta(name=sample_config)
+        assert fetched == ['oai:physics', 'oai:shared']
+        assert get_oaiharvest_object(sample_config).lastrun == \
+            datetime.datetime(1900, 1, 1)
+        row = OAIHarvestSetLastrun.query.one()
+        assert row.setspec == 'physics'
+        assert row.lastrun == datetime.datetime(2016, 1, 18, 15, 34, 50)
+
+        # Only the failed set is listed again from the old lastrun.
+        del requested[:]
+        del fetched[:]
+        failing.clear()
+        _, records = list_records_delta(name=sample_config)
+        assert requested == [('cs', '1900-01-01'), ('physics', '2016-01-18')]
+        assert [r.header.identifier for r in records] == ['oai:cs']
+        assert fetched == ['oai:cs']
+        assert OAIHarvestSetLastrun.query.count() == 0
+        assert get_oaiharvest_object(sample_config).lastrun == \
+            datetime.datetime(2016, 1, 18, 15, 34, 50)
+
+
+@responses.activate
+def test_plan_date_windows(app, oai_list_response):
+    """Check that date windows are bisected until they are balanced."""
+    # Bursty deposits: most records are on the 2nd and 9th day.
+    per_day = [1, 40, 1, 1, 2, 1, 1, 3, 30, 1]
+
+    def callback(request):
+        start = int(re.search(r'from=2015-01-(\d+)', request.url).group(1))
+        end = int(re.search(r'until=2015-01-(\d+)', request.url).group(1))
+        size = sum(per_day[start - 1:end])
+        return (200, {}, oai_list_response(
+            ['oai:1'], token='next', complete_list_size=size
+        ))
+
+    responses.add_callback(
+        responses.GET,
+        re.compile(r'https?://export.arxiv.org/oai2.*'),
+        callback=callback,
+        content_type='text/xml'
+    )
+    with app.app_context():
+        windows = plan_date_windows(
+            '2015-01-01', '2015-01-10', 20,
+            url='http://export.arxiv.org/oai2'
+        )
+        assert windows == [
+            ('2015-01-01', '2015-01-01'), ('2015-01-02', '2015-01-02'),
+            ('2015-01-03', '2015-01-05'), ('2015-01-06', '2015-01-07'),
+            ('2015-01-08', '2015-01-08'), ('2015-01-09', '2015-01-09'),
+            ('2015-01-10', '2015-01-10'),
+        ]
+
+
+@responses.activate
+def test_iter_records_checkpoint(app, sample_config, oai_list_response,
+                                 mock_oai_pages):
+    """Check that an interrupted harvest resumes from the last page."""
+    def later(response):
+        return response.replace('2016-01-18T15:34:50Z', '2016-01-19T08:00:00Z')
+
+    requested = mock_oai_pages({
+        None: oai_list_response(['oai:1', 'oai:2'], token='page2'),
+        'page2': later(oai_list_response(['oai:3', 'oai:4'], token='page3')),
+        'page3': later(oai_list_response(['oai:5'], token='')),
+        'expired': (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/">'
+            '<error code="badResumptionToken">Expired</error></OAI-PMH>'
+        ),
+    })
+    with app.app_context():
+        _, records = iter_records(name=sample_config, checkpoint=True)
+        for _ in range(3):
+            next(records)
+        # The first page has been consumed, the worker dies.
+        saved = OAIHarvestCheckpoint.query.one()
+        assert saved.resumption_token == 'page2'
+        assert saved.records_processed == 2
+        assert saved.setspec == 'physics'
+        assert saved.response_date == datetime.datetime(2016, 1, 18, 15, 34,
+                                                        50)
+
+        # Resume with the default of the configuration.
+        app.config['OAIHARVESTER_CHECKPOINT'] = True
+        _, records = list_records(name=sample_config)
+        assert [r.header.identifier for r in records] == [
+            'oai:3', 'oai:4', 'oai:5'
+        ]
+        assert requested == [None, 'page2', 'page2', 'page3']
+        assert OAIHarvestCheckpoint.query.count() == 0
+        # The lastrun is the time at which the interrupted harvest started.
+        assert get_oaiharvest_object(sample_config).lastrun == \
+            datetime.datetime(2016, 1, 18, 15, 34, 50)
+
+        # Restart from scratch when the token has expired.
+        from_date = get_info_by_oai_name(sample_config)[2]
+        checkpoint = OAIHarvestCheckpoint(
+            config_id=OAIHarvestConfig.query.filter_by(
+                name=sample_config).one().id,
+            setspec='physics', from_date=from_date,
+            resumption_token='expired', records_processed=2
+        )
+        db.session.add(checkpoint)
+        db.session.commit()
+        del requested[:]
+        _, records = list_records(name=sample_config)
+        assert len(records) == 5
+        assert requested == ['expired', None, 'page2', 'page3']
+        assert OAIHarvestCheckpoint.query.count() == 0
+
+
+@pytest.mark.parametrize('sample', [
+    'sample_arxiv_response_listrecords_physics.xml',
+    'sample_inspire_response_listrecords.xml',
+    'sample_oai_dc_response.xml',
+])
+def test_parse_raw_page(sample):
+    """Check that raw pages are read like parsed ones."""
+    path = os.path.join(os.path.dirname(__file__), 'data', sample)
+    with open(path, 'rb') as f:
+        content = f.read()
+    records, _ = parse_raw_page(content, 'ListRecords')
+    expected, _ = parse_page(etree.XML(content), 'ListRecords',
+                             class_mapping=RAW_CLASS_MAP)
+    assert len(records) == len(expected)
+    for record, parsed in zip(records, expected):
+        assert isinstance(record.raw, bytes)
+        assert (record.identifier, record.datestamp, record.deleted) == \
+            (parsed.identifier, parsed.datestamp, parsed.deleted)
+        # Every record is a standalone document.
+        assert etree.tostring(etree.fromstring(record.raw), method='c14n') \
+            == etree.tostring(etree.fromstring(parsed.raw), method='c14n')
+
+
+def test_parse_raw_page_tokens(oai_list_response):
+    """Check the resumption tokens and errors of raw pages."""
+    from sickle.oaiexceptions import NoRecordsMatch
+    content = oai_list_response(
+        ['oai:1', 'oai:2'], token='a&amp;b', complete_list_size=4
+    ).replace('<record>', '<record>\n', 1).encode('utf-8')
+    records, token = parse_raw_page(content, 'ListRecords')
+    assert [r.identifier for r in records] == ['oai:1', 'oai:2']
+    assert (token.token, token.complete_list_size) == ('a&b', '4')
+    assert records[0].metadata == {'title': ['Title']}
+
+    _, token = parse_raw_page(
+        oai_list_response(['oai:3'], token='').encode('utf-8'), 'ListRecords'
+    )
+    assert token.token is None
+
+    # CDATA sections are parsed with lxml.
+    records, _ = parse_raw_page(content.replace(
+        b'Title', b'<![CDATA[</record>]]>'
+    ), 'ListRecords')
+    assert [r.identifier for r in records] == ['oai:1', 'oai:2']
+
+    with pytest.raises(NoRecordsMatch):
+        parse_raw_page(
+            b'<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/">'
+            b'<error code="noRecordsMatch">No &amp; records</error>'
+            b'</OAI-PMH>', 'ListRecords'
+        )
+
+
+def test_parse_raw_page_encoding(oai_list_response):
+    """Check that the records of other encodings are UTF-8 documents."""
+    content = oai_list_response([u'oai:\xe9']).replace(
+        'encoding="UTF-8"', 'encoding="ISO-8859-1"'
+    ).replace('Title', u'Caf\xe9').encode('latin-1')
+    records, _ = parse_raw_page(content, 'ListRecords')
+    assert records[0].identifier == u'oai:\xe9'
+    assert records[0].metadata == {'title': [u'Caf\xe9']}
+    assert not records[0].raw.startswith(b'<?xml')
+    records[0].raw.decode('utf-8')
+
+    headers, _ = parse_raw_page(content.replace(
+        b'ListRecords', b'ListIdentifiers'
+    ), 'ListIdentifiers')
+    assert headers[0].identifier == u'oai:\xe9'
+
+
+def test_parse_raw_page_headers(oai_list_response):
+    """Check that the headers of ListIdentifiers responses are read."""
+    content = oai_list_response(
+        ['oai:1', 'oai:2'], token='next', verb='ListIdentifiers'
+    ).replace('<header>', '<header status="deleted">', 1).encode('utf-8')
+    expected = parse_page(etree.fromstring(content), 'ListIdentifiers',
+                          class_mapping=RAW_CLASS_MAP)
+    headers, token = parse_raw_page(content, 'ListIdentifiers')
+    assert headers == expected[0] == [
+        ('oai:1', '2015-01-16', True), ('oai:2', '2015-01-16', False)
+    ]
+    assert token.token == 'next'
+
+    # Entities are resolved by lxml.
+    headers, _ = parse_raw_page(content.replace(b'oai:2', b'oai:&#50;'),
+                                'ListIdentifiers')
+    assert headers[1].identifier == 'oai:2'
+
+    # Like the headers of ListRecords, the ones of another namespace are not
+    # read without a parser.
+    other = content.replace(b'http://www.openarchives.org/OAI/2.0/',
+                            b'http://example.org/')
+    assert parse_raw_page(other, 'ListIdentifiers') == \
+        parse_page(etree.fromstring(other), 'ListIdentifiers',
+                   class_mapping=RAW_CLASS_MAP)
+
+
+@responses.activate
+def test_list_records_raw(app, sample_config, oai_list_response,
+                          mock_oai_pages):
+    """Check that raw records are harvested page by page."""
+    mock_oai_pages({
+        None: oai_list_response(['oai:1', 'oai:2'], token='page2'),
+        'page2': oai_list_response(['oai:2', 'oai:3'], token=''),
+    })
+    with app.app_context():
+        _, records = list_records(name=sample_config, raw=True)
+        assert [type(r) for r in records] == [RawRecord] * 3
+        assert [r.header.identifier for r in records] == [
+            'oai:1', 'oai:2', 'oai:3'
+        ]
+        # With an overridden encoding, the records are parsed.
+        _, records = list_records(name=sample_config, raw=True,
+                                  encoding='utf-8')
+        assert [type(r) for r in records] == [RawRecord] * 3
+        assert records[0].metadata == {'title': ['Title']}
+        _, records = get_records(['oai:1'], name=sample_config, raw=True)
+        assert records[0].raw.startswith(
+            b'<record xmlns="http://www.openarchives.org/OAI/2.0/">'
+        )
+
+
+@responses.activate
+def test_get_records_concurrently(app, oai_list_response):
+    """Check that records are fetched concurrently, in the input order."""
+    from sickle.oaiexceptions import IdDoesNotExist
+
+    def callback(request):
+        identifier = re.search(r'identifier=([^&]*)', request.url).group(1)
+        if identifier == 'oai%3Amissing':
+            return (200, {}, (
+                '<?xml version="1.0" encoding="UTF-8"?>'
+                '<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/">'
+                '<error code="idDoesNotExist">No record</error></OAI-PMH>'
+            ))
+        if identifier == 'oai%3Abad':
+            return (200, {}, oai_list_response([], verb='GetRecord').replace(
+                '<GetRecord></GetRecord>',
+                '<error code="badArgument">Bad identifier</error>'
+            ))
+        if identifier == 'oai%3Aempty':
+            return (200, {}, oai_list_response([], verb='GetRecord'))
+        time.sleep(0.01)
+        return (200, {}, oai_list_response(
+            [identifier.replace('%3A', ':')], verb='GetRecord'
+        ))
+
+    responses.add_callback(
+        responses.GET,
+        re.compile(r'https?://export.arxiv.org/oai2.*'),
+        callback=callback,
+        content_type='text/xml'
+    )
+    identifiers = ['oai:{0}'.format(i) for i in range(20)]
+    with app.app_context():
+        _, records = get_records(identifiers + ['oai:missing'],
+                                 url='http://export.arxiv.org/oai2',
+                                 concurrency=4, errors={})
+        assert [r.header.identifier for r in records] == identifiers
+
+        errors = {}
+        _, records = get_records(['oai:1', 'oai:missing', 'oai:2'],
+                                 url='http://export.arxiv.org/oai2',
+                                 concurrency=2, errors=errors)
+        assert [r.header.identifier for r in records] == ['oai:1', 'oai:2']
+        assert list(errors) == ['oai:missing']
+        assert isinstance(errors['oai:missing'], IdDoesNotExist)
+
+        errors = {}
+        _, records = get_records(['oai:bad', 'oai:empty', 'oai:1'],
+                                 url='http://export.arxiv.org/oai2',
+                                 errors=errors)
+        assert [r.header.identifier for r in records] == ['oai:1']
+        assert isinstance(errors['oai:bad'], BadArgument)
+        assert isinstance(errors['oai:empty'], IdDoesNotExist)
+
+        _, records = get_records(['oai:1', 'oai:2'],
+                                 url='http://export.arxiv.org/oai2',
+                                 compact=True)
+        assert [type(r) for r in records] == [CompactRecord] * 2
+
+        with pytest.raises(IdDoesNotExist):
+            get_records(['oai:1', 'oai:missing'],
+                        url='http://export.arxiv.org/oai2', concurrency=2)
+        with pytest.raises(IdDoesNotExist):
+            get_records(['oai:empty'], url='http://export.arxiv.org/oai2')
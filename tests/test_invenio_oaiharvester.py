@@ -49,3 +49,24 @@ def test_init():
     assert 'invenio-oaiharvester' not in app.extensions
     ext.init_app(app)
     assert 'invenio-oaiharvester' in app.extensions
+
+
+def test_init_namespaces():
+    """Test the namespace lookups compiled at initialization."""
+    from invenio_oaiharvester.utils import get_namespace_paths, \
+        identifier_extraction_from_string
+    app = Flask('testapp')
+    app.config['OAIHARVESTER_DEFAULT_NAMESPACE_MAP'] = {
+        'oai': 'http://www.openarchives.org/OAI/2.0/',
+    }
+    InvenioOAIHarvester(app)
+    try:
+        assert get_namespace_paths('').nsmap == {
+            'oai': 'http://www.openarchives.org/OAI/2.0/',
+        }
+        # No application context is needed without a namespace.
+        assert identifier_extraction_from_string(
+            '<record><identifier>oai:1</identifier></record>', ''
+        ) == 'oai:1'
+    finally:
+        InvenioOAIHarvester(Flask('testapp'))
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio.
+# Copyright (C) 2016 CERN.
+#
+# Invenio is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Test the compact representation of harvested records."""
+
+import os
+import pickle
+
+from lxml import etree
+from sickle.models import Header, Record
+
+from invenio_oaiharvester.records import CompactHeader, CompactRecord
+
+
+def _record_elements(sample):
+    path = os.path.join(os.path.dirname(__file__), 'data', sample)
+    root = etree.parse(path).getroot()
+    return root.findall('.//{http://www.openarchives.org/OAI/2.0/}record')
+
+
+def test_compact_record():
+    """Check that compact records expose the fields of sickle records."""
+    elements = _record_elements('sample_arxiv_response_listrecords_cs.xml')
+    assert elements
+    for element in elements:
+        record = Record(element)
+        compact = CompactRecord(element)
+        assert compact.header.identifier == record.header.identifier
+        assert compact.header.datestamp == record.header.datestamp
+        assert compact.deleted == record.deleted
+        assert compact.raw == record.raw
+        assert compact.metadata == record.metadata
+        assert dict(compact) == record.metadata
+        assert repr(compact) == repr(record)
+
+    assert not hasattr(compact, '__dict__')
+    compact = pickle.loads(pickle.dumps(CompactRecord(elements[0])))
+    assert compact.identifier == Record(elements[0]).header.identifier
+
+
+def test_compact_deleted_record():
+    """Check that deleted records have no metadata."""
+    element = etree.fromstring(
+        '<record xmlns="http://www.openarchives.org/OAI/2.0/">'
+        '<header status="deleted"><identifier>oai:1</identifier>'
+        '<datestamp>2015-01-16</datestamp></header></record>'
+    )
+    record = CompactRecord(element)
+    assert record.deleted
+    assert record.metadata == {}
+    assert repr(record) == '<Record oai:1 [deleted]>'
+
+
+def test_compact_header():
+    """Check that compact headers expose the fields of sickle headers."""
+    elements = _record_elements('sample_arxiv_response_listrecords_cs.xml')
+    for element in elements:
+        element = element[0]
+        header = Header(element)
+        compact = CompactHeader.from_element(element)
+        assert compact.header is compact
+        assert compact == (header.identifier, header.datestamp,
+                           header.deleted)
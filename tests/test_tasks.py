@@ -22,10 +22,12 @@ import re
 import pytest
 import responses
 
-from invenio_oaiharvester.errors import InvenioOAIHarvesterError
-from invenio_oaiharvester.signals import oaiharvest_finished
+from invenio_oaiharvester.errors import DeltaHarvestOptions, \
+    InvenioOAIHarvesterError
+from invenio_oaiharvester.signals import oaiharvest_batch, oaiharvest_finished
 from invenio_oaiharvester.tasks import get_specific_records, \
-    list_records_from_dates
+    list_identifiers_from_dates, list_records_from_dates, \
+    list_records_partitioned
 
 
 @responses.activate
@@ -83,3 +85,135 @@ def test_list_records_from_dates(app, sample_list_xml):
             )
     finally:
         oaiharvest_finished.disconnect(bar)
+
+
+@responses.activate
+def test_list_records_from_dates_batches(app, sample_list_xml):
+    """Check that records are sent in batches while harvested."""
+    batches = []
+    finished = []
+
+    def on_batch(request, records, sequence, name):
+        batches.append((sequence, len(records), name))
+
+    def on_finished(request, **kwargs):
+        finished.append(kwargs)
+
+    responses.add(
+        responses.GET,
+        re.compile(r'https?://export.arxiv.org/oai2.*'),
+        body=sample_list_xml,
+        content_type='text/xml'
+    )
+    oaiharvest_batch.connect(on_batch)
+    oaiharvest_finished.connect(on_finished)
+    try:
+        with app.app_context():
+            count = list_records_from_dates(
+                metadata_prefix='arXiv',
+                from_date='2015-01-15',
+                until_date='2015-01-20',
+                url='http://export.arxiv.org/oai2',
+                setspecs='physics',
+                batch_size=60
+            )
+            assert count == 150
+            assert batches == [(0, 60, None), (1, 60, None), (2, 30, None)]
+            assert finished == [{'count': 150, 'batches': 3, 'name': None}]
+
+            del batches[:], finished[:]
+            app.config['OAIHARVESTER_BATCH_SIZE'] = 100
+            get_specific_records(
+                'oai:arXiv.org:1507.03011,oai:arXiv.org:1507.03012',
+                url='http://export.arxiv.org/oai2'
+            )
+            assert batches == [(0, 2, None)]
+            assert finished == [{'count': 2, 'batches': 1, 'name': None}]
+    finally:
+        app.config['OAIHARVESTER_BATCH_SIZE'] = None
+        oaiharvest_batch.disconnect(on_batch)
+        oaiharvest_finished.disconnect(on_finished)
+
+
+def test_list_records_from_dates_delta(app, sample_config, monkeypatch):
+    """Test the options of a delta harvest."""
+    calls = []
+
+    def iter_records_delta(*args, **kwargs):
+        calls.append(kwargs)
+        return None, iter([])
+
+    monkeypatch.setattr('invenio_oaiharvester.tasks.iter_records_delta',
+                        iter_records_delta)
+    with app.app_context():
+        assert list_records_from_dates(name=sample_config, delta=True,
+                                       concurrency=4) == 0
+        assert calls == [{'concurrency': 4}]
+
+        with pytest.raises(DeltaHarvestOptions):
+            list_records_from_dates(name=sample_config, delta=True,
+                                    skip_unchanged=True)
+        with pytest.raises(DeltaHarvestOptions):
+            list_records_from_dates(name=sample_config, delta=True,
+                                    checkpoint=True)
+        assert len(calls) == 1
+
+
+@responses.activate
+def test_list_records_partitioned(app, sample_config, sample_list_xml):
+    """Check harvesting of records in date windows."""
+    from invenio_oaiharvester.utils import get_oaiharvest_object
+
+    windows = []
+
+    def baz(request, records, name):
+        windows.append(len(records))
+
+    responses.add(
+        responses.GET,
+        re.compile(r'https?://export.arxiv.org/oai2.*set=physics.*'),
+        body=sample_list_xml,
+        content_type='text/xml'
+    )
+    oaiharvest_finished.connect(baz)
+    try:
+        with app.app_context():
+            result = list_records_partitioned(
+                from_date='2015-01-15',
+                until_date='2015-01-20',
+                name=sample_config,
+                windows=3
+            )
+            assert result.get() == 450
+            assert windows == [150, 150, 150]
+            assert len(responses.calls) == 3
+            assert 'from=2015-01-17' in responses.calls[1].request.url
+            assert 'until=2015-01-18' in responses.calls[1].request.url
+            assert get_oaiharvest_object(sample_config).lastrun.year == 1900
+
+            result = list_records_partitioned(name=sample_config, windows=2)
+            assert result.get() == 300
+            assert get_oaiharvest_object(sample_config).lastrun.year > 1900
+    finally:
+        oaiharvest_finished.disconnect(baz)
+
+
+@responses.activate
+def test_list_identifiers_from_dates(app, oai_list_response, tmpdir):
+    """Check that the identifiers are written to a file."""
+    responses.add(
+        responses.GET,
+        re.compile(r'https?://export.arxiv.org/oai2.*'),
+        body=oai_list_response(['oai:1', 'oai:2'], verb='ListIdentifiers'),
+        content_type='text/xml'
+    )
+    output = tmpdir.join('identifiers.txt')
+    with app.app_context():
+        assert list_identifiers_from_dates.delay(
+            url='http://export.arxiv.org/oai2'
+        ).get() == 2
+        assert list_identifiers_from_dates.delay(
+            url='http://export.arxiv.org/oai2', output=str(output),
+            details=True
+        ).get() == 2
+    assert output.read() == 'oai:1\t2015-01-16\t\noai:2\t2015-01-16\t\n'
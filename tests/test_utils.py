@@ -19,13 +19,20 @@
 
 """Test for utilities used by OAI harvester."""
 
+import datetime
 import os
+import time
 
+import pytest
 from mock import MagicMock, PropertyMock
 
-from invenio_oaiharvester.utils import check_or_create_dir, create_file_name, \
-    get_identifier_names, identifier_extraction_from_string, \
-    record_extraction_from_file, record_extraction_from_string, write_to_dir
+from invenio_oaiharvester.utils import FileAllocator, RecordIndex, \
+    check_or_create_dir, create_file_name, date_windows, \
+    get_identifier_names, header_extraction_from_string, \
+    header_extraction_from_strings, identifier_extraction_from_string, \
+    identifiers_extraction_from_strings, iter_mapped, iter_prefetched, \
+    iter_records_from_file, iter_threaded, record_extraction_from_file, \
+    record_extraction_from_string, scan_headers, write_to_dir
 
 
 def test_identifier_extraction(app):
@@ -52,6 +59,78 @@ def test_identifier_extraction_with_namespace(app):
         assert result == "identifier1"
 
 
+def test_header_extraction(app):
+    """Test extracting header fields with and without a parser."""
+    with app.app_context():
+        record = (
+            '<record xmlns="http://www.openarchives.org/OAI/2.0/">'
+            '<header status="deleted"><identifier>oai:1</identifier>'
+            '<datestamp>2015-01-16</datestamp></header>'
+            '<metadata><identifier>other</identifier></metadata></record>'
+        )
+        expected = ('oai:1', '2015-01-16', 'deleted')
+        assert header_extraction_from_string(record) == expected
+        assert header_extraction_from_string(record.encode('utf-8')) == \
+            expected
+
+        # Entities and CDATA sections are read by lxml.
+        assert header_extraction_from_string(
+            record.replace('oai:1', 'oai:1&amp;2')
+        ) == ('oai:1&2', '2015-01-16', 'deleted')
+        assert header_extraction_from_string(
+            record.replace('oai:1', '<![CDATA[oai:<1>]]>')
+        ) == ('oai:<1>', '2015-01-16', 'deleted')
+
+        prefixed = (
+            '<oai:record xmlns:oai="http://www.openarchives.org/OAI/2.0/">'
+            '<oai:header><oai:identifier>oai:2</oai:identifier>'
+            '<oai:datestamp>2015-01-17</oai:datestamp></oai:header>'
+            '</oai:record>'
+        )
+        assert header_extraction_from_strings([record, prefixed]) == [
+            expected, ('oai:2', '2015-01-17', None)
+        ]
+        assert identifiers_extraction_from_strings([record, prefixed]) == [
+            'oai:1', 'oai:2'
+        ]
+
+        # Headers of another namespace are only read by lxml.
+        other = record.replace('http://www.openarchives.org/OAI/2.0/',
+                               'http://example.org/')
+        assert header_extraction_from_string(other) == (None, None, None)
+        with open(os.path.join(os.path.dirname(__file__), 'data',
+                               'sample_arxiv_response_no_namespace.xml'),
+                  'rb') as f:
+            raw_xml = f.read()
+        assert header_extraction_from_string(raw_xml) == (None, None, None)
+        assert header_extraction_from_string(raw_xml, oai_namespace='') == \
+            ('oai:arXiv.org:0804.2273', '2008-04-16', None)
+
+
+def test_scan_headers():
+    """Test reading the headers of a whole response."""
+    page = (
+        '<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/">'
+        '<ListIdentifiers>'
+        '<header status="deleted"><identifier>oai:1</identifier>'
+        '<datestamp>2015-01-16</datestamp></header>'
+        '<header><identifier>oai:2</identifier>'
+        '<datestamp>2015-01-17</datestamp><setSpec>a&amp;b</setSpec></header>'
+        '</ListIdentifiers></OAI-PMH>'
+    )
+    headers, end = scan_headers(page.encode('utf-8'))
+    assert headers == [('oai:1', '2015-01-16', 'deleted'),
+                       ('oai:2', '2015-01-17', None)]
+    assert page[end:] == '</ListIdentifiers></OAI-PMH>'
+    assert scan_headers(page) == (headers, end)
+
+    # Every header must be readable without a parser.
+    assert scan_headers(page.replace('oai:2', 'oai:&#50;')) is None
+    assert scan_headers(page.replace('<header>', '<header/>')) is None
+    assert scan_headers(page.replace('http://www.openarchives.org/OAI/2.0/',
+                                     'http://example.org/')) is None
+
+
 def test_records_extraction_without_namespace(app):
     """Test extracting records from OAI XML without a namespace."""
     with app.app_context():
@@ -83,6 +162,38 @@ def test_records_extraction_with_namespace_listrecords(app):
         assert len(record_extraction_from_string(raw_xml)) == 2
 
 
+def test_records_extraction_envelope(app):
+    """Test the envelope of the records extracted from OAI XML."""
+    with app.app_context():
+        raw_xml = (
+            '<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/" '
+            'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">\n'
+            '<responseDate>2016-01-18</responseDate>\n'
+            '<request verb="ListRecords">http://example.org</request>\n'
+            '<ListRecords>'
+            '<record><header><identifier>oai:1</identifier></header>'
+            '</record>\n'
+            '<record xsi:type="t"><header><identifier>oai:2</identifier>'
+            '</header></record></ListRecords></OAI-PMH>'
+        )
+        envelope = (
+            b'<OAI-PMH xmlns:OAI-PMH="http://www.openarchives.org/OAI/2.0/">'
+            b'<OAI-PMH:responseDate>2016-01-18</OAI-PMH:responseDate>\n'
+            b'<OAI-PMH:request verb="ListRecords">http://example.org'
+            b'</OAI-PMH:request>\n'
+        )
+        assert record_extraction_from_string(raw_xml) == [
+            envelope + b'<OAI-PMH:record><OAI-PMH:header><OAI-PMH:identifier>'
+            b'oai:1</OAI-PMH:identifier></OAI-PMH:header></OAI-PMH:record>\n'
+            b'</OAI-PMH>',
+            envelope + b'<OAI-PMH:record '
+            b'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+            b'xsi:type="t"><OAI-PMH:header><OAI-PMH:identifier>oai:2'
+            b'</OAI-PMH:identifier></OAI-PMH:header></OAI-PMH:record>'
+            b'</OAI-PMH>',
+        ]
+
+
 def test_records_extraction_from_file(app):
     """Test extracting records from OAI XML."""
     with app.app_context():
@@ -93,6 +204,35 @@ def test_records_extraction_from_file(app):
         assert len(record_extraction_from_file(path_tmp)) == 1
 
 
+def test_iter_records_from_file(app, tmpdir):
+    """Test streaming records from OAI XML files."""
+    with app.app_context():
+        for name in ("sample_arxiv_response_with_namespace.xml",
+                     "sample_inspire_response_listrecords.xml",
+                     "sample_arxiv_response_listrecords_cs.xml"):
+            path_tmp = os.path.join(os.path.dirname(__file__), "data", name)
+            with open(path_tmp, 'rb') as f:
+                expected = record_extraction_from_string(f.read())
+            assert list(iter_records_from_file(path_tmp)) == expected
+
+        path_tmp = os.path.join(
+            os.path.dirname(__file__),
+            "data/sample_arxiv_response_no_namespace.xml"
+        )
+        assert len(list(iter_records_from_file(path_tmp, ""))) == 1
+
+        # Files created by write_to_dir
+        mock_record = MagicMock()
+        type(mock_record).raw = PropertyMock(return_value=(
+            '<record xmlns="http://www.openarchives.org/OAI/2.0/"><header>'
+            '<identifier>oai:1</identifier></header></record>'
+        ))
+        files, _ = write_to_dir([mock_record] * 3, tmpdir.dirname)
+        records = list(iter_records_from_file(files[0]))
+        assert len(records) == 3
+        assert identifier_extraction_from_string(records[0]) == 'oai:1'
+
+
 def test_identifier_filter():
     """oaiharvest - testing identifier filter."""
     sample = "oai:mysite.com:1234"
@@ -148,6 +288,264 @@ def test_write_to_dir(app, tmpdir):
         assert total == 0
 
 
+@pytest.mark.parametrize('compression', [None, 'gzip', 'zstd'])
+def test_write_to_dir_compressed(app, tmpdir, compression):
+    """oaiharvest - testing compressed and size bounded output."""
+    if compression == 'zstd':
+        pytest.importorskip('zstandard')
+    records = []
+    for index in range(10):
+        record = MagicMock()
+        type(record).raw = PropertyMock(return_value=(
+            '<record xmlns="http://www.openarchives.org/OAI/2.0/"><header>'
+            '<identifier>oai:{0}</identifier></header></record>'.format(index)
+        ))
+        records.append(record)
+    size = len(records[0].raw)
+    with app.app_context():
+        files, total = write_to_dir(
+            records, tmpdir.dirname, compression=compression,
+            max_bytes=3 * size + len('<ListRecords></ListRecords>')
+        )
+        assert total == 10
+        assert len(files) == 4
+        suffix = {None: '.xml', 'gzip': '.xml.gz', 'zstd': '.xml.zst'}
+        assert all(f.endswith(suffix[compression]) for f in files)
+        identifiers = [identifier_extraction_from_string(record)
+                       for f in files for record in iter_records_from_file(f)]
+        assert identifiers == ['oai:{0}'.format(i) for i in range(10)]
+
+        # Files hold one record at least
+        files, total = write_to_dir(records[:2], tmpdir.dirname, max_bytes=1)
+        assert (len(files), total) == (2, 2)
+
+
+@pytest.mark.parametrize('compression', [None, 'gzip'])
+def test_write_to_dir_manifest(app, tmpdir, compression):
+    """oaiharvest - testing the manifest and index of the output."""
+    import hashlib
+    import json
+
+    records = []
+    for index in range(5):
+        record = MagicMock()
+        type(record).raw = PropertyMock(return_value=(
+            '<record><header><identifier>oai:{0}</identifier>'
+            '</header></record>'.format(index)
+        ))
+        record.header.identifier = 'oai:{0}'.format(index)
+        records.append(record)
+    with app.app_context():
+        files, total = write_to_dir(records, tmpdir.strpath, max_records=2,
+                                    compression=compression,
+                                    manifest='manifest.json', run_id='run',
+                                    files_per_directory=2)
+        # Another run of the same day has its own manifest and index.
+        write_to_dir(records[:1], tmpdir.strpath, compression=compression,
+                     manifest='manifest.json', run_id='other',
+                     files_per_directory=2)
+        # Nothing is written for an empty stream of records.
+        assert write_to_dir(iter([]), tmpdir.join('empty').strpath,
+                            manifest='manifest.json') == ([], 0)
+        assert tmpdir.join('empty').listdir() == []
+    date_directory = os.path.dirname(os.path.dirname(files[0]))
+    manifest_path = os.path.join(date_directory, 'run-manifest.json')
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    assert manifest['records'] == total == 5
+    assert [entry['path'] for entry in manifest['files']] == \
+        [os.path.relpath(path, date_directory) for path in files]
+    assert [entry['records'] for entry in manifest['files']] == [2, 2, 1]
+    for entry, path in zip(manifest['files'], files):
+        with open(path, 'rb') as f:
+            content = f.read()
+        assert entry['bytes'] == len(content)
+        assert entry['sha256'] == hashlib.sha256(content).hexdigest()
+
+    for use_mmap in (False, True):
+        with RecordIndex(manifest_path, use_mmap=use_mmap) as index:
+            assert len(index) == 5
+            assert 'oai:3' in index
+            assert index.get('oai:3') == records[3].raw.encode('utf-8')
+            assert index.get('oai:0') == records[0].raw.encode('utf-8')
+            assert index.get('oai:missing') is None
+
+
+def test_file_allocator(app, tmpdir):
+    """oaiharvest - testing the names of the files written."""
+    allocate = FileAllocator(tmpdir.strpath, run_id='run', suffix='.xml.gz',
+                             files_per_directory=2,
+                             date=datetime.date(2016, 1, 18))
+    paths = [allocate() for _ in range(5)]
+    assert [os.path.relpath(path, tmpdir.strpath) for path in paths] == [
+        os.path.join('2016-01-18', '0000', 'run-000000.xml.gz'),
+        os.path.join('2016-01-18', '0000', 'run-000001.xml.gz'),
+        os.path.join('2016-01-18', '0001', 'run-000002.xml.gz'),
+        os.path.join('2016-01-18', '0001', 'run-000003.xml.gz'),
+        os.path.join('2016-01-18', '0002', 'run-000004.xml.gz'),
+    ]
+    assert all(os.path.isdir(os.path.dirname(path)) for path in paths)
+
+    mock_record = MagicMock()
+    type(mock_record).raw = PropertyMock(return_value='<record/>')
+    with app.app_context():
+        files, _ = write_to_dir([mock_record] * 3, tmpdir.strpath,
+                                max_records=1, name='arXiv', run_id='run')
+        assert [os.path.basename(path) for path in files] == [
+            'run-000000.xml', 'run-000001.xml', 'run-000002.xml'
+        ]
+        assert os.path.relpath(files[0], tmpdir.strpath).startswith(
+            os.path.join('arXiv', datetime.date.today().isoformat())
+        )
+        # Existing files are never overwritten.
+        with pytest.raises(OSError):
+            write_to_dir([mock_record], tmpdir.strpath, name='arXiv',
+                         run_id='run')
+
+
+def test_iter_mapped():
+    """oaiharvest - testing ordered map in a pool of threads."""
+    def slow_square(value):
+        time.sleep(0.01 * (value % 3))
+        return value * value
+
+    expected = [value * value for value in range(20)]
+    assert list(iter_mapped(slow_square, range(20))) == expected
+    assert list(iter_mapped(slow_square, range(20), workers=4)) == expected
+
+    # Items are consumed as the results are
+    consumed = []
+
+    def items():
+        for value in range(100):
+            consumed.append(value)
+            yield value
+
+    results = iter_mapped(slow_square, items(), workers=2)
+    assert next(results) == 0
+    assert len(consumed) <= 5
+    results.close()
+
+    def fail(value):
+        raise ValueError(value)
+
+    with pytest.raises(ValueError):
+        list(iter_mapped(fail, range(5), workers=2))
+
+
+@pytest.mark.parametrize('compression', [None, 'gzip'])
+def test_write_to_dir_concurrently(app, tmpdir, compression):
+    """oaiharvest - testing files written by a pool of threads."""
+    records = []
+    for index in range(50):
+        record = MagicMock()
+        type(record).raw = PropertyMock(return_value=(
+            '<record><header><identifier>oai:{0}</identifier>'
+            '</header></record>'.format(index)
+        ))
+        record.header.identifier = 'oai:{0}'.format(index)
+        records.append(record)
+
+    def contents(files):
+        result = []
+        for path in files:
+            with open(path, 'rb') as f:
+                result.append((os.path.basename(path), f.read()))
+        return result
+
+    with app.app_context():
+        serial = write_to_dir(records, tmpdir.join('serial').strpath,
+                              max_records=3, compression=compression,
+                              run_id='run', manifest='manifest.json',
+                              workers=1)
+        threaded = write_to_dir(records, tmpdir.join('threaded').strpath,
+                                max_records=3, compression=compression,
+                                run_id='run', manifest='manifest.json',
+                                workers=4)
+    assert serial[1] == threaded[1] == 50
+    assert len(serial[0]) == len(threaded[0]) == 17
+    if compression is None:
+        assert contents(serial[0]) == contents(threaded[0])
+    else:
+        with app.app_context():
+            assert [len(list(iter_records_from_file(path, '')))
+                    for path in threaded[0]] == [3] * 16 + [2]
+    manifest = os.path.join(os.path.dirname(os.path.dirname(threaded[0][0])),
+                            'run-manifest.json')
+    with RecordIndex(manifest) as index:
+        assert len(index) == 50
+        assert index.get('oai:42') == records[42].raw.encode('utf-8')
+
+
 def test_create_file_name(tmpdir):
     """oaiharvest - testing dir creation."""
     create_file_name(tmpdir.dirname + 'foo')
+
+
+def test_iter_threaded():
+    """oaiharvest - testing threaded merge of iterables."""
+    iterables = [range(0, 10), range(10, 20), range(20, 30)]
+    assert sorted(iter_threaded(iterables, workers=2)) == list(range(30))
+    assert list(iter_threaded([range(3)], workers=4)) == [0, 1, 2]
+
+    def failing():
+        yield 1
+        raise ValueError()
+
+    with pytest.raises(ValueError):
+        list(iter_threaded([failing(), range(5)], workers=2))
+
+    items = iter_threaded([iter(range(1000))], maxsize=1)
+    assert next(items) == 0
+    items.close()
+
+
+def test_date_windows():
+    """oaiharvest - testing date windows."""
+    assert date_windows('2015-01-01', '2015-01-10', 2) == [
+        ('2015-01-01', '2015-01-05'), ('2015-01-06', '2015-01-10')
+    ]
+    assert date_windows('2015-01-01', '2015-01-10', 3) == [
+        ('2015-01-01', '2015-01-03'), ('2015-01-04', '2015-01-06'),
+        ('2015-01-07', '2015-01-10')
+    ]
+    assert date_windows('2015-01-01', '2015-01-02', 5) == [
+        ('2015-01-01', '2015-01-01'), ('2015-01-02', '2015-01-02')
+    ]
+    assert date_windows('2015-01-01T10:00:00Z', '2015-01-01', 0) == [
+        ('2015-01-01', '2015-01-01')
+    ]
+
+
+def test_iter_prefetched():
+    """oaiharvest - testing prefetching of iterables."""
+    assert list(iter_prefetched(range(100), depth=3)) == list(range(100))
+    assert list(iter_prefetched([], depth=3)) == []
+
+    produced = []
+
+    def slow():
+        for i in range(10):
+            time.sleep(0.01)
+            produced.append(i)
+            yield i
+
+    items = iter_prefetched(slow(), depth=4)
+    assert next(items) == 0
+    time.sleep(0.05)
+    # The producer ran ahead while the caller was busy.
+    assert len(produced) > 1
+    assert list(items) == list(range(1, 10))
+
+    def failing():
+        yield 1
+        raise ValueError()
+
+    items = iter_prefetched(failing())
+    assert next(items) == 1
+    with pytest.raises(ValueError):
+        next(items)
+
+    items = iter_prefetched(iter(range(1000)))
+    assert next(items) == 0
+    items.close()